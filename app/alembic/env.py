@@ -22,6 +22,13 @@ from models.database import Base
 from models import products, users  # Ensure all models are loaded
 target_metadata = Base.metadata
 
+# Search column and indexes are managed by hand in the add_product_search migration
+SEARCH_OBJECTS = {"search_vector", "ix_products_search_vector", "ix_products_name_trgm"}
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    return name not in SEARCH_OBJECTS
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -44,6 +51,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -67,7 +75,7 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, include_object=include_object
         )
 
         with context.begin_transaction():
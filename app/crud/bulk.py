@@ -0,0 +1,259 @@
+import io
+import os
+import csv
+import orjson
+from itertools import islice
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy import select, update, values, column, bindparam, cast, func, or_, Integer, Float, Boolean
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.database import SessionLocal
+from models.products import Product
+from schemas.products import ProductActionBase, ProductBase, BulkProductPatchBase
+from .products import invalidate_catalog, refresh_product_categories
+from .file_upload import MB
+from .utils import dialect_insert
+
+
+# Rows upserted per transaction during an import, and rows fetched per round trip during an export
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", 500))
+EXPORT_COLUMNS = list(ProductBase.model_fields)
+# Largest import file, well above the image limit since catalogs are streamed rather than held in memory
+BULK_IMPORT_MAX_SIZE = int(os.environ.get("BULK_IMPORT_MAX_SIZE_MB", 500)) * MB
+# Fields a bulk patch may change, left untouched when an item omits them
+PATCH_COLUMNS = {"sale_price": Float, "original_price": Float, "in_stock": Integer, "is_available": Boolean}
+
+
+def detect_format(upload: UploadFile, format: str = None):
+    if format:
+        return format
+    filename = (upload.filename or "").lower()
+    if filename.endswith((".ndjson", ".jsonl")) or upload.content_type in ("application/x-ndjson", "application/jsonl"):
+        return "ndjson"
+    return "csv"
+
+
+def read_rows(upload: UploadFile, format: str):
+    """Lazily parse the spooled upload, one dict per line, so the whole file is never held in memory."""
+    text = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+    if format == "ndjson":
+        # Parsed in validate_rows so one bad line only fails that row
+        return (line for line in text if line.strip())
+    # Empty CSV cells mean "not given", not an empty string
+    return ({key: value for key, value in row.items() if value != ""} for row in csv.DictReader(text))
+
+
+def validate_rows(rows, start: int):
+    valid, errors = [], []
+    for number, row in enumerate(rows, start=start):
+        try:
+            if isinstance(row, str):
+                row = orjson.loads(row)
+            product = ProductActionBase.model_validate(row)
+        except (ValidationError, orjson.JSONDecodeError, TypeError) as e:
+            errors.append({"row": number, "error": str(e)})
+            continue
+
+        if not product.slug:
+            errors.append({"row": number, "error": "slug is required"})
+            continue
+        valid.append((number, product.model_dump(exclude_unset=True)))
+    return valid, errors
+
+
+def dedupe_rows(rows: list):
+    """Keep the last row of every slug, the earlier ones are reported instead of silently dropped."""
+    by_slug, errors = {}, []
+    for number, values in rows:
+        previous = by_slug.get(values["slug"])
+        if previous:
+            errors.append({"row": previous[0], "error": f"Superseded by row {number} with the same slug"})
+        by_slug[values["slug"]] = (number, values)
+    return list(by_slug.values()), errors
+
+
+# Insert or update one batch of rows by slug in a single transaction, slugs must be unique within the batch
+async def upsert_products_batch(db: AsyncSession, rows: list):
+    by_slug = {values["slug"]: values for _, values in rows}
+
+    existing = {}
+    result = await db.execute(select(Product.id, Product.slug, Product.category).where(Product.slug.in_(by_slug)))
+    for row in result:
+        existing[row.slug] = row
+
+    # One INSERT ... ON CONFLICT (slug) per set of given fields, an update only changes the fields its row has.
+    # A product another import creates meanwhile is updated instead of duplicated
+    groups = {}
+    for values in by_slug.values():
+        groups.setdefault(tuple(sorted(values)), []).append(values)
+    for fields, group in groups.items():
+        upsert = dialect_insert(db, Product).values(group)
+        updates = {name: upsert.excluded[name] for name in fields if name != "slug"}
+        if updates:
+            await db.execute(upsert.on_conflict_do_update(index_elements=["slug"], set_=updates))
+        else:
+            await db.execute(upsert.on_conflict_do_nothing(index_elements=["slug"]))
+
+    categories = {values.get("category") for values in by_slug.values()}
+    categories |= {row.category for row in existing.values()}
+    await refresh_product_categories(db, *categories)
+    await db.commit()
+    return len(by_slug) - len(existing), len(existing)
+
+
+async def import_products_view(db: AsyncSession, upload: UploadFile, format: str = None):
+    format = detect_format(upload, format)
+    rows = read_rows(upload, format)
+    report = {"created": 0, "updated": 0, "errors": []}
+
+    # Header is line 1 of a CSV, data starts on line 2
+    number = 2 if format == "csv" else 1
+    while True:
+        try:
+            batch = await run_in_threadpool(list, islice(rows, BULK_BATCH_SIZE))
+        except (csv.Error, UnicodeDecodeError) as e:
+            report["errors"].append({"row": number, "error": f"Unreadable file: {e}"})
+            break
+        if not batch:
+            break
+
+        valid, errors = validate_rows(batch, number)
+        valid, superseded = dedupe_rows(valid)
+        report["errors"].extend(errors + superseded)
+        number += len(batch)
+        if not valid:
+            continue
+
+        try:
+            created, updated = await upsert_products_batch(db, valid)
+            report["created"] += created
+            report["updated"] += updated
+        except Exception as e:
+            await db.rollback()
+            report["errors"].extend({"row": row, "error": str(e)} for row, _ in valid)
+
+    if report["created"] or report["updated"]:
+        await invalidate_catalog()
+    return report
+
+
+# Apply one chunk of patches with a single UPDATE ... FROM (VALUES ...) on Postgres, executemany elsewhere
+async def patch_products_chunk(db: AsyncSession, patches: dict):
+    rows = [{"id": product_id, **{name: patch.get(name) for name in PATCH_COLUMNS}} for product_id, patch in patches.items()]
+
+    if db.get_bind().dialect.name == "postgresql":
+        patch_values = values(
+            column("id", Integer), *[column(name, type_) for name, type_ in PATCH_COLUMNS.items()], name="patch"
+        ).data([tuple(row.values()) for row in rows])
+        # Casts keep all-NULL columns of the VALUES list typed
+        await db.execute(
+            update(Product.__table__)
+            .where(Product.id == cast(patch_values.c.id, Integer))
+            .values({
+                name: func.coalesce(cast(patch_values.c[name], type_), getattr(Product, name))
+                for name, type_ in PATCH_COLUMNS.items()
+            })
+        )
+        return
+
+    await db.execute(
+        update(Product.__table__)
+        .where(Product.id == bindparam("patch_id"))
+        .values({name: func.coalesce(bindparam(f"patch_{name}", type_=type_), getattr(Product, name)) for name, type_ in PATCH_COLUMNS.items()}),
+        [{f"patch_{name}": value for name, value in row.items()} for row in rows],
+    )
+
+
+async def bulk_patch_products_view(db: AsyncSession, items: list[BulkProductPatchBase]):
+    results = [{"index": index, "id": item.id, "slug": item.slug, "status": "pending"} for index, item in enumerate(items)]
+    updated = 0
+
+    for start in range(0, len(items), BULK_BATCH_SIZE):
+        chunk = list(enumerate(items[start:start + BULK_BATCH_SIZE], start=start))
+
+        ids = {item.id for _, item in chunk if item.id is not None}
+        slugs = {item.slug for _, item in chunk if item.id is None and item.slug}
+        found = (await db.execute(
+            select(Product.id, Product.slug, Product.category)
+            .where(or_(Product.id.in_(ids), Product.slug.in_(slugs)))
+            .order_by(Product.id.desc())
+        )).all()
+        by_id = {row.id: row for row in found}
+        by_slug = {row.slug: row for row in found if row.slug in slugs}
+
+        # Later items for the same product override the fields of earlier ones
+        patches, categories = {}, set()
+        for index, item in chunk:
+            product = by_id.get(item.id) if item.id is not None else by_slug.get(item.slug)
+            if item.id is None and not item.slug:
+                results[index].update(status="error", error="id or slug is required")
+                continue
+            if not product:
+                results[index].update(status="not_found")
+                continue
+
+            results[index]["id"] = product.id
+            patches.setdefault(product.id, {}).update(item.model_dump(include=set(PATCH_COLUMNS), exclude_none=True))
+            categories.add(product.category)
+
+        if not patches:
+            continue
+
+        try:
+            await patch_products_chunk(db, patches)
+            await refresh_product_categories(db, *categories)
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            for index, _ in chunk:
+                if results[index]["status"] == "pending":
+                    results[index].update(status="error", error=str(e))
+            continue
+
+        for index, _ in chunk:
+            if results[index]["status"] == "pending":
+                results[index]["status"] = "updated"
+                updated += 1
+
+    if updated:
+        await invalidate_catalog()
+    return {"updated": updated, "results": results}
+
+
+def encode_export_row(values: dict, format: str, writer, buffer: io.StringIO):
+    if format == "ndjson":
+        return orjson.dumps(values) + b"\n"
+
+    writer.writerow(values)
+    line = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return line.encode()
+
+
+async def export_products(format: str = "csv"):
+    """Yield the catalog in id order with a server side cursor, one batch in memory at a time.
+
+    Runs on its own session because the response body is sent after the
+    request's dependencies have been closed.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    if format == "csv":
+        writer.writeheader()
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+    async with SessionLocal() as db:
+        db.info["use_replica"] = True
+        # Plain column rows, no ORM objects piling up in the session
+        result = await db.stream(
+            select(*[getattr(Product, column) for column in EXPORT_COLUMNS])
+            .order_by(Product.id)
+            .execution_options(yield_per=BULK_BATCH_SIZE)
+        )
+        async for rows in result.mappings().partitions():
+            yield b"".join(encode_export_row(dict(row), format, writer, buffer) for row in rows)
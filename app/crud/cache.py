@@ -0,0 +1,74 @@
+import os
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+
+load_dotenv()
+
+REDIS_URL = os.environ.get("REDIS_URL")
+# memory, redis or fakeredis (redis code path backed by an in-process store, for tests)
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "redis" if REDIS_URL else "memory")
+
+MISSING = object()
+
+
+class LRUTTLCache:
+    """Small in-process cache, entries expire after `ttl` seconds and the least recently used go first."""
+
+    def __init__(self, maxsize: int = 512, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return MISSING
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, value, ttl: float = None):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        value = self.get(key)
+        self._data.pop(key, None)
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0,
+        }
+
+
+# Product listings, details and categories, cleared on every product or product image write.
+# Only the worker that wrote can clear it, so it is switched off when responses are cached in a shared backend
+catalog_cache = LRUTTLCache(
+    maxsize=int(os.environ.get("CATALOG_CACHE_SIZE", 512)) if CACHE_BACKEND == "memory" else 0,
+    ttl=float(os.environ.get("CATALOG_CACHE_TTL", 60)),
+)
@@ -0,0 +1,202 @@
+import os
+import uuid
+import logging
+import orjson
+from itsdangerous import URLSafeSerializer, BadSignature
+from sqlalchemy import select, delete, case
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.products import Cart, Product, ProductCartAssociation
+from .auth import SECRET_KEY
+from .image_variants import variant_url
+from .response_cache import invalidate_tags, create_backend, MemoryBackend
+from .utils import dialect_insert
+
+
+# Seconds a rendered cart stays cached, every cart write invalidates it straight away
+CART_CACHE_TTL = int(os.environ.get("CART_CACHE_TTL", 300))
+# Seconds a guest cart is kept after its last change
+GUEST_CART_TTL = int(os.environ.get("GUEST_CART_TTL", 7 * 24 * 3600))
+GUEST_CART_MAX_ITEMS = int(os.environ.get("GUEST_CART_MAX_ITEMS", 100))
+# Most of one product a cart line holds, larger quantities are cut down to it
+CART_MAX_QUANTITY = int(os.environ.get("CART_MAX_QUANTITY", 99))
+# Guest carts the in-memory backend keeps per worker, the least recently used go first
+GUEST_CART_STORE_SIZE = int(os.environ.get("GUEST_CART_STORE_SIZE", 10000))
+
+logger = logging.getLogger(__name__)
+
+CART_PRODUCT_COLUMNS = (
+    Product.id, Product.name, Product.sale_price, Product.original_price, Product.slug, Product.in_stock,
+    Product.unit, Product.description, Product.quantity, Product.cover_image_url, Product.cover_variants_ready,
+)
+
+
+def clamp_quantity(quantity: int | None):
+    return min(max(quantity or 1, 1), CART_MAX_QUANTITY)
+
+
+def cart_tag(user_id: int):
+    return f"cart:{user_id}"
+
+
+async def invalidate_cart(*user_ids):
+    await invalidate_tags(*(cart_tag(user_id) for user_id in user_ids))
+
+
+def render_cart(cart_id: int, rows):
+    products = []
+    for row in rows:
+        cart_quantity = row.cart_quantity or 1
+        products.append({
+            "id": row.id,
+            "name": row.name,
+            "sale_price": row.sale_price,
+            "original_price": row.original_price,
+            "slug": row.slug,
+            "in_stock": row.in_stock,
+            "unit": row.unit,
+            "description": row.description,
+            "quantity": row.quantity,
+            "cart_quantity": cart_quantity,
+            "line_total": round((row.sale_price or 0) * cart_quantity, 2),
+            "image": variant_url(row.cover_image_url, "thumb", row.cover_variants_ready),
+            "image_webp": variant_url(row.cover_image_url, "thumb", row.cover_variants_ready, "webp"),
+        })
+
+    return {
+        "cart_id": cart_id,
+        "products": products,
+        "items_count": len(products),
+        "total_quantity": sum(product["cart_quantity"] for product in products),
+        "subtotal": round(sum(product["line_total"] for product in products), 2),
+    }
+
+
+async def load_cart(db: AsyncSession, user_id: int):
+    """The user's cart with each product, its quantity and line total from one query, None when there is no cart."""
+    rows = (await db.execute(
+        select(Cart.id.label("cart_id"), ProductCartAssociation.quantity.label("cart_quantity"), *CART_PRODUCT_COLUMNS)
+        .select_from(Cart)
+        .outerjoin(ProductCartAssociation, ProductCartAssociation.cart_id == Cart.id)
+        .outerjoin(Product, Product.id == ProductCartAssociation.product_id)
+        .where(Cart.user_id == user_id)
+        .order_by(Product.id)
+    )).all()
+    if not rows:
+        return None
+    return render_cart(rows[0].cart_id, [row for row in rows if row.id is not None])
+
+
+async def get_or_create_cart_id(db: AsyncSession, user_id: int):
+    """Id of the user's cart, created by the same statement on a first visit.
+
+    The insert returns nothing when the cart already exists, also when a concurrent
+    request created it first, so only that case needs a second query.
+    """
+    cart_id = await db.scalar(
+        dialect_insert(db, Cart).values(user_id=user_id).on_conflict_do_nothing(index_elements=["user_id"]).returning(Cart.id)
+    )
+    if cart_id is None:
+        cart_id = await db.scalar(select(Cart.id).where(Cart.user_id == user_id))
+    return cart_id
+
+
+async def upsert_cart_items(db: AsyncSession, cart_id: int, quantities: dict, add: bool = False):
+    """Write {product_id: quantity} into the cart with one INSERT ... ON CONFLICT DO UPDATE.
+
+    Existing lines take the new quantity, or have it added to theirs when `add` is set.
+    """
+    if not quantities:
+        return
+    insert = dialect_insert(db, ProductCartAssociation).values([
+        {"cart_id": cart_id, "product_id": product_id, "quantity": quantity} for product_id, quantity in quantities.items()
+    ])
+    quantity = insert.excluded.quantity
+    if add:
+        added = ProductCartAssociation.quantity + insert.excluded.quantity
+        quantity = case((added > CART_MAX_QUANTITY, CART_MAX_QUANTITY), else_=added)
+    await db.execute(insert.on_conflict_do_update(index_elements=["product_id", "cart_id"], set_={"quantity": quantity}))
+
+
+async def replace_cart_items(db: AsyncSession, cart_id: int, quantities: dict):
+    """Make the cart hold exactly {product_id: quantity}, one upsert and one set-based delete."""
+    await upsert_cart_items(db, cart_id, quantities)
+    await db.execute(
+        delete(ProductCartAssociation).where(
+            ProductCartAssociation.cart_id == cart_id,
+            ProductCartAssociation.product_id.not_in(quantities),
+        )
+    )
+
+
+# Guest carts live in the cache backend, never in the database. Only redis shares them between
+# workers, with the memory backend a guest has to keep reaching the same worker or the cart is lost
+guest_carts = create_backend(maxsize=GUEST_CART_STORE_SIZE)
+if isinstance(guest_carts, MemoryBackend):
+    logger.warning("Guest carts are kept per worker, set REDIS_URL when running more than one")
+cart_tokens = URLSafeSerializer(SECRET_KEY, salt="guest-cart")
+
+
+def new_cart_token():
+    return cart_tokens.dumps(uuid.uuid4().hex)
+
+
+def guest_cart_key(token: str | None):
+    """Store key of a cart token, None when the token is missing or was not signed by us."""
+    if not token:
+        return None
+    try:
+        return f"guest-cart:{cart_tokens.loads(token)}"
+    except BadSignature:
+        return None
+
+
+def parse_guest_items(payload: bytes | None):
+    if not payload:
+        return {}
+    return {int(product_id): quantity for product_id, quantity in orjson.loads(payload).items()}
+
+
+async def get_guest_items(token: str | None):
+    key = guest_cart_key(token)
+    return parse_guest_items(await guest_carts.get(key)) if key else {}
+
+
+async def save_guest_items(token: str, items: dict):
+    await guest_carts.set(guest_cart_key(token), orjson.dumps(items, option=orjson.OPT_NON_STR_KEYS), GUEST_CART_TTL)
+
+
+async def load_guest_cart(db: AsyncSession, items: dict):
+    """Render guest cart items like load_cart does, products that no longer exist are left out."""
+    if not items:
+        return render_cart(None, [])
+    rows = (await db.execute(
+        select(case(items, value=Product.id).label("cart_quantity"), *CART_PRODUCT_COLUMNS)
+        .where(Product.id.in_(items))
+        .order_by(Product.id)
+    )).all()
+    return render_cart(None, rows)
+
+
+async def merge_guest_cart(db: AsyncSession, user_id: int, token: str | None):
+    """Move a guest cart into the user's cart in one transaction, quantities of products in both are added up."""
+    key = guest_cart_key(token)
+    if not key:
+        return
+    # Taken out of the store first, logging in twice with one token can not merge it twice
+    payload = await guest_carts.pop(key)
+    items = parse_guest_items(payload)
+    if not items:
+        return
+
+    try:
+        product_ids = set((await db.scalars(select(Product.id).where(Product.id.in_(items)))).all())
+        cart_id = await get_or_create_cart_id(db, user_id)
+        await upsert_cart_items(db, cart_id, {product_id: quantity for product_id, quantity in items.items() if product_id in product_ids}, add=True)
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        # Keep the guest cart for the next login
+        await guest_carts.set(key, payload, GUEST_CART_TTL)
+        raise
+    await invalidate_cart(user_id)
@@ -1,37 +1,399 @@
+import io
 import os
+import re
+import base64
+import hashlib
+import time
+import shutil
+import asyncio
+import logging
+import functools
+import tempfile
+import threading
+import multiprocessing
 import boto3
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from boto3.s3.transfer import TransferConfig
 from dotenv import load_dotenv
 
-from fastapi import HTTPException
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+
+from .image_variants import render_variants, variant_name
 
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
 
 access_key = os.environ.get("ACCESS_KEY")
 bucket_name = os.environ.get("BUCKET_NAME")
 secret_key = os.environ.get("SECRET_KEY")
 aws_url = os.environ.get("AWS_URL")
+# Set to point the client at an S3 compatible server (MinIO, moto) instead of AWS
+endpoint_url = os.environ.get("AWS_ENDPOINT_URL") or None
+
+# Connections the shared client keeps open, should cover upload workers x multipart concurrency
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get("S3_MAX_POOL_CONNECTIONS", 32))
+# Uploads running at once, further uploads queue instead of blocking the event loop
+S3_UPLOAD_WORKERS = int(os.environ.get("S3_UPLOAD_WORKERS", 8))
+S3_MULTIPART_THRESHOLD = int(os.environ.get("S3_MULTIPART_THRESHOLD_MB", 8)) * MB
+S3_MULTIPART_CHUNKSIZE = int(os.environ.get("S3_MULTIPART_CHUNKSIZE_MB", 8)) * MB
+S3_MAX_CONCURRENCY = int(os.environ.get("S3_MAX_CONCURRENCY", 4))
+# Processes resizing images into variants, kept small so they never starve the web workers
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", 2))
+# Largest image accepted by the upload views
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE_MB", 10)) * MB
+# Seconds a presigned upload URL stays valid
+S3_PRESIGN_EXPIRES = int(os.environ.get("S3_PRESIGN_EXPIRES", 900))
+# Most keys one DeleteObjects request accepts
+S3_DELETE_BATCH = 1000
+
+# Leading bytes of the image formats we accept, the client sent content type is not trusted
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+IMAGE_EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/gif": "gif", "image/webp": "webp"}
+IMAGE_TYPES = set(IMAGE_EXTENSIONS)
+
+CONTENT_PREFIX = "media/sha256/"
+CONTENT_KEY = re.compile(rf"{CONTENT_PREFIX}[0-9a-f]{{64}}\.({'|'.join(IMAGE_EXTENSIONS.values())})")
+
+
+def sniff_image_type(file):
+    header = file.read(16)
+    file.seek(0)
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, content_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return content_type
+    return None
+
+
+def get_upload_size(image: UploadFile):
+    if image.size is not None:
+        return image.size
+    size = image.file.seek(0, os.SEEK_END)
+    image.file.seek(0)
+    return size
+
+
+# Reject oversized or non image uploads before they are sent anywhere
+def check_image_upload(image: UploadFile):
+    if get_upload_size(image) > MAX_UPLOAD_SIZE:
+        return JSONResponse({"detail": f"File is larger than {MAX_UPLOAD_SIZE // MB}MB"}, status_code=413)
+    if sniff_image_type(image.file) is None:
+        return JSONResponse({"detail": "Only JPEG, PNG, GIF and WebP images are allowed"}, status_code=415)
+    return None
+
+
+def hash_file(file):
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(MB), b""):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+# Images are stored under the hash of their bytes, the same photo uploaded twice is one object
+def content_key(digest: str, content_type: str):
+    return f"{CONTENT_PREFIX}{digest}.{IMAGE_EXTENSIONS[content_type]}"
+
+
+# Check an object uploaded with a presigned URL the way check_image_upload checks a proxied one
+async def check_stored_image(key: str):
+    if not CONTENT_KEY.fullmatch(key):
+        return JSONResponse({"detail": "Invalid upload key"}, status_code=400)
+
+    size, content_type = await storage.inspect(key)
+    if size is None:
+        return JSONResponse({"detail": "Uploaded file not found"}, status_code=404)
+    if size > MAX_UPLOAD_SIZE:
+        await storage.delete(key)
+        return JSONResponse({"detail": f"File is larger than {MAX_UPLOAD_SIZE // MB}MB"}, status_code=413)
+    if content_type is None:
+        await storage.delete(key)
+        return JSONResponse({"detail": "Only JPEG, PNG, GIF and WebP images are allowed"}, status_code=415)
+    return None
+
+
+class UploadMetrics:
+    def __init__(self, samples: int = 1000):
+        self.uploads = 0
+        self.failures = 0
+        self.bytes = 0
+        self.in_flight = 0
+        self.durations = deque(maxlen=samples)
+
+    def record(self, seconds: float, size: int, failed: bool = False):
+        self.durations.append(seconds * 1000)
+        if failed:
+            self.failures += 1
+            return
+        self.uploads += 1
+        self.bytes += size
+
+    def percentiles(self):
+        durations = sorted(self.durations)
+        if not durations:
+            return {"p50": 0, "p90": 0, "p99": 0, "max": 0}
+
+        def pick(percent):
+            return round(durations[min(len(durations) - 1, int(len(durations) * percent / 100))], 3)
+
+        return {"p50": pick(50), "p90": pick(90), "p99": pick(99), "max": round(durations[-1], 3)}
+
+
+class KeepOpenFile:
+    """boto3 closes the file it uploads, the upload views still read it afterwards for the variants."""
+
+    def __init__(self, file):
+        self._file = file
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def close(self):
+        pass
+
+
+class StorageService:
+    """One long lived S3 client shared by every upload, transfers run on a bounded thread pool."""
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=S3_UPLOAD_WORKERS, thread_name_prefix="s3-upload")
+        self.transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=S3_MAX_CONCURRENCY,
+        )
+        self.metrics = UploadMetrics()
+
+    @property
+    def client(self):
+        # Client creation is not thread safe, using the client afterwards is
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = boto3.client(
+                        's3', aws_access_key_id=access_key, aws_secret_access_key=secret_key, endpoint_url=endpoint_url,
+                        config=Config(
+                            max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                            retries={"max_attempts": 3, "mode": "standard"},
+                        ),
+                    )
+        return self._client
+
+    def public_url(self, key: str):
+        return f"{aws_url}/{key}"
+
+    def _upload(self, file, key: str, content_type: str):
+        size = 0
+        if file.seekable():
+            size = file.seek(0, os.SEEK_END)
+            file.seek(0)
 
-def upload_to_s3(file, file_name, content_type):
+        started = time.perf_counter()
+        try:
+            self.client.upload_fileobj(
+                KeepOpenFile(file), bucket_name, key,
+                ExtraArgs={"ContentType": content_type, "ACL": "public-read"},
+                Config=self.transfer_config,
+            )
+        except Exception:
+            self.metrics.record(time.perf_counter() - started, 0, failed=True)
+            raise
+
+        duration = time.perf_counter() - started
+        self.metrics.record(duration, size)
+        logger.info("Uploaded %s (%d bytes) in %.1fms", key, size, duration * 1000)
+
+    async def upload(self, file, key: str, content_type: str):
+        self.metrics.in_flight += 1
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self._upload, file, key, content_type)
+        finally:
+            self.metrics.in_flight -= 1
+        return self.public_url(key)
+
+    def presign_post(self, key: str, content_type: str, digest: str):
+        # S3 itself rejects a body outside the size range, with another content type or other bytes than `digest`
+        checksum = base64.b64encode(bytes.fromhex(digest)).decode()
+        return self.client.generate_presigned_post(
+            bucket_name, key,
+            Fields={
+                "Content-Type": content_type, "acl": "public-read",
+                "x-amz-checksum-algorithm": "SHA256", "x-amz-checksum-sha256": checksum,
+            },
+            Conditions=[
+                {"Content-Type": content_type},
+                {"acl": "public-read"},
+                {"x-amz-checksum-algorithm": "SHA256"},
+                {"x-amz-checksum-sha256": checksum},
+                ["content-length-range", 1, MAX_UPLOAD_SIZE],
+            ],
+            ExpiresIn=S3_PRESIGN_EXPIRES,
+        )
+
+    def presign_put(self, key: str, content_type: str, digest: str):
+        # A PUT can not carry a size condition, check_stored_image enforces it when the upload is finalized
+        return self.client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": bucket_name, "Key": key, "ContentType": content_type, "ACL": "public-read",
+                "ChecksumSHA256": base64.b64encode(bytes.fromhex(digest)).decode(),
+            },
+            ExpiresIn=S3_PRESIGN_EXPIRES,
+        )
+
+    def _inspect(self, key: str):
+        try:
+            size = self.client.head_object(Bucket=bucket_name, Key=key)["ContentLength"]
+            header = self.client.get_object(Bucket=bucket_name, Key=key, Range="bytes=0-15")["Body"].read()
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None, None
+            raise
+        return size, sniff_image_type(io.BytesIO(header))
+
+    async def inspect(self, key: str):
+        """Size and sniffed image type of a stored object, (None, None) when it does not exist."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._inspect, key)
+
+    async def delete(self, key: str):
+        await asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(self.client.delete_object, Bucket=bucket_name, Key=key)
+        )
+
+    def _delete_many(self, keys: list):
+        # One request per 1000 keys, keys that are already gone count as deleted
+        failed = []
+        for start in range(0, len(keys), S3_DELETE_BATCH):
+            response = self.client.delete_objects(
+                Bucket=bucket_name,
+                Delete={"Objects": [{"Key": key} for key in keys[start:start + S3_DELETE_BATCH]], "Quiet": True},
+            )
+            failed.extend(error["Key"] for error in response.get("Errors", []))
+        return failed
+
+    async def delete_many(self, keys: list):
+        """Delete `keys` with the multi-object delete API, returns the keys S3 could not delete."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._delete_many, keys)
+
+    def _download_to_temp(self, key: str):
+        with tempfile.NamedTemporaryFile(delete=False, prefix="variant-") as temp:
+            self.client.download_fileobj(bucket_name, key, temp, Config=self.transfer_config)
+        return temp.name
+
+    async def download_to_temp(self, key: str):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._download_to_temp, key)
+
+    def stats(self):
+        return {
+            "workers": S3_UPLOAD_WORKERS,
+            "max_pool_connections": S3_MAX_POOL_CONNECTIONS,
+            "in_flight": self.metrics.in_flight,
+            "uploads": self.metrics.uploads,
+            "failures": self.metrics.failures,
+            "bytes": self.metrics.bytes,
+            "duration_ms": self.metrics.percentiles(),
+            "variants": dict(variant_stats),
+        }
+
+
+storage = StorageService()
+
+
+async def upload_to_s3(file, file_name, content_type):
 
     file_url = f"media/{file_name}"
     file_url = file_url.replace(" ", "")
 
-    s3 = boto3.client('s3', aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+    try:
+        return await storage.upload(file, file_url, content_type)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"AWS error: {e}")
+
+
+_image_pool = None
+_variant_tasks = set()
+variant_stats = Counter()
+
+
+def get_image_pool():
+    global _image_pool
+    if _image_pool is None:
+        # spawn, forking a process that runs threads and an event loop is not safe
+        _image_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _image_pool
+
+
+# Called on app shutdown, queued variant jobs are dropped and their images keep serving the original
+def shutdown_image_pool():
+    global _image_pool
+    if _image_pool is not None:
+        _image_pool.shutdown(wait=True, cancel_futures=True)
+        _image_pool = None
+
+
+def copy_to_temp(file):
+    file.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, prefix="variant-") as temp:
+        shutil.copyfileobj(file, temp)
+    return temp.name
 
+
+async def generate_variants(path: str, file_name: str, on_ready):
     try:
+        rendered = await asyncio.get_running_loop().run_in_executor(get_image_pool(), render_variants, path)
+        await asyncio.gather(*[
+            upload_to_s3(io.BytesIO(data), variant_name(file_name, variant, ext), content_type)
+            for variant, ext, content_type, data in rendered
+        ])
+        await on_ready()
+        variant_stats["generated"] += 1
+    except Exception:
+        variant_stats["failed"] += 1
+        logger.exception("Generating variants of %s failed, the original keeps being served", file_name)
+    finally:
+        os.remove(path)
 
-        s3.upload_fileobj(file, bucket_name, file_url,
-                            ExtraArgs={
-                                "ContentType": content_type,
-                                'ACL': 'public-read'
-                            })
-        # Construct the URL of the uploaded file
-        image_url = f"{aws_url}/{file_url}"
 
-        return image_url
+async def generate_stored_variants(file_name: str, on_ready):
+    try:
+        path = await storage.download_to_temp(f"media/{file_name}")
+    except Exception:
+        variant_stats["failed"] += 1
+        logger.exception("Downloading %s for its variants failed, the original keeps being served", file_name)
+        return
+    await generate_variants(path, file_name, on_ready)
+
+
+def run_variant_task(coro):
+    task = asyncio.create_task(coro)
+    _variant_tasks.add(task)
+    task.add_done_callback(_variant_tasks.discard)
+
+
+# Generate the resized variants of an uploaded image in the background, `on_ready` runs once they are stored
+async def schedule_variants(file, file_name: str, on_ready):
+    # The upload's spooled file is closed with the request, keep a copy for the worker process
+    path = await asyncio.to_thread(copy_to_temp, file)
+    run_variant_task(generate_variants(path, file_name, on_ready))
 
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"AWS error: {e}")
 
+# Same for an image uploaded straight to S3, the worker fetches it from the bucket first
+def schedule_stored_variants(file_name: str, on_ready):
+    run_variant_task(generate_stored_variants(file_name, on_ready))
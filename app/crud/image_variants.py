@@ -0,0 +1,46 @@
+import io
+import os
+from PIL import Image, ImageOps
+
+
+# Longest side in pixels of each generated variant
+VARIANTS = {"thumb": 160, "card": 480, "detail": 1200}
+# File extension -> (Pillow format, content type)
+FORMATS = {"jpg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+QUALITY = int(os.environ.get("IMAGE_VARIANT_QUALITY", 82))
+
+
+def variant_name(name: str, variant: str, ext: str):
+    # Variants sit next to the original: media/x/123_rose.jpg -> media/x/123_rose.card.webp
+    return f"{os.path.splitext(name)[0]}.{variant}.{ext}"
+
+
+def variant_url(url: str | None, variant: str, ready: bool, ext: str = "jpg"):
+    """URL of a variant of `url`, or `url` itself while its variants are still being generated."""
+    if not url or not ready:
+        return url if ext == "jpg" else None
+    return variant_name(url, variant, ext)
+
+
+def variant_urls(url: str | None, ready: bool):
+    if not url or not ready:
+        return {}
+    return {variant: {ext: variant_name(url, variant, ext) for ext in FORMATS} for variant in VARIANTS}
+
+
+def render_variants(path: str):
+    """Resize the image at `path` into every variant and format, runs in a worker process."""
+    rendered = []
+    with Image.open(path) as image:
+        # Let the JPEG decoder downscale while reading, the largest variant is all we need
+        image.draft("RGB", (VARIANTS["detail"], VARIANTS["detail"]))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+
+        for variant, size in VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            for ext, (format, content_type) in FORMATS.items():
+                buffer = io.BytesIO()
+                resized.save(buffer, format, quality=QUALITY, optimize=True)
+                rendered.append((variant, ext, content_type, buffer.getvalue()))
+    return rendered
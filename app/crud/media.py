@@ -0,0 +1,182 @@
+import os
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from fastapi import UploadFile
+from sqlalchemy import select, update, delete, case
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.database import SessionLocal
+from models.products import MediaObject
+from .file_upload import (
+    storage, upload_to_s3, hash_file, content_key, sniff_image_type, get_upload_size, S3_DELETE_BATCH, S3_PRESIGN_EXPIRES
+)
+from .image_variants import VARIANTS, FORMATS, variant_name
+from .utils import dialect_insert
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two reaper runs
+MEDIA_REAP_INTERVAL = int(os.environ.get("MEDIA_REAP_INTERVAL", 300))
+# Seconds an unreferenced object is kept before it is deleted, so a re-upload of the same bytes can still claim it.
+# Presigned uploads are reserved as unreferenced objects, so it also has to cover their upload and finalize
+MEDIA_REAP_GRACE = max(int(os.environ.get("MEDIA_REAP_GRACE", 3600)), 2 * S3_PRESIGN_EXPIRES)
+# The original and its variants must fit in one DeleteObjects request
+MEDIA_REAP_BATCH = S3_DELETE_BATCH // (1 + len(VARIANTS) * len(FORMATS))
+
+media_stats = Counter()
+
+
+def media_key(url: str | None):
+    # Every upload lives under media/, whatever bucket URL it was stored with
+    if not url:
+        return None
+    _, found, path = url.partition("/media/")
+    return f"media/{path}" if found else None
+
+
+def object_keys(key: str):
+    return [key] + [variant_name(key, variant, ext) for variant in VARIANTS for ext in FORMATS]
+
+
+async def acquire_media(db: AsyncSession, key: str, size: int = None, content_type: str = None):
+    """Add a reference to `key`, returns whether its variants exist and whether its bytes still have to be checked.
+
+    They have to be for a new row and for one an upload reserved. The caller checks within
+    the same transaction, so a failed check rolls the reference back.
+    """
+    row = (await db.execute(
+        update(MediaObject.__table__)
+        .where(MediaObject.key == key)
+        .values(ref_count=MediaObject.ref_count + 1, orphaned_on=None)
+        .returning(MediaObject.variants_ready, MediaObject.pending)
+    )).first()
+    if row:
+        if row.pending:
+            await db.execute(update(MediaObject.__table__).where(MediaObject.key == key).values(pending=False))
+        return row.variants_ready, row.pending
+
+    try:
+        async with db.begin_nested():
+            db.add(MediaObject(key=key, size=size, content_type=content_type, ref_count=1))
+    except IntegrityError:
+        # Another upload of the same bytes inserted it first
+        return await acquire_media(db, key, size, content_type)
+    return False, True
+
+
+async def reserve_media(db: AsyncSession, key: str, size: int = None, content_type: str = None):
+    """Record an upload before it happens, returns whether the bytes are already stored.
+
+    The row starts out unreferenced, so an upload that is never finalized or committed is reaped like any orphan.
+    """
+    now = datetime.now()
+    reserve = dialect_insert(db, MediaObject).values(
+        key=key, size=size, content_type=content_type, ref_count=0, pending=True, orphaned_on=now
+    )
+    # An unreferenced object the client is about to claim gets its grace period restarted
+    await db.execute(reserve.on_conflict_do_update(
+        index_elements=["key"], set_={"orphaned_on": now}, where=MediaObject.ref_count <= 0
+    ))
+    pending = await db.scalar(select(MediaObject.pending).where(MediaObject.key == key))
+    await db.commit()
+    return not pending
+
+
+# Drop one reference per url, objects left without any are picked up by the reaper after MEDIA_REAP_GRACE
+async def release_media(db: AsyncSession, *urls):
+    counts = Counter(key for key in map(media_key, urls) if key)
+    for key, count in counts.items():
+        await db.execute(
+            update(MediaObject.__table__)
+            .where(MediaObject.key == key)
+            .values(
+                ref_count=MediaObject.ref_count - count,
+                orphaned_on=case((MediaObject.ref_count - count <= 0, datetime.now()), else_=None),
+            )
+        )
+
+
+async def store_image(db: AsyncSession, image: UploadFile):
+    """Store an uploaded image under its content hash, the bytes are only sent to S3 the first time they are seen.
+
+    The object is reserved and committed on a session of its own before the upload, so an upload
+    whose reference never gets committed, or that fails half way, still leaves a row for the reaper.
+    """
+    content_type = sniff_image_type(image.file)
+    key = content_key(await asyncio.to_thread(hash_file, image.file), content_type)
+    size = get_upload_size(image)
+
+    async with SessionLocal() as reserve_db:
+        stored = await reserve_media(reserve_db, key, size, content_type)
+    if not stored:
+        await upload_to_s3(image.file, key.removeprefix("media/"), content_type)
+
+    variants_ready, _ = await acquire_media(db, key, size, content_type)
+    return key, variants_ready
+
+
+async def reap_media():
+    """Delete objects unreferenced for longer than MEDIA_REAP_GRACE.
+
+    The rows stay locked from before the S3 delete until they are removed, an upload
+    of the same bytes meanwhile waits for them to be gone and then stores them again.
+    """
+    cutoff = datetime.now() - timedelta(seconds=MEDIA_REAP_GRACE)
+    reaped = 0
+    while True:
+        async with SessionLocal() as db:
+            orphans = (
+                select(MediaObject.id)
+                .where(MediaObject.ref_count <= 0, MediaObject.orphaned_on < cutoff)
+                .limit(MEDIA_REAP_BATCH)
+                .with_for_update(skip_locked=True)
+            )
+            # Changes nothing, it takes the row locks on Postgres and the write lock on SQLite
+            rows = (await db.execute(
+                update(MediaObject.__table__)
+                .where(MediaObject.id.in_(orphans), MediaObject.ref_count <= 0)
+                .values(orphaned_on=MediaObject.orphaned_on)
+                .returning(MediaObject.id, MediaObject.key)
+            )).all()
+            if not rows:
+                break
+
+            failed = set(await storage.delete_many([name for row in rows for name in object_keys(row.key)]))
+            if failed:
+                media_stats["delete_failed"] += len(failed)
+                logger.error("Could not delete %d orphaned media objects, first: %s", len(failed), min(failed))
+
+            # A row goes with its original, one whose original is still there stays for the next run
+            # with its variants redone on the next claim, as some of them may be gone
+            kept = [row.id for row in rows if row.key in failed]
+            deleted = [row.id for row in rows if row.key not in failed]
+            if kept:
+                await db.execute(update(MediaObject.__table__).where(MediaObject.id.in_(kept)).values(variants_ready=False))
+            if deleted:
+                await db.execute(delete(MediaObject.__table__).where(MediaObject.id.in_(deleted)))
+            await db.commit()
+
+        reaped += len(deleted)
+        if failed or len(rows) < MEDIA_REAP_BATCH:
+            break
+
+    media_stats["reaped"] += reaped
+    media_stats["runs"] += 1
+    return reaped
+
+
+# Runs for the lifetime of the app, every worker runs one and the row locks keep them from doing the same work
+async def media_reaper():
+    while True:
+        await asyncio.sleep(MEDIA_REAP_INTERVAL)
+        try:
+            reaped = await reap_media()
+            if reaped:
+                logger.info("Reaped %d orphaned media objects", reaped)
+        except Exception:
+            media_stats["failed_runs"] += 1
+            logger.exception("Media reaper run failed")
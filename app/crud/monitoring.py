@@ -0,0 +1,32 @@
+from fastapi.responses import JSONResponse
+
+from models.database import engine, replica_engines
+from .cache import catalog_cache
+from .response_cache import get_cache_stats
+from .file_upload import storage
+from .media import media_stats
+
+
+def get_engine_pool_stats(db_engine):
+    pool = db_engine.sync_engine.pool
+    if not hasattr(pool, "stats"):
+        return {"pool": pool.status()}
+    return pool.stats()
+
+
+# Database connection pool metrics
+async def pool_stats_view():
+    return JSONResponse({
+        "primary": get_engine_pool_stats(engine),
+        "replicas": [get_engine_pool_stats(replica) for replica in replica_engines],
+    })
+
+
+# In-process cache hit/miss counters
+async def cache_stats_view():
+    return JSONResponse({"catalog": catalog_cache.stats(), "responses": get_cache_stats()})
+
+
+# S3 upload timings and thread pool usage
+async def storage_stats_view():
+    return JSONResponse({**storage.stats(), "media": dict(media_stats)})
@@ -0,0 +1,53 @@
+import os
+import base64
+import binascii
+import orjson
+from fastapi import HTTPException, Response
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+DEFAULT_PAGE_SIZE = int(os.environ.get("DEFAULT_PAGE_SIZE", 50))
+MAX_PAGE_SIZE = int(os.environ.get("MAX_PAGE_SIZE", 100))
+PAGE_HEADERS = ("X-Next-Cursor", "X-Total-Count")
+
+
+def encode_cursor(values: dict):
+    return base64.urlsafe_b64encode(orjson.dumps(values)).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str | None):
+    if not cursor:
+        return None
+    try:
+        values = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return {"id": int(values["id"])}
+    except (binascii.Error, orjson.JSONDecodeError, KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+async def paginate(
+    db: AsyncSession, query, key_column, response: Response, cursor: str | None = None,
+    limit: int = DEFAULT_PAGE_SIZE, with_total: bool = False
+):
+    """Keyset page of `query` ordered by `key_column` descending.
+
+    The next page cursor goes out in the X-Next-Cursor header and, when asked for,
+    the total row count in X-Total-Count, so list responses keep their shape.
+    """
+    if with_total:
+        total = await db.scalar(select(func.count()).select_from(query.order_by(None).subquery()))
+        response.headers["X-Total-Count"] = str(total)
+
+    after = decode_cursor(cursor)
+    if after:
+        query = query.where(key_column < after["id"])
+
+    limit = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    rows = (await db.scalars(query.order_by(key_column.desc()).limit(limit + 1))).all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor({"id": getattr(rows[-1], key_column.key)})
+
+    return rows
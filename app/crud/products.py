@@ -1,33 +1,77 @@
-import io
 import os
+import re
+import base64
+import logging
 import requests
-from fastapi import UploadFile
+from collections import Counter
+from fastapi import UploadFile, Response
+from fastapi.concurrency import run_in_threadpool
 from typing import Dict
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, insert, func, update, delete, case, or_
+from sqlalchemy.orm import selectinload, joinedload
 from datetime import datetime
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 
-from .file_upload import upload_to_s3
+from .file_upload import (
+    storage, check_image_upload, schedule_variants, schedule_stored_variants, content_key, check_stored_image,
+    IMAGE_TYPES, MAX_UPLOAD_SIZE, MB, S3_PRESIGN_EXPIRES
+)
+from .media import acquire_media, reserve_media, release_media, store_image
+from .image_variants import variant_urls
 from .orders import do_orders_success
+from .pagination import paginate, PAGE_HEADERS
+from .cache import catalog_cache, MISSING
+from .response_cache import invalidate_tags, cached_value
+from .cart import (
+    load_cart, render_cart, invalidate_cart, cart_tag, get_or_create_cart_id, replace_cart_items, clamp_quantity, CART_CACHE_TTL,
+    guest_cart_key, new_cart_token, get_guest_items, save_guest_items, load_guest_cart, GUEST_CART_MAX_ITEMS
+)
+from .search import search_index, search_products, product_search_filter
+from .utils import dialect_insert
 
+from models.database import SessionLocal
 from models.products import (
-    Product, ProductImage, Cart, ProductCartAssociation, Pincode, Order, Payment, PaymentWebhook, RatingReview, Promocode, PageSection
+    Product, ProductCategory, ProductImage, Cart, ProductCartAssociation, Pincode, Order, Payment, PaymentWebhook, RatingReview, Promocode, PageSection,
+    MediaObject
     )
 
 from schemas.products import (
-    ProductActionBase, AdminProductsListBase, ProductsListBase,  AddToCartBase, PincodeBase, OrderBase, CreateOrderBase, CheckoutBase,
+    ProductActionBase, AdminProductsListBase, ProductsListBase, ProductsDetailBase, AddToCartBase, PincodeBase, OrderBase, CreateOrderBase, CheckoutBase,
     UserOrderBase, AddProductRatingReviewBase, ProductRatingReviewBase, AdminOrderBase, AdminOrderDetailBase, LatestOrdersBase, 
-    UpdatePincodeBase, PromocodeActionBase, PromocodeBase, UserOrderDetailBase
+    UpdatePincodeBase, PromocodeActionBase, PromocodeBase, UserOrderDetailBase, PageSectionBase, ProductCategoriesBase,
+    ProductImageBase, PresignUploadBase, FinalizeProductImageBase, FinalizePageSectionBase, CartItemsBase
 )
 
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+BUNDLE_REVIEWS_PAGE_SIZE = int(os.environ.get("BUNDLE_REVIEWS_PAGE_SIZE", 10))
+BUNDLE_RELATED_LIMIT = int(os.environ.get("BUNDLE_RELATED_LIMIT", 8))
+UPLOAD_KINDS = ("product-image", "page-section")
+# Seconds to wait for Cashfree, the checkout transaction stays open meanwhile
+CASHFREE_TIMEOUT = float(os.environ.get("CASHFREE_TIMEOUT", 15))
+
+# Relationships read by the order response builders; async sessions cannot lazy load
+ORDER_DETAIL_LOADS = (
+    selectinload(Order.product),
+    selectinload(Order.user),
+)
+
+
+# Drop every cached copy of the catalog after a product or product image write
+async def invalidate_catalog():
+    catalog_cache.clear()
+    search_index.mark_stale()
+    await invalidate_tags("products")
+
+
 # ------------------------------------- Product ----------------------------------------------------------------
 
-async def create_product(db: Session, product: ProductActionBase):
+async def create_product(db: AsyncSession, product: ProductActionBase):
     try:
 
         db_product = Product(
@@ -45,51 +89,158 @@ async def create_product(db: Session, product: ProductActionBase):
         )
         
         db.add(db_product)    
-        db.commit()
-        db.refresh(db_product)
+        await db.flush()
+        await refresh_product_categories(db, db_product.category)
+        await db.commit()
+        await db.refresh(db_product)
+        await invalidate_catalog()
         
         return db_product
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse({"error": str(e)}, status_code=400)
 
 
 # Products List
-async def get_all_products(db: Session, limit: int, category: str):
-    query = db.query(Product).order_by(Product.id.desc()).options(selectinload(Product.images))
+async def get_all_products(
+    db: AsyncSession, response: Response, limit: int, category: str, cursor: str = None, with_total: bool = False
+):
+    cache_key = ("products-list", limit, category, cursor, with_total)
+    cached = catalog_cache.get(cache_key)
+    if cached is not MISSING:
+        products, headers = cached
+        response.headers.update(headers)
+        return products
+
+    query = select(Product)
 
     if category:
-        query = query.filter(Product.category == category)
+        query = query.where(Product.category == category)
 
-    products = query.limit(limit).all()
-    return [await ProductsListBase.get_image_data(product) for product in products]
+    products = await paginate(db, query, Product.id, response, cursor, limit, with_total)
+    products = [
+        ProductsListBase.model_validate(await ProductsListBase.get_image_data(product)).model_dump()
+        for product in products
+    ]
+
+    # Keep the page headers with the page so cached responses can still be paged
+    headers = {name: response.headers[name] for name in PAGE_HEADERS if name in response.headers}
+    catalog_cache.set(cache_key, (products, headers))
+    return products
 
 
 
-async def get_product_view(db: Session, product_id: int):
-    product = db.query(Product).filter(Product.id == product_id).first()
+# Public product search, ranked best match first
+async def search_products_view(db: AsyncSession, q: str, limit: int, category: str = None):
+    products = await search_products(db, q, limit, category)
+    return [
+        ProductsListBase.model_validate(await ProductsListBase.get_image_data(product)).model_dump()
+        for product in products
+    ]
+
+
+async def get_product_view(db: AsyncSession, product_id: int):
+    cache_key = ("product", product_id)
+    product = catalog_cache.get(cache_key)
+    if product is not MISSING:
+        return product
+
+    product = await db.get(Product, product_id)
     if not product:
         return JSONResponse(status_code=404, content={"detail": "Product not found"})
+
+    product = ProductsDetailBase.model_validate(product).model_dump()
+    catalog_cache.set(cache_key, product)
     return product
 
 
-async def get_product_category_view(db: Session, product_id: int):
-    product = db.query(Product).filter(Product.id == product_id).first()
+async def get_product_category_view(db: AsyncSession, product_id: int):
+    cache_key = ("product-category", product_id)
+    category = catalog_cache.get(cache_key)
+    if category is not MISSING:
+        return {"category": category}
+
+    product = await db.get(Product, product_id)
     if not product:
         return JSONResponse(status_code=404, content={"detail": "Product not found"})
-    return JSONResponse({"category": product.category})
 
+    catalog_cache.set(cache_key, product.category)
+    return {"category": product.category}
 
-async def admin_products_list_view(db: Session, get_image: bool, name:str, category:str):
-    query = db.query(Product)
+
+# Everything a product page shows, in a fixed five queries
+async def product_bundle_view(db: AsyncSession, product_id: int = None, slug: str = None):
+    if slug is not None:
+        product = await db.scalar(select(Product).where(Product.slug == slug).order_by(Product.id).limit(1))
+    else:
+        product = await db.get(Product, product_id)
+    if not product:
+        return JSONResponse(status_code=404, content={"detail": "Product not found"})
+
+    images = (await db.scalars(
+        select(ProductImage).where(ProductImage.product_id == product.id).order_by(ProductImage.id)
+    )).all()
+
+    # Rating summary from one grouped count instead of loading every review
+    stars = func.round(RatingReview.rating)
+    rating_rows = (await db.execute(
+        select(stars.label("stars"), func.count().label("count"), func.sum(RatingReview.rating).label("total"))
+        .where(RatingReview.product_id == product.id)
+        .group_by(stars)
+    )).all()
+    total_reviews = sum(row.count for row in rating_rows)
+    breakdown = {5: 0, 4: 0, 3: 0, 2: 0, 1: 0}
+    for row in rating_rows:
+        if int(row.stars) in breakdown:
+            breakdown[int(row.stars)] += row.count
+
+    reviews = (await db.scalars(
+        select(RatingReview).where(RatingReview.product_id == product.id)
+        .options(joinedload(RatingReview.user))
+        .order_by(RatingReview.id.desc())
+        .limit(BUNDLE_REVIEWS_PAGE_SIZE)
+    )).all()
+
+    related = []
+    if product.category:
+        related = (await db.scalars(
+            select(Product).where(Product.category == product.category, Product.id != product.id)
+            .order_by(Product.id.desc())
+            .limit(BUNDLE_RELATED_LIMIT)
+        )).all()
+
+    return {
+        "product": ProductsDetailBase.model_validate(product).model_dump(),
+        "images": [
+            {
+                **ProductImageBase.model_validate(image, from_attributes=True).model_dump(),
+                "variants": variant_urls(image.image_url, image.variants_ready),
+            }
+            for image in images
+        ],
+        "rating": {
+            "average": round(sum(row.total for row in rating_rows) / total_reviews, 1) if total_reviews else 0,
+            "total_reviews": total_reviews,
+            "breakdown": breakdown,
+        },
+        "reviews": [review for review in [await ProductRatingReviewBase.get_data(r) for r in reviews] if review],
+        "related": [ProductsListBase.model_validate(await ProductsListBase.get_image_data(p)).model_dump() for p in related],
+    }
+
+
+async def admin_products_list_view(
+    db: AsyncSession, response: Response, get_image: bool, name:str, category:str,
+    cursor: str = None, limit: int = None, with_total: bool = False
+):
+    query = select(Product)
     
     if name:
-        query = query.filter(Product.name.ilike(f"%{name}%"))
+        query = query.where(await product_search_filter(db, name))
 
     if category:
-        query = query.filter(Product.category == category)
+        query = query.where(Product.category == category)
 
-    products =  query.order_by(Product.id.desc()).options(selectinload(Product.images)).all()
+    products = await paginate(db, query, Product.id, response, cursor, limit, with_total)
 
     if get_image:
         return [await AdminProductsListBase.get_image_data(product) for product in products]
@@ -97,33 +248,43 @@ async def admin_products_list_view(db: Session, get_image: bool, name:str, categ
 
 
 # Update Product
-async def update_product_view(db:Session, product_id: int, product_data:ProductActionBase):
+async def update_product_view(db: AsyncSession, product_id: int, product_data:ProductActionBase):
     try:
-        product = db.query(Product).filter(Product.id == product_id).first()
+        product = await db.get(Product, product_id)
         if not product:
             return JSONResponse(status_code=404, content={"detail": "Product not found"})
         
+        old_category = product.category
+
         # Update only the fields provided in the request
         for field, value in product_data.model_dump(exclude_unset=True).items():
             setattr(product, field, value)
         
-        db.commit()
-        db.refresh(product)
+        await db.flush()
+        await refresh_product_categories(db, old_category, product.category)
+        await db.commit()
+        await db.refresh(product)
+        await invalidate_catalog()
         
         return product
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse({"detail": str(e)}, status_code=400)
 
 
-async def delete_product_view(db: Session, product_id:int):
+async def delete_product_view(db: AsyncSession, product_id:int):
     try:
-        product = db.query(Product).filter(Product.id == product_id).first()
+        product = await db.get(Product, product_id)
         if not product:
             return JSONResponse(status_code=404, content={"detail": "Product not found"})
         
-        db.delete(product)
-        db.commit()
+        # Its images are deleted with it
+        await release_media(db, *(await db.scalars(select(ProductImage.image_url).where(ProductImage.product_id == product.id))).all())
+        await db.delete(product)
+        await db.flush()
+        await refresh_product_categories(db, product.category)
+        await db.commit()
+        await invalidate_catalog()
         
         return {"detail": "Product deleted successfully"}
     except Exception as e:
@@ -131,190 +292,426 @@ async def delete_product_view(db: Session, product_id:int):
 
 
 # Get Product Categoris
-async def get_product_categories_view(db: Session):
+async def get_product_categories_view(db: AsyncSession):
     try:
-        return db.query(Product.category).distinct().all()
+        categories = catalog_cache.get("product-categories")
+        if categories is MISSING:
+            rows = (await db.scalars(select(ProductCategory).order_by(ProductCategory.category))).all()
+            categories = [ProductCategoriesBase.model_validate(row).model_dump() for row in rows]
+            catalog_cache.set("product-categories", categories)
+        return categories
     except Exception as e:
         return JSONResponse({"detail": str(e)}, status_code=400)
 
+
+
+# Recompute the category index rows of the given categories from the products table
+async def refresh_product_categories(db: AsyncSession, *categories):
+    categories = {category for category in categories if category is not None}
+    if not categories:
+        return
+
+    rows = await db.execute(
+        select(
+            Product.category,
+            func.count().label("product_count"),
+            func.sum(case((Product.in_stock > 0, 1), else_=0)).label("in_stock_count"),
+            func.min(Product.sale_price).label("min_price"),
+            func.max(Product.sale_price).label("max_price"),
+        ).where(Product.category.in_(categories)).group_by(Product.category)
+    )
+    stats = [row._asdict() for row in rows]
+
+    # Upserted, two writers adding the first product of a category can not both insert its row
+    if stats:
+        insert = dialect_insert(db, ProductCategory).values(stats)
+        await db.execute(insert.on_conflict_do_update(
+            index_elements=["category"],
+            set_={name: insert.excluded[name] for name in ("product_count", "in_stock_count", "min_price", "max_price")},
+        ))
+
+    empty = categories - {row["category"] for row in stats}
+    if empty:
+        await db.execute(delete(ProductCategory).where(ProductCategory.category.in_(empty)))
+
+
+# Products page with category, availability and gift set counts
+async def faceted_products_view(
+    db: AsyncSession, response: Response, category: str = None, is_available: bool = None, is_giftset: bool = None,
+    cursor: str = None, limit: int = None, with_total: bool = False
+):
+    # Facet name -> the value the page is filtered on, None when it is not
+    selected = {"category": category or None, "is_available": is_available, "is_giftset": is_giftset}
+
+    # One GROUP BY over every combination of facet values. Each facet counts the products matching
+    # all the other filters but not its own, so a client can show what picking another value returns
+    rows = (await db.execute(
+        select(Product.category, Product.is_available, Product.is_giftset, func.count().label("total"))
+        .group_by(Product.category, Product.is_available, Product.is_giftset)
+    )).all()
+
+    def matches_others(row, facet):
+        return all(
+            value is None or getattr(row, name) == value
+            for name, value in selected.items() if name != facet
+        )
+
+    facets = {"category": Counter(), "is_available": Counter(true=0, false=0), "is_giftset": Counter(true=0, false=0)}
+    for row in rows:
+        if row.category is not None and matches_others(row, "category"):
+            facets["category"][row.category] += row.total
+        for facet in ("is_available", "is_giftset"):
+            if matches_others(row, facet):
+                facets[facet]["true" if getattr(row, facet) else "false"] += row.total
+
+    query = select(Product).where(*[getattr(Product, name) == value for name, value in selected.items() if value is not None])
+    products = await paginate(db, query, Product.id, response, cursor, limit, with_total)
+
+    return {
+        "products": [ProductsListBase.model_validate(await ProductsListBase.get_image_data(product)).model_dump() for product in products],
+        "facets": {name: dict(counts) for name, counts in facets.items()},
+    }
+
 # =================================================================================================================
 
 
 # ------------------------------------- Product Image -------------------------------------------------------------
 
+# Keep the denormalized cover image and image count of a product in step with its images
+async def sync_product_cover(db: AsyncSession, product_id: int):
+    images = select(ProductImage).where(ProductImage.product_id == product_id)
+    await db.execute(
+        update(Product).where(Product.id == product_id).values(
+            cover_image_url=images.with_only_columns(ProductImage.image_url).order_by(ProductImage.id).limit(1).scalar_subquery(),
+            image_count=images.with_only_columns(func.count()).scalar_subquery(),
+            cover_variants_ready=func.coalesce(
+                images.with_only_columns(ProductImage.variants_ready).order_by(ProductImage.id).limit(1).scalar_subquery(),
+                False,
+            ),
+        )
+    )
+
+
+# Called once the resized variants of a stored image exist, every row showing that image can use them
+async def media_variants_ready(key: str):
+    image_url = storage.public_url(key)
+    async with SessionLocal() as db:
+        await db.execute(update(MediaObject).where(MediaObject.key == key).values(variants_ready=True))
+        product_ids = (await db.scalars(
+            update(ProductImage).where(ProductImage.image_url == image_url).values(variants_ready=True).returning(ProductImage.product_id)
+        )).all()
+        await db.execute(update(PageSection).where(PageSection.image_url == image_url).values(variants_ready=True))
+        for product_id in set(product_ids):
+            await sync_product_cover(db, product_id)
+        await db.commit()
+    await invalidate_catalog()
+    await invalidate_tags("page-section")
+
+
 # Add Product Image
 async def add_product_image_view(db, product_id, image):
     try:
-        product = db.query(Product).filter(Product.id == product_id).first()
+        product = await db.get(Product, int(product_id))
         if not product:
             return JSONResponse(status_code=404, content={"detail": "Product not found"})
-        
-        current_time = datetime.now()
-        timestamp = datetime.timestamp(current_time)
-
-        image_url = f"al-qudsiyah/{int(timestamp)}_{image.filename}"
 
-        file_content = await image.read()
-        
-        file_obj = io.BytesIO(file_content)
+        error = check_image_upload(image)
+        if error:
+            return error
 
-        file_aws_url = upload_to_s3(file_obj, image_url, image.content_type)
+        # Stored under the hash of its bytes, a photo that is already in the bucket is not uploaded again
+        key, variants_ready = await store_image(db, image)
         
         db_product_image = ProductImage(
-            image_url=file_aws_url,
-            product_id=product_id
+            image_url=storage.public_url(key),
+            product_id=product.id,
+            variants_ready=variants_ready,
         )
         
         db.add(db_product_image)
-        db.commit()
-        db.refresh(db_product_image)
+        await db.flush()
+        await sync_product_cover(db, product.id)
+        await db.commit()
+        await db.refresh(db_product_image)
+        await invalidate_catalog()
+
+        if not variants_ready:
+            await schedule_variants(image.file, key.removeprefix("media/"), lambda: media_variants_ready(key))
         
         return db_product_image
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse({"detail": str(e)}, status_code=400)
     
 
+# Presigned upload, the browser sends the file straight to S3 and then calls the matching finalize view
+async def presign_upload_view(db: AsyncSession, data: PresignUploadBase):
+    if data.kind not in UPLOAD_KINDS:
+        return JSONResponse({"detail": f"kind must be one of {', '.join(UPLOAD_KINDS)}"}, status_code=400)
+    if data.method not in ("post", "put"):
+        return JSONResponse({"detail": "method must be post or put"}, status_code=400)
+    if not re.fullmatch(r"[0-9a-f]{64}", data.sha256):
+        return JSONResponse({"detail": "sha256 must be the hex SHA-256 of the file"}, status_code=400)
+    if data.size > MAX_UPLOAD_SIZE:
+        return JSONResponse({"detail": f"File is larger than {MAX_UPLOAD_SIZE // MB}MB"}, status_code=413)
+    if data.content_type not in IMAGE_TYPES:
+        return JSONResponse({"detail": "Only JPEG, PNG, GIF and WebP images are allowed"}, status_code=415)
+
+    if data.kind == "product-image" and not await db.get(Product, data.product_id or 0):
+        return JSONResponse(status_code=404, content={"detail": "Product not found"})
+
+    key = content_key(data.sha256, data.content_type)
+    # Same bytes already stored, the client can go straight to finalize
+    if await reserve_media(db, key, data.size, data.content_type):
+        return {"key": key, "exists": True}
+
+    try:
+        if data.method == "post":
+            presigned = storage.presign_post(key, data.content_type, data.sha256)
+            upload = {"url": presigned["url"], "fields": presigned["fields"]}
+        else:
+            upload = {
+                "url": storage.presign_put(key, data.content_type, data.sha256),
+                "headers": {
+                    "Content-Type": data.content_type, "x-amz-acl": "public-read",
+                    "x-amz-checksum-sha256": base64.b64encode(bytes.fromhex(data.sha256)).decode(),
+                },
+            }
+    except Exception as e:
+        return JSONResponse({"detail": f"AWS error: {e}"}, status_code=400)
+
+    return {"key": key, "exists": False, "method": data.method, "expires_in": S3_PRESIGN_EXPIRES, **upload}
+
+
+# Take a reference to an object uploaded with a presigned URL, checking it the first time it is seen
+async def acquire_stored_image(db: AsyncSession, key: str):
+    variants_ready, new = await acquire_media(db, key)
+    if new:
+        error = await check_stored_image(key)
+        if error:
+            await db.rollback()
+            return None, error
+    return variants_ready, None
+
+
+# Record a product image uploaded with a presigned URL
+async def finalize_product_image_view(db: AsyncSession, data: FinalizeProductImageBase):
+    try:
+        product = await db.get(Product, data.product_id)
+        if not product:
+            return JSONResponse(status_code=404, content={"detail": "Product not found"})
+
+        variants_ready, error = await acquire_stored_image(db, data.key)
+        if error:
+            return error
+
+        db_product_image = ProductImage(image_url=storage.public_url(data.key), product_id=product.id, variants_ready=variants_ready)
+        db.add(db_product_image)
+        await db.flush()
+        await sync_product_cover(db, product.id)
+        await db.commit()
+        await db.refresh(db_product_image)
+        await invalidate_catalog()
+
+        if not variants_ready:
+            schedule_stored_variants(data.key.removeprefix("media/"), lambda: media_variants_ready(data.key))
+
+        return db_product_image
+    except Exception as e:
+        await db.rollback()
+        return JSONResponse({"detail": str(e)}, status_code=400)
+
+
 # Get product Image
-async def get_product_images_view(db: Session, product_id: int):
+async def get_product_images_view(db: AsyncSession, product_id: int):
     # we can also return product.image if we have product obj
     try:
-        return db.query(ProductImage).filter(ProductImage.product_id == product_id).all()
+        return (await db.scalars(select(ProductImage).where(ProductImage.product_id == product_id))).all()
     except Exception as e:
         return JSONResponse({"detail": str(e)}, status_code=400)
 
 
-async def delete_product_image_view(db:Session, image_id:int):
+async def delete_product_image_view(db: AsyncSession, image_id:int):
     try:
-        product_image = db.query(ProductImage).filter(ProductImage.id == image_id).first()
+        product_image = await db.get(ProductImage, image_id)
         if not product_image:
             return JSONResponse(status_code=404, content={"detail": "Product Image not found"})
         
-        db.delete(product_image)
-        db.commit()
+        await db.delete(product_image)
+        # The S3 object goes once no other image or page section uses it
+        await release_media(db, product_image.image_url)
+        await db.flush()
+        await sync_product_cover(db, product_image.product_id)
+        await db.commit()
+        await invalidate_catalog()
         
         return {"detail": "Product Image deleted successfully"}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse({"detail": str(e)}, status_code=400)
 # =================================================================================================================
 
 
-async def user_cart_view(db: Session, user: dict):
-    cart = db.query(Cart).filter(Cart.user_id == user["id"]).first()
-    
-    if not cart:
-        db_cart = Cart(user_id=user["id"])
-        db.add(db_cart)
-        db.commit()
-        db.refresh(db_cart)    
-        cart = db.query(Cart).filter(Cart.user_id == user["id"]).first()
-        
-    if not cart.products:
-        return JSONResponse({
-        "cart_id": cart.id,
-        "products": []
-    })
-
-    products_data = [
-        {
-            "id": product.id,
-            "name": product.name,
-            "sale_price": product.sale_price,
-            "original_price": product.original_price,
-            "slug": product.slug,
-            "in_stock": product.in_stock,
-            "unit": product.unit,
-            "description": product.description,
-            "quantity": product.quantity,
-            "image": product.images[0].image_url if product.images else None
-        }
-        for product in cart.products
-    ]
+async def user_cart_view(db: AsyncSession, user: dict):
+    async def build_cart():
+        cart = await load_cart(db, user["id"])
+        if cart is None:
+            cart = render_cart(await get_or_create_cart_id(db, user["id"]), [])
+            await db.commit()
+        return cart
 
-    return JSONResponse({
-        "cart_id": cart.id,
-        "products": products_data
-    })
+    # Cached per user, product writes change prices and images so they invalidate it as well
+    cart = await cached_value(
+        "cart", {"user_id": user["id"]}, (cart_tag(user["id"]), "products"), CART_CACHE_TTL, build_cart, db=db
+    )
+    return JSONResponse(cart)
 
 
-# User cart items count
-async def user_cart_items_count(db: Session, user: dict):
-    cart = db.query(Cart).filter(Cart.user_id == user["id"]).first()
-    
-    if not cart:
-        db_cart = Cart(user_id=user["id"])
-        db.add(db_cart)
-        db.commit()
-        db.refresh(db_cart)    
-        cart = db.query(Cart).filter(Cart.user_id == user["id"]).first()
-    
-    product_count = len(cart.products) if cart.products else 0
-    
-    
+# User cart items count, one COUNT on every page render and never a write
+async def user_cart_items_count(db: AsyncSession, user: dict):
+    product_count = await db.scalar(
+        select(func.count())
+        .select_from(ProductCartAssociation)
+        .join(Cart, Cart.id == ProductCartAssociation.cart_id)
+        .where(Cart.user_id == user["id"])
+    )
     return JSONResponse({"count": product_count}, status_code=200)
 
 
-async def add_to_cart_view(db: Session, user: dict, cart: AddToCartBase):
+async def add_to_cart_view(db: AsyncSession, user: dict, cart: AddToCartBase):
     try:
-        # Get User Cart
-        user_cart = db.query(Cart).filter(Cart.user_id == user["id"]).first()
-        # If user not have cart then create
-        if not user_cart:
-            db_cart = Cart(user_id=user["id"])
-            db.add(db_cart)
-            db.commit()
-            db.refresh(db_cart)    
-            user_cart = db.query(Cart).filter(Cart.user_id == user["id"]).first()
-
-        # Check product in already in cart
-        product_cart = db.query(ProductCartAssociation).filter(
-            ProductCartAssociation.product_id== cart.product_id, 
-            ProductCartAssociation.cart_id == user_cart.id
-            ).first()
-        if product_cart:
+        cart_id = await get_or_create_cart_id(db, user["id"])
+
+        # Returns nothing when the product is already in the cart
+        added = await db.scalar(
+            dialect_insert(db, ProductCartAssociation)
+            .values(product_id=cart.product_id, cart_id=cart_id, quantity=clamp_quantity(cart.quantity))
+            .on_conflict_do_nothing(index_elements=["product_id", "cart_id"])
+            .returning(ProductCartAssociation.product_id)
+        )
+        await db.commit()
+        if added is None:
             return JSONResponse({"msg": "Item already in cart"}, status_code=200)
-        
-        # Add Product in cart
-        db_product_cart = ProductCartAssociation(product_id=cart.product_id, cart_id=user_cart.id, quantity=cart.quantity)
 
-        db.add(db_product_cart)
-        db.commit()
-        db.refresh(db_product_cart)    
-        
+        await invalidate_cart(user["id"])
         return JSONResponse({"msg": "Product Added to Cart"})
     except Exception as e:
+        await db.rollback()
         return JSONResponse({"error": str(e)}, status_code=400)
-    
-    # product_cart = ProductCartAssociation(cart_id=db)
 
         
-async def delete_from_cart_view(db: Session, user: dict, product_id: int):
-    # Get User Cart
-    user_cart = db.query(Cart).filter(Cart.user_id == user["id"]).first()
-
-    prodcut_cart = db.query(ProductCartAssociation).filter(
-        ProductCartAssociation.cart_id == user_cart.id,
-        ProductCartAssociation.product_id == product_id,
-    ).first()
-    
-    if prodcut_cart:
-        db.delete(prodcut_cart)
-        db.commit()
+async def delete_from_cart_view(db: AsyncSession, user: dict, product_id: int):
+    # Nothing to remove when the user has no cart, and no cart gets created for it
+    await db.execute(
+        delete(ProductCartAssociation).where(
+            ProductCartAssociation.cart_id == select(Cart.id).where(Cart.user_id == user["id"]).scalar_subquery(),
+            ProductCartAssociation.product_id == product_id,
+        )
+    )
+    await db.commit()
+    await invalidate_cart(user["id"])
 
     return JSONResponse({"msg": "Item removed from cart"}, status_code=200)
 
 
-async def add_pincode_view(db: Session, user: dict, pincode_data: PincodeBase):
+# Replace the whole cart with the given items and quantities in one transaction
+async def set_cart_items_view(db: AsyncSession, user: dict, data: CartItemsBase):
+    # A product listed twice keeps its last quantity, a quantity of 0 or less removes it
+    quantities = {}
+    for item in data.items:
+        quantities[item.product_id] = item.quantity
+    quantities = {product_id: clamp_quantity(quantity) for product_id, quantity in quantities.items() if quantity > 0}
+
+    try:
+        found = set((await db.scalars(select(Product.id).where(Product.id.in_(quantities)))).all())
+        missing = sorted(set(quantities) - found)
+        if missing:
+            return JSONResponse({"error": "Products not found", "product_ids": missing}, status_code=404)
+
+        cart_id = await get_or_create_cart_id(db, user["id"])
+        await replace_cart_items(db, cart_id, quantities)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    await invalidate_cart(user["id"])
+    return JSONResponse(await load_cart(db, user["id"]))
+
+
+# Guest Cart, kept in the cache backend under a signed token until the guest logs in
+def guest_cart_response(cart: dict, token: str | None):
+    return JSONResponse({**cart, "cart_token": token}, headers={"X-Cart-Token": token} if token else None)
+
+
+async def guest_cart_view(db: AsyncSession, cart_token: str | None):
+    if not guest_cart_key(cart_token):
+        cart_token = None
+    return guest_cart_response(await load_guest_cart(db, await get_guest_items(cart_token)), cart_token)
+
+
+# Apply `change` to the guest's items, a missing or invalid token starts a new cart
+async def update_guest_cart(db: AsyncSession, cart_token: str | None, change):
+    if not guest_cart_key(cart_token):
+        cart_token = new_cart_token()
+    # Only reads products, the primary is not needed
+    db.info["use_replica"] = True
+
+    items = await get_guest_items(cart_token)
+    error = await change(items)
+    if error:
+        return error
+    if len(items) > GUEST_CART_MAX_ITEMS:
+        return JSONResponse({"error": f"A cart holds at most {GUEST_CART_MAX_ITEMS} products"}, status_code=400)
+
+    await save_guest_items(cart_token, items)
+    return guest_cart_response(await load_guest_cart(db, items), cart_token)
+
+
+async def guest_add_to_cart_view(db: AsyncSession, cart_token: str | None, cart: AddToCartBase):
+    async def add(items):
+        if not await db.get(Product, cart.product_id):
+            return JSONResponse({"error": "Product not found"}, status_code=404)
+        items[cart.product_id] = clamp_quantity(items.get(cart.product_id, 0) + clamp_quantity(cart.quantity))
+
+    return await update_guest_cart(db, cart_token, add)
+
+
+async def guest_set_cart_items_view(db: AsyncSession, cart_token: str | None, data: CartItemsBase):
+    async def replace(items):
+        quantities = {}
+        for item in data.items:
+            quantities[item.product_id] = item.quantity
+        quantities = {product_id: clamp_quantity(quantity) for product_id, quantity in quantities.items() if quantity > 0}
+
+        found = set((await db.scalars(select(Product.id).where(Product.id.in_(quantities)))).all())
+        missing = sorted(set(quantities) - found)
+        if missing:
+            return JSONResponse({"error": "Products not found", "product_ids": missing}, status_code=404)
+        items.clear()
+        items.update(quantities)
+
+    return await update_guest_cart(db, cart_token, replace)
+
+
+async def guest_delete_from_cart_view(db: AsyncSession, cart_token: str | None, product_id: int):
+    async def remove(items):
+        items.pop(product_id, None)
+
+    return await update_guest_cart(db, cart_token, remove)
+
+
+async def add_pincode_view(db: AsyncSession, user: dict, pincode_data: PincodeBase):
     try:
-        exists = db.query(Pincode).filter(Pincode.pincode == pincode_data.pincode).first()
+        exists = await db.scalar(select(Pincode).where(Pincode.pincode == pincode_data.pincode))
         if exists:
             return JSONResponse({"msg": "Pincode already exists"}, status_code=400)
 
         db_pincode = Pincode(pincode=pincode_data.pincode, active=pincode_data.active)
         db.add(db_pincode)
-        db.commit()
-        db.refresh(db_pincode)
+        await db.commit()
+        await db.refresh(db_pincode)
+        await invalidate_tags("pincodes")
 
         return JSONResponse({"msg": "Pincode Added"})
     except Exception as e:
@@ -322,15 +719,16 @@ async def add_pincode_view(db: Session, user: dict, pincode_data: PincodeBase):
 
 
 # Update Pincode
-async def update_pincode_view(db: Session, pincode_id:int, pincode_data: UpdatePincodeBase):
+async def update_pincode_view(db: AsyncSession, pincode_id:int, pincode_data: UpdatePincodeBase):
     try:
-        pincode_obj = db.query(Pincode).filter(Pincode.id == pincode_id).first()
+        pincode_obj = await db.get(Pincode, pincode_id)
         if not pincode_obj:
             return JSONResponse({"msg": "Pincode not found"}, status_code=404)
 
         pincode_obj.active = pincode_data.active
-        db.commit()
-        db.refresh(pincode_obj)
+        await db.commit()
+        await db.refresh(pincode_obj)
+        await invalidate_tags("pincodes")
 
         return JSONResponse({"msg": "Pincode updated successfully"})
     except Exception as e:
@@ -338,27 +736,31 @@ async def update_pincode_view(db: Session, pincode_id:int, pincode_data: UpdateP
     
 
 # Pincodes List
-async def pincodes_list_view(db: Session, user: dict):
-    pincodes = db.query(Pincode)
-    return pincodes
+async def pincodes_list_view(
+    db: AsyncSession, response: Response, user: dict, cursor: str = None, limit: int = None, with_total: bool = False
+):
+    pincodes = await paginate(db, select(Pincode), Pincode.id, response, cursor, limit, with_total)
+    return [PincodeBase.model_validate(pincode, from_attributes=True).model_dump() for pincode in pincodes]
 
 
-async def check_pincode_delivery_view(db: Session, pincode: str):
-    availabilty = db.query(Pincode).filter(Pincode.pincode == pincode, Pincode.active == True).first()
-    return JSONResponse({"available": True if availabilty else False})
+async def check_pincode_delivery_view(db: AsyncSession, pincode: str):
+    availabilty = await db.scalar(select(Pincode).where(Pincode.pincode == pincode, Pincode.active == True))
+    return {"available": True if availabilty else False}
 
 
 # Orders List -------------------------------------------------------------
-async def user_orders_list_view(db: Session, user: dict):
+async def user_orders_list_view(db: AsyncSession, user: dict):
     orders = (
-        db.query(Order)
-        .filter(
-            Order.user_id == user["id"],
-            Order.status != "EXPIRED"  # 👈 exclude EXPIRED orders
+        await db.scalars(
+            select(Order)
+            .where(
+                Order.user_id == user["id"],
+                Order.status != "EXPIRED"  # 👈 exclude EXPIRED orders
+            )
+            .order_by(Order.id.desc())
+            .options(selectinload(Order.product))
         )
-        .order_by(Order.id.desc())
-        .all()
-    )
+    ).all()
 
     if orders:
         return [await UserOrderBase.get_image_data(order) for order in orders]
@@ -367,8 +769,10 @@ async def user_orders_list_view(db: Session, user: dict):
 
 
 # User Order Detail
-async def user_order_detail_view(db: Session, user: dict, order_id: int):
-    order = db.query(Order).filter(Order.id == order_id, Order.user_id == user["id"]).first()
+async def user_order_detail_view(db: AsyncSession, user: dict, order_id: int):
+    order = await db.scalar(
+        select(Order).where(Order.id == order_id, Order.user_id == user["id"]).options(*ORDER_DETAIL_LOADS)
+    )
     if order:
         return await UserOrderDetailBase.get_data(order, db)
 
@@ -377,7 +781,7 @@ async def user_order_detail_view(db: Session, user: dict, order_id: int):
 
 # Order Cancel Request
 async def order_cancel_request_view(db, order_id, order_data, user):
-    order = db.query(Order).filter(Order.id == order_id, Order.user_id == user["id"]).first()
+    order = await db.scalar(select(Order).where(Order.id == order_id, Order.user_id == user["id"]))
 
     if not order:
         return JSONResponse({"message": "Order not found"}, status_code=404)
@@ -399,8 +803,8 @@ async def order_cancel_request_view(db, order_id, order_data, user):
     order.status = "CANCELLED REQUEST"
 
     print("order staus 2 ", order.status)
-    db.commit()
-    db.refresh(order)
+    await db.commit()
+    await db.refresh(order)
 
     return JSONResponse({
         "message": "We've received your cancellation request. It will be reviewed and processed within 3–4 business days."
@@ -409,30 +813,30 @@ async def order_cancel_request_view(db, order_id, order_data, user):
 
 
 # Orders List - Admin
-async def orders_list_view(db: Session, status: str = None, delivery_status: str = None, product_name: str = None):
-    query = db.query(Order).order_by(Order.id.desc())
+async def orders_list_view(
+    db: AsyncSession, response: Response, status: str = None, delivery_status: str = None, product_name: str = None,
+    cursor: str = None, limit: int = None, with_total: bool = False
+):
+    query = select(Order).options(*ORDER_DETAIL_LOADS)
 
     # Only join Product table if filtering by product_name
     if product_name:
-        query = query.join(Order.product).filter(Product.name.ilike(f"%{product_name}%"))
+        query = query.join(Order.product).where(await product_search_filter(db, product_name))
     
     if status:
-        query = query.filter(Order.status == status)
+        query = query.where(Order.status == status)
     
     if delivery_status:
-        query = query.filter(Order.delivery_status == delivery_status)
+        query = query.where(Order.delivery_status == delivery_status)
     
-    orders = query.all()
+    orders = await paginate(db, query, Order.id, response, cursor, limit, with_total)
     
-    if orders:
-        return [await AdminOrderBase.get_data(order) for order in orders]
-    
-    return JSONResponse([])
+    return [await AdminOrderBase.get_data(order) for order in orders]
 
 
 # Get Order Details for admin
-async def admin_order_detail_view(db: Session, order_id: int):
-    order = db.query(Order).filter(Order.id == order_id).first()
+async def admin_order_detail_view(db: AsyncSession, order_id: int):
+    order = await db.scalar(select(Order).where(Order.id == order_id).options(*ORDER_DETAIL_LOADS))
     if not order:
         return JSONResponse({"error": "Order not exists"}, status_code=404)
     
@@ -440,29 +844,31 @@ async def admin_order_detail_view(db: Session, order_id: int):
 
 
 # Get Order Counts
-async def admin_orders_count_view(db: Session):
+async def admin_orders_count_view(db: AsyncSession):
     try:
         return JSONResponse({
-            "total_orders": db.query(Order).count(),
-            "pending_orders": db.query(Order).filter(Order.status == "PENDING").count(),
-            "success_orders": db.query(Order).filter(Order.status == "SUCCESS").count(),
-            "delivery_pending": db.query(Order).filter(Order.delivery_status == "PENDING").count(),
-            "delivery_success": db.query(Order).filter(Order.delivery_status == "SUCCESS").count(),
+            "total_orders": await db.scalar(select(func.count(Order.id))),
+            "pending_orders": await db.scalar(select(func.count(Order.id)).where(Order.status == "PENDING")),
+            "success_orders": await db.scalar(select(func.count(Order.id)).where(Order.status == "SUCCESS")),
+            "delivery_pending": await db.scalar(select(func.count(Order.id)).where(Order.delivery_status == "PENDING")),
+            "delivery_success": await db.scalar(select(func.count(Order.id)).where(Order.delivery_status == "SUCCESS")),
         })
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=400)
 
 
-async def admin_latest_orders_view(db: Session, status: str):
-    orders = db.query(Order).filter(Order.status == status).order_by(Order.created_on.desc()).limit(5)
+async def admin_latest_orders_view(db: AsyncSession, status: str):
+    orders = (await db.scalars(
+        select(Order).where(Order.status == status).order_by(Order.created_on.desc()).limit(5).options(*ORDER_DETAIL_LOADS)
+    )).all()
     if orders:
         return [await LatestOrdersBase.get_data(order) for order in orders]
     return JSONResponse([])
 
 
 # Add Order
-async def add_order_view(db: Session, order: CreateOrderBase, user: dict):
-    product = db.query(Product).filter(id=order.product_id).first()
+async def add_order_view(db: AsyncSession, order: CreateOrderBase, user: dict):
+    product = await db.get(Product, order.product_id)
     if not product:
         return JSONResponse({"error": "Product not exists"}, status_code=404)
 
@@ -474,15 +880,15 @@ async def add_order_view(db: Session, order: CreateOrderBase, user: dict):
     )
 
     db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
+    await db.commit()
+    await db.refresh(db_order)
 
     return db_order
 
 
 # Upadte Order - Admin
 async def update_order_view(db, user, order_id, order_data):
-    order = db.query(Order).filter(Order.id == order_id).first()
+    order = await db.get(Order, order_id)
     
     if not order:
         return JSONResponse({"message": "Order not exists"})
@@ -490,78 +896,111 @@ async def update_order_view(db, user, order_id, order_data):
     for field, value in order_data.dict(exclude_unset=True).items():
         setattr(order, field, value)
 
-    db.commit()
-    db.refresh(order)
+    await db.commit()
+    await db.refresh(order)
     return JSONResponse({"message": "Order updated successfully"})
 
 
 
-async def checkout_view(db: Session, user: dict, checkout_data: CheckoutBase):
+# Codes are not unique, the oldest one with the code is the one that is used
+def first_promocode_id(code: str):
+    return select(Promocode.id).where(Promocode.promocode == code).order_by(Promocode.id).limit(1).scalar_subquery()
+
+
+# Take one use of a promocode, the conditions and the decrement are one statement so it can not be oversold
+async def redeem_promocode(db: AsyncSession, code: str):
+    promocode_id = first_promocode_id(code)
+    discount = await db.scalar(
+        update(Promocode)
+        .where(
+            Promocode.id == promocode_id,
+            Promocode.available == True,
+            Promocode.quantity > 0,
+            or_(Promocode.expired_on.is_(None), Promocode.expired_on >= datetime.now().date()),
+        )
+        .values(quantity=Promocode.quantity - 1)
+        .returning(Promocode.amount)
+    )
+    if discount is not None:
+        return discount, None
+
+    # Only the failure path reads the promocode, to say why it was refused
+    promocode = await db.scalar(select(Promocode).where(Promocode.id == promocode_id))
+    if not promocode:
+        return None, JSONResponse({"message": "Promocode not found"}, status_code=404)
+    if promocode.expired_on and promocode.expired_on < datetime.now().date():
+        return None, JSONResponse({"message": "Promocode expired"}, status_code=400)
+    return None, JSONResponse({"message": "Promocode is not available"}, status_code=400)
+
+
+# Undo a checkout the gateway did not take, its promocode use is given back and its rows are kept as FAILED
+async def fail_checkout(db: AsyncSession, payment: Payment, order_ids: list, promocode: str | None):
+    try:
+        if promocode:
+            await db.execute(
+                update(Promocode).where(Promocode.id == first_promocode_id(promocode)).values(quantity=Promocode.quantity + 1)
+            )
+        await db.execute(update(Order).where(Order.id.in_(order_ids)).values(status="FAILED"))
+        await db.execute(update(Payment).where(Payment.id == payment.id).values(status="FAILED"))
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        logger.exception("Could not mark checkout of payment %s as failed", payment.id)
+
+
+async def checkout_view(db: AsyncSession, user: dict, checkout_data: CheckoutBase):
     
-    # Get user cart
-    cart = db.query(Cart).filter(Cart.user_id == user['id']).first()
+    # Get user cart, its lines and their totals in one query
+    cart = await load_cart(db, user["id"])
     if not cart:
         return JSONResponse({"error": "Cart not exists"}, status_code=404)
     
     # If cart does not have product
-    if not cart.products:
+    if not cart["products"]:
         return JSONResponse({"error": "Cart is empty"}, status_code=400)
-    
-    # Check if promocode used
-    promocode_discount_percentage = 0
-    if checkout_data.promocode:
-        promocode = db.query(Promocode).filter(Promocode.promocode == checkout_data.promocode).first()
-
-        # Check promocode validity
-        if promocode.expired_on < datetime.now().date():
-            return JSONResponse({"message": "Promocode expired"}, status_code=400)
-        
-        if promocode.quantity <= 0 or not promocode.available: 
-            return JSONResponse({"message": "Promocode is not available"}, status_code=400)
-        
-        promocode.quantity = promocode.quantity - 1
-        promocode_discount_percentage = promocode.amount
-        db.commit()
-
-        
-    total_amount = 0
-    orders = ""
-
-    for product in cart.products:
 
-        # Create Order   
-        db_order = Order(
-            product_id=product.id, 
-            user_id=user["id"],
-            address=checkout_data.address,
-            total_amount=product.sale_price
+    # Promocode, orders and payment are committed as PENDING before Cashfree is called, so no connection or
+    # promocode lock is held during the call and the webhook always finds the payment it names
+    try:
+        promocode_discount_percentage = 0
+        if checkout_data.promocode:
+            promocode_discount_percentage, error = await redeem_promocode(db, checkout_data.promocode)
+            if error:
+                await db.rollback()
+                return error
+
+        # One INSERT ... RETURNING for every order of the cart, the ids are only joined so their order does not matter
+        order_ids = (await db.scalars(
+            insert(Order).returning(Order.id),
+            [
+                {
+                    "product_id": product["id"],
+                    "user_id": user["id"],
+                    "address": checkout_data.address,
+                    "quantity": product["cart_quantity"],
+                    "total_amount": product["line_total"],
+                }
+                for product in cart["products"]
+            ],
+        )).all()
+
+        # If promocode applied then less the amount
+        total_amount = cart["subtotal"]
+        if promocode_discount_percentage:
+            discount_amount = (total_amount * promocode_discount_percentage) / 100
+            total_amount = total_amount - discount_amount
+
+        # Add Payment
+        db_payment = Payment(
+            amount_paid=total_amount, orders=",".join(map(str, order_ids)), address=checkout_data.address, 
+            customer_phone=checkout_data.customer_phone, user_id= user['id'], 
+            promocode=checkout_data.promocode
         )
-        db.add(db_order)
-        db.commit()
-        db.refresh(db_order)
-
-        # Calculate Total Price
-        total_amount += product.sale_price
-        if orders:
-            orders += f",{db_order.id}"
-        else:
-            orders += f"{db_order.id}"
-
-    # If promocode applied then less the amount
-    if promocode_discount_percentage:
-        discount_amount = (total_amount * promocode_discount_percentage) / 100
-        total_amount = total_amount - discount_amount
-
-    # Add Payment
-    db_payment = Payment(
-        amount_paid=total_amount, orders=orders, address=checkout_data.address, 
-        customer_phone=checkout_data.customer_phone, user_id= user['id'], 
-        promocode=checkout_data.promocode
-    )
-
-    db.add(db_payment)
-    db.commit()
-    db.refresh(db_payment)
+        db.add(db_payment)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        return JSONResponse({"error": str(e)}, status_code=400)
 
     # Cashfree Data
     url = "https://sandbox.cashfree.com/pg/orders"
@@ -587,27 +1026,35 @@ async def checkout_view(db: Session, user: dict, checkout_data: CheckoutBase):
         "Content-Type": "application/json"
     }
 
-    response = requests.post(url=url, json=payload, headers=headers)
-    
-    if response.status_code != 200:
-        return JSONResponse(response.json(), status_code=response.status_code)
-    
-    cashfree_data = response.json()
+    # requests blocks, keep it off the event loop
+    try:
+        response = await run_in_threadpool(requests.post, url=url, json=payload, headers=headers, timeout=CASHFREE_TIMEOUT)
+        cashfree_data = response.json()
+        if response.status_code != 200:
+            await fail_checkout(db, db_payment, order_ids, checkout_data.promocode)
+            return JSONResponse(cashfree_data, status_code=response.status_code)
+        session_id = cashfree_data["payment_session_id"]
+    except Exception as e:
+        await fail_checkout(db, db_payment, order_ids, checkout_data.promocode)
+        return JSONResponse({"error": f"Payment gateway error: {e}"}, status_code=502)
 
-    db_payment.transaction_no = cashfree_data["order_id"]
-    db.commit()
-    db.refresh(db_payment)
+    # Cashfree has the order now, the webhook finds the payment by its id even if this write is lost
+    try:
+        db_payment.transaction_no = cashfree_data.get("order_id")
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        logger.exception("Could not store the Cashfree order of payment %s", db_payment.id)
 
-    
-    return JSONResponse({"session_id": cashfree_data["payment_session_id"]})
+    return JSONResponse({"session_id": session_id})
 
 
-async def cashfree_webhook_view(db: Session, data: dict):
+async def cashfree_webhook_view(db: AsyncSession, data: dict):
     data = data.model_dump()
 
     db_payment_webhook = PaymentWebhook(data=str(data))
     db.add(db_payment_webhook)
-    db.commit()
+    await db.commit()
 
     if not "data" in data.keys():
         return
@@ -623,13 +1070,17 @@ async def cashfree_webhook_view(db: Session, data: dict):
     payment_id = order["order_tags"]["payment_id"]
 
     # Get Payment
-    payment = db.query(Payment).filter(Payment.id == int(payment_id)).first()
+    payment = await db.scalar(select(Payment).where(Payment.id == int(payment_id)).options(selectinload(Payment.user)))
+    if not payment:
+        return
 
     # Payment - Success or User Drop - User Drop Validation Remaaining
     payment.status = cashfree_payment["payment_status"]
-    payment.paid_on = cashfree_payment["payment_time"]
-    db.commit()
-    db.refresh(payment)
+    # Sessions keep their instances after a commit, so paid_on has to be a datetime already for the
+    # confirmation mail. Cashfree sends ISO 8601 with an offset, the column stores its local time
+    if cashfree_payment.get("payment_time"):
+        payment.paid_on = datetime.fromisoformat(cashfree_payment["payment_time"]).replace(tzinfo=None)
+    await db.commit()
 
     if payment.status == "SUCCESS":
         await do_orders_success(db, payment)
@@ -637,12 +1088,13 @@ async def cashfree_webhook_view(db: Session, data: dict):
     return
 
 
-async def payments_view(db: Session):
-    payments = db.query(Payment).order_by(Payment.id.desc())
-    return payments
+async def payments_view(
+    db: AsyncSession, response: Response, cursor: str = None, limit: int = None, with_total: bool = False
+):
+    return await paginate(db, select(Payment), Payment.id, response, cursor, limit, with_total)
 
 
-async def cashfree_view(db: Session):
+async def cashfree_view(db: AsyncSession):
     url = "https://sandbox.cashfree.com/pg/orders"
     payload = {
         "order_currency": "INR",
@@ -665,9 +1117,11 @@ async def cashfree_view(db: Session):
     return JSONResponse(response.json(), status_code=response.status_code)
 
 
-async def product_rating_review_view(db: Session, product_id: int):
+async def product_rating_review_view(db: AsyncSession, product_id: int):
     # try:
-    product_ratings = db.query(RatingReview).filter(RatingReview.product_id == product_id).all()
+    product_ratings = (await db.scalars(
+        select(RatingReview).where(RatingReview.product_id == product_id).options(selectinload(RatingReview.user))
+    )).all()
 
     if not product_ratings:
         return JSONResponse(
@@ -710,19 +1164,19 @@ async def product_rating_review_view(db: Session, product_id: int):
     #     return JSONResponse({"error": str(e)}, status_code=400)
 
 
-async def add_product_rating_view(db: Session, user: dict, data: AddProductRatingReviewBase):
+async def add_product_rating_view(db: AsyncSession, user: dict, data: AddProductRatingReviewBase):
     try:
         data = data.model_dump()
         
-        product = db.query(Product).filter(Product.id == data['product_id']).first()
+        product = await db.get(Product, data['product_id'])
         if not product:
             return JSONResponse({"error": "Product not exists"}, status_code=404)
         # Add data in table
 
-        product_rating = db.query(RatingReview).filter(
+        product_rating = await db.scalar(select(RatingReview).where(
             RatingReview.product_id == data["product_id"],
             RatingReview.user_id == user["id"]
-        ).first()
+        ))
 
         if not product_rating:
             product_rating = RatingReview(
@@ -733,7 +1187,8 @@ async def add_product_rating_view(db: Session, user: dict, data: AddProductRatin
             )
 
             db.add(product_rating)
-            db.commit()    
+            await db.commit()    
+            await invalidate_tags("reviews")
 
             return JSONResponse({"msg": "Success"})
         
@@ -743,26 +1198,29 @@ async def add_product_rating_view(db: Session, user: dict, data: AddProductRatin
         if data.get("review", None):
             product_rating.reveiew = data["review"]
 
-        db.commit()
+        await db.commit()
+        await invalidate_tags("reviews")
         return JSONResponse({"msg": "Success"})
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=400)
     
 
 # Promocodes List
-async def promocodes_list_view(db: Session):
-    promocodes = db.query(Promocode).order_by(Promocode.created_on.desc()).all()
+async def promocodes_list_view(db: AsyncSession):
+    promocodes = (await db.scalars(
+        select(Promocode).order_by(Promocode.created_on.desc()).options(selectinload(Promocode.user))
+    )).all()
     if promocodes:
         return [await PromocodeBase.get_data(promocode) for promocode in promocodes]
     return JSONResponse([])
 
 
 # Add Promocode
-async def add_promocode_view(db: Session, user: dict, promocode: PromocodeActionBase):
+async def add_promocode_view(db: AsyncSession, user: dict, promocode: PromocodeActionBase):
     try:
         promocode_data = promocode.model_dump()
 
-        promocode = db.query(Promocode).filter(Promocode.promocode == promocode_data["promocode"]).first()
+        promocode = await db.scalar(select(Promocode).where(Promocode.promocode == promocode_data["promocode"]))
         if promocode:
             return JSONResponse({"message": "Promocode already exists"}, status_code=400)
 
@@ -776,7 +1234,7 @@ async def add_promocode_view(db: Session, user: dict, promocode: PromocodeAction
         )
 
         db.add(db_promocode)
-        db.commit()
+        await db.commit()
 
         return JSONResponse({"message": "Success"})
     except Exception as e:
@@ -784,21 +1242,20 @@ async def add_promocode_view(db: Session, user: dict, promocode: PromocodeAction
     
     
 # Update Promocode
-async def update_promocode_view(db: Session, promocode_id: int, promocode: PromocodeActionBase):
+async def update_promocode_view(db: AsyncSession, promocode_id: int, promocode: PromocodeActionBase):
     try:
         promocode_data = promocode.model_dump(exclude_unset=True)
 
-        db_promocode = db.query(Promocode).filter(Promocode.id == promocode_id).first()
+        db_promocode = await db.get(Promocode, promocode_id)
 
         if not db_promocode:
             return JSONResponse({"message": "Promocode not found"}, status_code=404)
         
         # Check if the promocode name is being updated to a name that already exists
         if "promocode" in promocode_data:
-            existing = (
-                db.query(Promocode)
-                .filter(Promocode.promocode == promocode_data["promocode"], Promocode.id != promocode_id)
-                .first()
+            existing = await db.scalar(
+                select(Promocode)
+                .where(Promocode.promocode == promocode_data["promocode"], Promocode.id != promocode_id)
             )
             if existing:
                 return JSONResponse({"message": "Promocode with this name already exists"}, status_code=400)
@@ -807,8 +1264,8 @@ async def update_promocode_view(db: Session, promocode_id: int, promocode: Promo
         for key, value in promocode_data.items():
             setattr(db_promocode, key, value)
 
-        db.commit()
-        db.refresh(db_promocode)
+        await db.commit()
+        await db.refresh(db_promocode)
 
         return JSONResponse({"message": "Promocode updated successfully"})
     except Exception as e:
@@ -817,9 +1274,9 @@ async def update_promocode_view(db: Session, promocode_id: int, promocode: Promo
     
 
 # Apply Promocode
-async def apply_promocode_view(db: Session, promocode: str):
+async def apply_promocode_view(db: AsyncSession, promocode: str):
     try:
-        promocode = db.query(Promocode).filter(Promocode.promocode == promocode).first()
+        promocode = await db.scalar(select(Promocode).where(Promocode.promocode == promocode))
 
         if not promocode:
             return JSONResponse({"message": "Invalid Promocode"}, status_code=400)
@@ -837,8 +1294,8 @@ async def apply_promocode_view(db: Session, promocode: str):
 
 
 # Get Promocode
-async def get_promocode_view(db: Session, promocode: str):
-    promocode = db.query(Promocode).filter(Promocode.promocode == promocode).first()
+async def get_promocode_view(db: AsyncSession, promocode: str):
+    promocode = await db.scalar(select(Promocode).where(Promocode.promocode == promocode))
     
     if not promocode:
         return JSONResponse({"message": "Invalid Promocode"}, status_code=400)
@@ -847,15 +1304,15 @@ async def get_promocode_view(db: Session, promocode: str):
 
 
 # Delete Promocode
-async def delete_promocode_view(db: Session, promocode_id: int):
+async def delete_promocode_view(db: AsyncSession, promocode_id: int):
     try:
-        db_promocode = db.query(Promocode).filter(Promocode.id == promocode_id).first()
+        db_promocode = await db.get(Promocode, promocode_id)
 
         if not db_promocode:
             return JSONResponse({"messgae": "Promocode not found"}, status_code=404)
 
-        db.delete(db_promocode)
-        db.commit()
+        await db.delete(db_promocode)
+        await db.commit()
 
         return JSONResponse({"message": "Promocode deleted successfully"}, status_code=200)
 
@@ -865,44 +1322,51 @@ async def delete_promocode_view(db: Session, promocode_id: int):
 
 # Page Section -------------------------------------
 async def get_page_section_view(db, page_url, name):
-    query = db.query(PageSection)
+    query = select(PageSection)
 
     if page_url:
-        query = query.filter(PageSection.page_url == page_url)
+        query = query.where(PageSection.page_url == page_url)
 
     if name:
-        query = query.filter(PageSection.name == name)
+        query = query.where(PageSection.name == name)
 
-    return query.all()
+    page_sections = (await db.scalars(query)).all()
+    return [
+        {
+            **PageSectionBase.model_validate(section, from_attributes=True).model_dump(),
+            "variants": variant_urls(section.image_url, section.variants_ready),
+        }
+        for section in page_sections
+    ]
 
 
 async def add_page_section_view(db, page_url, name, image):
     try: 
-        page_section_exists = db.query(PageSection).filter(PageSection.name == name).first()
+        page_section_exists = await db.scalar(select(PageSection).where(PageSection.name == name))
         if page_section_exists:
             return JSONResponse({"message": "Name already exists"}, status_code=400)
-        
-        current_time = datetime.now()
-        timestamp = datetime.timestamp(current_time)
-
-        image_url = f"page-section/{int(timestamp)}_{image.filename}"
 
-        file_content = await image.read()
-        
-        file_obj = io.BytesIO(file_content)
+        error = check_image_upload(image)
+        if error:
+            return error
 
-        file_aws_url = upload_to_s3(file_obj, image_url, image.content_type)
+        key, variants_ready = await store_image(db, image)
         
         db_page_section = PageSection(
-            page_url=page_url, name=name, image_url=file_aws_url
+            page_url=page_url, name=name, image_url=storage.public_url(key), variants_ready=variants_ready
         )
         
         db.add(db_page_section)
-        db.commit()
-        db.refresh(db_page_section)
+        await db.commit()
+        await db.refresh(db_page_section)
+        await invalidate_tags("page-section")
+
+        if not variants_ready:
+            await schedule_variants(image.file, key.removeprefix("media/"), lambda: media_variants_ready(key))
         
         return JSONResponse({"message": "Page Section Created"}, status_code=200)
     except Exception as e:
+        await db.rollback()
         return JSONResponse({"error": str(e)}, status_code=400)
     
 
@@ -910,7 +1374,7 @@ async def add_page_section_view(db, page_url, name, image):
 async def update_page_section_view(db, pagesection_id, page_url, name, image):
     try:
         # Get existing section
-        page_section = db.query(PageSection).filter(PageSection.id == pagesection_id).first()
+        page_section = await db.get(PageSection, pagesection_id)
         if not page_section:
             return JSONResponse({"message": "Page section not found"}, status_code=404)
 
@@ -925,24 +1389,64 @@ async def update_page_section_view(db, pagesection_id, page_url, name, image):
             page_section.page_url = page_url
 
         if image:
-            current_time = datetime.now()
-            timestamp = datetime.timestamp(current_time)
-            image_url = f"page-section/{int(timestamp)}_{image.filename}"
+            error = check_image_upload(image)
+            if error:
+                return error
 
-            file_content = await image.read()
-            file_obj = io.BytesIO(file_content)
+            key, variants_ready = await store_image(db, image)
+            await release_media(db, page_section.image_url)
+            page_section.image_url = storage.public_url(key)
+            page_section.variants_ready = variants_ready
 
-            file_aws_url = upload_to_s3(file_obj, image_url, image.content_type)
-            page_section.image_url = file_aws_url
+        await db.commit()
+        await db.refresh(page_section)
+        await invalidate_tags("page-section")
 
-        db.commit()
-        db.refresh(page_section)
+        if image and not variants_ready:
+            await schedule_variants(image.file, key.removeprefix("media/"), lambda: media_variants_ready(key))
 
         return JSONResponse({"message": "Page Section Updated"}, status_code=200)
 
     except Exception as e:
+        await db.rollback()
         return JSONResponse({"error": str(e)}, status_code=400)
-    
-
 
 
+# Create a page section, or replace the image of `pagesection_id`, from a presigned upload
+async def finalize_page_section_view(db: AsyncSession, data: FinalizePageSectionBase):
+    try:
+        if data.pagesection_id:
+            page_section = await db.get(PageSection, data.pagesection_id)
+            if not page_section:
+                return JSONResponse({"message": "Page section not found"}, status_code=404)
+        else:
+            if not data.name or not data.page_url:
+                return JSONResponse({"message": "page_url and name are required"}, status_code=400)
+            page_section_exists = await db.scalar(select(PageSection).where(PageSection.name == data.name))
+            if page_section_exists:
+                return JSONResponse({"message": "Name already exists"}, status_code=400)
+            page_section = PageSection(name=data.name)
+
+        variants_ready, error = await acquire_stored_image(db, data.key)
+        if error:
+            return error
+
+        if data.pagesection_id:
+            await release_media(db, page_section.image_url)
+        db.add(page_section)
+        if data.page_url:
+            page_section.page_url = data.page_url
+        page_section.image_url = storage.public_url(data.key)
+        page_section.variants_ready = variants_ready
+
+        await db.commit()
+        await db.refresh(page_section)
+        await invalidate_tags("page-section")
+
+        if not variants_ready:
+            schedule_stored_variants(data.key.removeprefix("media/"), lambda: media_variants_ready(data.key))
+
+        return JSONResponse({"message": "Page Section Updated" if data.pagesection_id else "Page Section Created"}, status_code=200)
+    except Exception as e:
+        await db.rollback()
+        return JSONResponse({"error": str(e)}, status_code=400)
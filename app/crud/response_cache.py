@@ -0,0 +1,341 @@
+import os
+import math
+import time
+import hashlib
+import logging
+import functools
+import orjson
+from collections import Counter
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy.ext.asyncio import AsyncSession
+from dotenv import load_dotenv
+
+from .cache import LRUTTLCache, MISSING, REDIS_URL, CACHE_BACKEND
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = os.environ.get("CACHE_PREFIX", "alq")
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 1024))
+# Seconds a tag version is kept after its last bump, entries never outlive it so a version that
+# expired and restarted at 0 can not bring back an entry stored under the old 0
+TAG_VERSION_TTL = int(os.environ.get("CACHE_TAG_VERSION_TTL", 24 * 3600))
+# How long a client keeps reading from the primary after it wrote something, and how long after an
+# invalidation cache entries are filled from the primary, replicas may not have the write before that
+READ_YOUR_WRITES_SECONDS = float(os.environ.get("DB_READ_YOUR_WRITES_SECONDS", 5))
+
+
+class MemoryBackend:
+    """Per-process backend, every worker keeps its own copy."""
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE):
+        self.entries = LRUTTLCache(maxsize=maxsize)
+        # tag -> (expires at, version), never evicted early for the reason given at TAG_VERSION_TTL
+        self.versions = {}
+        # tag -> when it was last bumped
+        self.bumped_at = {}
+
+    async def get(self, key: str):
+        value = self.entries.get(key)
+        return None if value is MISSING else value
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        self.entries.set(key, value, ttl)
+
+    async def pop(self, key: str):
+        value = self.entries.pop(key)
+        return None if value is MISSING else value
+
+    def _version(self, tag: str, now: float):
+        expires_at, version = self.versions.get(tag, (now, 0))
+        return version if expires_at > now else 0
+
+    async def get_versions(self, tags):
+        now = time.monotonic()
+        return [self._version(tag, now) for tag in tags]
+
+    async def bump_versions(self, tags):
+        now = time.monotonic()
+        # Per-user tags come and go, drop the expired ones now and then
+        if len(self.versions) > 10000:
+            for tag, (expires_at, _) in list(self.versions.items()):
+                if expires_at <= now:
+                    self.versions.pop(tag, None)
+            for tag, bumped_at in list(self.bumped_at.items()):
+                if bumped_at <= now - READ_YOUR_WRITES_SECONDS:
+                    self.bumped_at.pop(tag, None)
+        for tag in tags:
+            self.versions[tag] = (now + TAG_VERSION_TTL, self._version(tag, now) + 1)
+            self.bumped_at[tag] = now
+
+    async def recently_bumped(self, tags):
+        now = time.monotonic()
+        return any(now - self.bumped_at.get(tag, -math.inf) < READ_YOUR_WRITES_SECONDS for tag in tags)
+
+
+class FakeRedis:
+    """In-process stand-in for the few redis commands RedisBackend uses."""
+
+    def __init__(self):
+        self._data = {}
+
+    def _read(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    async def get(self, key):
+        return self._read(key)
+
+    async def mget(self, keys):
+        return [self._read(key) for key in keys]
+
+    async def set(self, key, value, ex=None):
+        self._data[key] = (time.monotonic() + ex if ex else None, value)
+        return True
+
+    async def getdel(self, key):
+        value = self._read(key)
+        self._data.pop(key, None)
+        return value
+
+    async def incr(self, key):
+        value = int(self._read(key) or 0) + 1
+        # Like redis, INCR keeps the key's expiry
+        expires_at = self._data[key][0] if key in self._data else None
+        self._data[key] = (expires_at, str(value).encode())
+        return value
+
+    async def expire(self, key, seconds):
+        if self._read(key) is None:
+            return False
+        self._data[key] = (time.monotonic() + seconds, self._data[key][1])
+        return True
+
+    async def delete(self, *keys):
+        return sum(self._data.pop(key, None) is not None for key in keys)
+
+
+class RedisBackend:
+    """Shared across workers, entries live in redis under CACHE_PREFIX."""
+
+    def __init__(self, client, prefix: str = CACHE_PREFIX):
+        self.client = client
+        self.prefix = prefix
+
+    def version_key(self, tag: str):
+        return f"{self.prefix}:version:{tag}"
+
+    def bumped_key(self, tag: str):
+        return f"{self.prefix}:bumped:{tag}"
+
+    async def get(self, key: str):
+        return await self.client.get(f"{self.prefix}:{key}")
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        await self.client.set(f"{self.prefix}:{key}", value, ex=ttl)
+
+    async def pop(self, key: str):
+        # Read and delete in one command, two callers can never both get the value
+        return await self.client.getdel(f"{self.prefix}:{key}")
+
+    async def get_versions(self, tags):
+        if not tags:
+            return []
+        values = await self.client.mget([self.version_key(tag) for tag in tags])
+        return [int(value) if value else 0 for value in values]
+
+    async def bump_versions(self, tags):
+        for tag in tags:
+            await self.client.incr(self.version_key(tag))
+            await self.client.expire(self.version_key(tag), TAG_VERSION_TTL)
+            if READ_YOUR_WRITES_SECONDS > 0:
+                await self.client.set(self.bumped_key(tag), b"1", ex=math.ceil(READ_YOUR_WRITES_SECONDS))
+
+    async def recently_bumped(self, tags):
+        if not tags:
+            return False
+        return any(await self.client.mget([self.bumped_key(tag) for tag in tags]))
+
+
+def create_backend(name: str = CACHE_BACKEND, maxsize: int = RESPONSE_CACHE_SIZE):
+    if name == "redis":
+        try:
+            from redis import asyncio as aioredis
+        except ImportError:
+            import aioredis
+        return RedisBackend(aioredis.from_url(REDIS_URL))
+
+    if name == "fakeredis":
+        return RedisBackend(FakeRedis())
+
+    return MemoryBackend(maxsize)
+
+
+backend = create_backend()
+cache_stats = {"hits": Counter(), "misses": Counter(), "errors": Counter()}
+
+
+def make_key(namespace: str, name: str, params: dict, versions: list):
+    digest = hashlib.sha1(orjson.dumps([params, versions], option=orjson.OPT_SORT_KEYS)).hexdigest()
+    return f"{namespace}:{name}:{digest}"
+
+
+async def fill_from_primary(db: AsyncSession | None, tags):
+    """Send `db` to the primary when one of `tags` was just invalidated.
+
+    The entry about to be stored lives under the new tag versions, filled from a replica
+    that has not caught up yet it would serve the old data until its TTL runs out.
+    """
+    if db is None or not db.info.get("use_replica"):
+        return
+    try:
+        fresh = await backend.recently_bumped(tags)
+    except Exception as e:
+        logger.warning("Response cache read failed for %s: %s", tags, e)
+        fresh = True
+    if fresh:
+        db.info["use_replica"] = False
+
+
+def cached(namespace: str, ttl: int = 60, tags: tuple = ()):
+    """Cache a route's JSON result under `namespace` until `ttl` runs out or one of its `tags` is invalidated.
+
+    Only plain (str, int, float, bool, None) arguments go into the key, so routes
+    must not return per-user data through this decorator. Responses returned
+    directly (errors, custom status codes) are never cached.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            params = {
+                name: value for name, value in kwargs.items()
+                if value is None or isinstance(value, (str, int, float, bool))
+            }
+            response = next((value for value in kwargs.values() if isinstance(value, Response)), None)
+
+            try:
+                key = make_key(namespace, func.__name__, params, await backend.get_versions(tags))
+                payload = await backend.get(key)
+            except Exception as e:
+                logger.warning("Response cache read failed for %s: %s", namespace, e)
+                cache_stats["errors"][namespace] += 1
+                return await func(*args, **kwargs)
+
+            if payload is not None:
+                cache_stats["hits"][namespace] += 1
+                entry = orjson.loads(payload)
+                if response is not None:
+                    response.headers.update(entry["headers"])
+                return entry["data"]
+
+            cache_stats["misses"][namespace] += 1
+            await fill_from_primary(next((value for value in kwargs.values() if isinstance(value, AsyncSession)), None), tags)
+            result = await func(*args, **kwargs)
+            if isinstance(result, Response):
+                return result
+
+            entry = {"data": jsonable_encoder(result), "headers": dict(response.headers) if response else {}}
+            try:
+                await backend.set(key, orjson.dumps(entry, option=orjson.OPT_NON_STR_KEYS), min(ttl, TAG_VERSION_TTL))
+            except Exception as e:
+                logger.warning("Response cache write failed for %s: %s", namespace, e)
+                cache_stats["errors"][namespace] += 1
+            return result
+
+        return wrapper
+    return decorator
+
+
+async def cached_value(namespace: str, params: dict, tags: tuple, ttl: int, compute, db: AsyncSession = None):
+    """Cached JSON result of `compute()`, for per-user data the `cached` decorator must not see.
+
+    `params` has to identify whose data it is, `tags` are bumped by the writes that change it.
+    `db` is the session `compute` reads with.
+    """
+    try:
+        key = make_key(namespace, "value", params, await backend.get_versions(tags))
+        payload = await backend.get(key)
+    except Exception as e:
+        logger.warning("Response cache read failed for %s: %s", namespace, e)
+        cache_stats["errors"][namespace] += 1
+        return await compute()
+
+    if payload is not None:
+        cache_stats["hits"][namespace] += 1
+        return orjson.loads(payload)
+
+    cache_stats["misses"][namespace] += 1
+    await fill_from_primary(db, tags)
+    result = jsonable_encoder(await compute())
+    try:
+        await backend.set(key, orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS), min(ttl, TAG_VERSION_TTL))
+    except Exception as e:
+        logger.warning("Response cache write failed for %s: %s", namespace, e)
+        cache_stats["errors"][namespace] += 1
+    return result
+
+
+def make_etag(data):
+    # From the body itself, so every worker agrees on it and it survives restarts and cache misses
+    return f'"{hashlib.sha1(orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)).hexdigest()}"'
+
+
+def etag_matches(request: Request, etag: str):
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [value.strip() for value in if_none_match.split(",")]
+
+
+def conditional(cache_control: str = "public, max-age=60"):
+    """Send a strong ETag, a hash of the route's JSON result, and answer a matching If-None-Match with 304.
+
+    The route still runs, goes above `cached` so a cache hit makes the 304 cost no
+    database query. The route needs `request` and `response` parameters.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            request = next((value for value in kwargs.values() if isinstance(value, Request)), None)
+            response = next((value for value in kwargs.values() if isinstance(value, Response)), None)
+
+            result = await func(*args, **kwargs)
+            if isinstance(result, Response):
+                return result
+
+            result = jsonable_encoder(result)
+            etag = make_etag(result)
+            if etag_matches(request, etag):
+                return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = cache_control
+            return result
+
+        return wrapper
+    return decorator
+
+
+async def invalidate_tags(*tags):
+    try:
+        await backend.bump_versions(tags)
+    except Exception as e:
+        logger.warning("Response cache invalidation failed for %s: %s", tags, e)
+
+
+def get_cache_stats():
+    return {
+        "backend": type(backend).__name__,
+        "hits": dict(cache_stats["hits"]),
+        "misses": dict(cache_stats["misses"]),
+        "errors": dict(cache_stats["errors"]),
+    }
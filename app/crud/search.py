@@ -0,0 +1,151 @@
+import re
+import time
+import asyncio
+from collections import defaultdict
+from sqlalchemy import select, func, or_, literal, literal_column
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.products import Product
+
+
+# Generated tsvector column and pg_trgm index, both created by the add_product_search migration
+search_vector = literal_column("products.search_vector")
+
+# Weight of a match in each field, mirrors the setweight() letters in the migration
+FIELD_WEIGHTS = {"name": 1.0, "category": 0.8, "ingredients": 0.6, "description": 0.4}
+# Smallest trigram similarity a query word needs to count as a (possibly misspelt) match
+MIN_SIMILARITY = 0.3
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text: str | None):
+    return _WORD.findall(text.lower()) if text else []
+
+
+def trigrams(word: str):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ProductSearchIndex:
+    """Pure-Python stand-in for the Postgres search, used on databases without tsvector/pg_trgm."""
+
+    def __init__(self, ttl: float = 60):
+        self.ttl = ttl
+        self.built_at = None
+        # Bumped by every write, a build that overlapped one leaves the index stale
+        self.generation = 0
+        self.lock = asyncio.Lock()
+        self.word_trigrams = {}
+        self.trigram_words = defaultdict(set)
+        self.word_products = defaultdict(dict)
+
+    def mark_stale(self):
+        self.built_at = None
+        self.generation += 1
+
+    def is_stale(self):
+        return self.built_at is None or self.built_at + self.ttl < time.monotonic()
+
+    async def build(self, db: AsyncSession):
+        """Build a new index aside and swap it in at once, searches meanwhile keep using the old one."""
+        generation = self.generation
+        word_trigrams, trigram_words, word_products = {}, defaultdict(set), defaultdict(dict)
+
+        rows = await db.execute(
+            select(Product.id, Product.name, Product.category, Product.ingredients, Product.description)
+        )
+        for row in rows:
+            for field, weight in FIELD_WEIGHTS.items():
+                for word in tokenize(getattr(row, field)):
+                    products = word_products[word]
+                    products[row.id] = max(products.get(row.id, 0), weight)
+
+        for word in word_products:
+            word_trigrams[word] = trigrams(word)
+            for trigram in word_trigrams[word]:
+                trigram_words[trigram].add(word)
+
+        self.word_trigrams, self.trigram_words, self.word_products = word_trigrams, trigram_words, word_products
+        if generation == self.generation:
+            self.built_at = time.monotonic()
+
+    def match_word(self, token: str):
+        """Score every product containing a word close to `token`."""
+        token_trigrams = trigrams(token)
+        candidates = set().union(*(self.trigram_words.get(trigram, ()) for trigram in token_trigrams))
+
+        scores = {}
+        for word in candidates:
+            word_trigrams = self.word_trigrams[word]
+            similarity = len(token_trigrams & word_trigrams) / len(token_trigrams | word_trigrams)
+            if word.startswith(token):
+                similarity = max(similarity, 0.9)
+            if similarity < MIN_SIMILARITY:
+                continue
+            for product_id, weight in self.word_products[word].items():
+                scores[product_id] = max(scores.get(product_id, 0), similarity * weight)
+        return scores
+
+    def search(self, query: str):
+        """Product ids matching every word of `query`, best match first."""
+        ranked = None
+        for token in tokenize(query):
+            scores = self.match_word(token)
+            if ranked is None:
+                ranked = scores
+            else:
+                ranked = {product_id: ranked[product_id] + score for product_id, score in scores.items() if product_id in ranked}
+
+        if not ranked:
+            return []
+        return sorted(ranked, key=lambda product_id: (-ranked[product_id], -product_id))
+
+
+search_index = ProductSearchIndex()
+
+
+def uses_postgres_search(db: AsyncSession):
+    return db.get_bind().dialect.name == "postgresql"
+
+
+async def get_search_index(db: AsyncSession):
+    if search_index.is_stale():
+        # One build at a time, requests that waited for it use its result
+        async with search_index.lock:
+            if search_index.is_stale():
+                await search_index.build(db)
+    return search_index
+
+
+async def product_search_filter(db: AsyncSession, text: str):
+    """WHERE clause matching products for `text`, replacing the old leading-wildcard ILIKE."""
+    if uses_postgres_search(db):
+        return or_(
+            search_vector.op("@@")(func.websearch_to_tsquery("simple", text)),
+            literal(text).op("<%")(Product.name),
+        )
+
+    index = await get_search_index(db)
+    return Product.id.in_(index.search(text))
+
+
+async def search_products(db: AsyncSession, text: str, limit: int, category: str = None):
+    """Products ranked by how well they match `text`, tolerating typos in the product name."""
+    if uses_postgres_search(db):
+        tsquery = func.websearch_to_tsquery("simple", text)
+        rank = func.ts_rank(search_vector, tsquery) + func.word_similarity(text, Product.name)
+        query = select(Product).where(await product_search_filter(db, text)).order_by(rank.desc(), Product.id.desc())
+        if category:
+            query = query.where(Product.category == category)
+        return (await db.scalars(query.limit(limit))).all()
+
+    index = await get_search_index(db)
+    product_ids = index.search(text)
+    query = select(Product).where(Product.id.in_(product_ids))
+    if category:
+        query = query.where(Product.category == category)
+
+    products = {product.id: product for product in (await db.scalars(query)).all()}
+    return [products[product_id] for product_id in product_ids if product_id in products][:limit]
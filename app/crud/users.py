@@ -1,5 +1,8 @@
-from sqlalchemy.orm import Session
+import logging
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from fastapi import Response
 from fastapi.responses import JSONResponse
 from datetime import datetime, timedelta
 
@@ -7,44 +10,50 @@ from models.users import User, UserOtp
 from crud.auth import verify_password, create_access_token, verify_google_token
 from crud.send_mail import send_email
 from crud.utils import generate_otp, generate_name
+from crud.pagination import paginate
+from crud.cart import merge_guest_cart
 from schemas.users import RegisterBase, LoginBase, AdminUpdateUserBase, UserBase, OtpVerify
 
 
+logger = logging.getLogger(__name__)
+
+
 # User Registeration
-async def user_register_view(db: Session, user: RegisterBase, unsafe_password: str):
+async def user_register_view(db: AsyncSession, user: RegisterBase, unsafe_password: str):
     try:
         if unsafe_password != user.confirm_password:
             return JSONResponse({"error": "Password not matched"}, status_code=400)
 
-        is_exists = db.query(User).filter(User.email == user.email).first()
+        is_exists = await db.scalar(select(User).where(User.email == user.email))
         if is_exists:
             return JSONResponse({"error": "Email already exists"}, status_code=400)
 
         db_user = User(email=user.email, password=user.password, first_name=user.first_name, last_name=user.last_name)
 
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
         
         otp = await generate_otp(db, user.email)
         await send_email(user.email, otp)
         return JSONResponse({"msg": "Registration success"}, status_code=200)
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse({"error": str(e)}, status_code=400)        
 
 
 # USer OTP Verify
-async def user_otp_verify_view(db: Session, data:OtpVerify):
+async def user_otp_verify_view(db: AsyncSession, data:OtpVerify):
     try:
         # Step 1: Get the most recent unexpired OTP for the email
         otp_record = (
-            db.query(UserOtp)
-            .filter(UserOtp.email == data.email, UserOtp.expires == False)
-            .order_by(UserOtp.created_at.desc())
-            .first()
-        )
+            await db.scalars(
+                select(UserOtp)
+                .where(UserOtp.email == data.email, UserOtp.expires == False)
+                .order_by(UserOtp.created_at.desc())
+            )
+        ).first()
 
         if not otp_record:
             return JSONResponse({"error": "No active OTP found for this email."}, status_code=400)
@@ -57,28 +66,28 @@ async def user_otp_verify_view(db: Session, data:OtpVerify):
         time_diff = datetime.now() - otp_record.created_at
         if time_diff > timedelta(minutes=10):
             otp_record.expires = True
-            db.commit()
+            await db.commit()
             return JSONResponse({"error": "OTP expired."}, status_code=400)
 
         # Step 4: Mark OTP as used/expired
         otp_record.expires = True
-        db.commit()
+        await db.commit()
 
         # Step 5 Active the user
-        db.query(User).filter(User.email == data.email).update({User.is_active: True})
-        db.commit()
+        await db.execute(update(User).where(User.email == data.email).values(is_active=True))
+        await db.commit()
 
         return JSONResponse({"msg": "OTP verified successfully."}, status_code=200)
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse({"error": str(e)}, status_code=500)
     
 
 # Resend OTP
-async def resend_otp_view(db:Session, email: str):
+async def resend_otp_view(db: AsyncSession, email: str):
     try:
-        user_exists = db.query(User).filter(User.email == email, User.is_active == False).first()
+        user_exists = await db.scalar(select(User).where(User.email == email, User.is_active == False))
 
         if not user_exists:
             return JSONResponse({"error": "Access Denied User does not exists or already active"}, status_code=500)
@@ -87,13 +96,13 @@ async def resend_otp_view(db:Session, email: str):
         await send_email(email, otp)
         return JSONResponse({"msg": "otp sent"})
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse({"error": str(e)}, status_code=500)
 
 
 # Check email already exists
-async def check_email_view(db: Session, email: str):
-    user = db.query(User).filter(User.email == email).first()
+async def check_email_view(db: AsyncSession, email: str):
+    user = await db.scalar(select(User).where(User.email == email))
     if user:
         return JSONResponse({"msg": "Email exists", "exists": True})
     
@@ -101,7 +110,7 @@ async def check_email_view(db: Session, email: str):
 
 
 # User Login
-async def user_login_view(db: Session, login_user: LoginBase):
+async def user_login_view(db: AsyncSession, login_user: LoginBase):
     try:
         # Case 1 Google Login
         if login_user.access_token:
@@ -114,7 +123,7 @@ async def user_login_view(db: Session, login_user: LoginBase):
             phone = google_user.get("phone", "")
 
             # Check if user exists in DB
-            user = db.query(User).filter(User.email == email).first()
+            user = await db.scalar(select(User).where(User.email == email))
 
             if not user:
                 # Create a new account if Google login is used for the first time
@@ -131,18 +140,18 @@ async def user_login_view(db: Session, login_user: LoginBase):
                 )
                 # Save User
                 db.add(db_user)
-                db.commit()
-                db.refresh(db_user)
+                await db.commit()
+                await db.refresh(db_user)
                 
                 # Get User
-                user = db.query(User).filter(User.id == db_user.id).first()
+                user = await db.scalar(select(User).where(User.id == db_user.id))
 
             # Generate JWT token
             access_token = create_access_token(data={"sub": user.email, "id": str(user.id)})
 
         # Case 2: Manual Login (Email & Password)
         else:
-            user = db.query(User).filter(User.email == login_user.email).first()
+            user = await db.scalar(select(User).where(User.email == login_user.email))
             if not user:
                 return JSONResponse({"error": "Incorrect Email"}, status_code=400)
             
@@ -154,11 +163,17 @@ async def user_login_view(db: Session, login_user: LoginBase):
 
             # ✅ Update last_login
             user.last_login = datetime.now()
-            db.commit()
+            await db.commit()
 
             # Generate JWT token
             access_token = create_access_token(data={"sub": user.email, "id": str(user.id)})
 
+        # A failed merge leaves the guest cart in place, it must not fail the login
+        try:
+            await merge_guest_cart(db, user.id, login_user.cart_token)
+        except Exception:
+            logger.exception("Merging guest cart into cart of user %s failed", user.id)
+
         return {
             "access_token": access_token, 
             "token_type": "bearer", 
@@ -172,9 +187,9 @@ async def user_login_view(db: Session, login_user: LoginBase):
 
 
 # Update User By Admin
-async def update_user_by_admin_view(db: Session, user_id: int, updated_user:AdminUpdateUserBase):
+async def update_user_by_admin_view(db: AsyncSession, user_id: int, updated_user:AdminUpdateUserBase):
     try:
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await db.scalar(select(User).where(User.id == user_id))
         if not user:
             return JSONResponse({"error": "User not exists"}, status_code=400)
         
@@ -182,41 +197,42 @@ async def update_user_by_admin_view(db: Session, user_id: int, updated_user:Admi
         for field, value in updated_user.model_dump(exclude_unset=True).items():
             setattr(user, field, value)
         
-        db.commit()
-        db.refresh(user)
+        await db.commit()
+        await db.refresh(user)
 
         return user
     
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse({"error": str(e)}, status_code=400)
 
 # Delete User By Admin
-async def delete_user_by_admin_view(db: Session, user_id: int):
+async def delete_user_by_admin_view(db: AsyncSession, user_id: int):
     try:
-        user = db.query(User).filter(User.id == user_id).first()
+        user = await db.scalar(select(User).where(User.id == user_id))
         if not user:
             return JSONResponse({"error": "User not found"}, status_code=404)
         
-        db.delete(user)
-        db.commit()
+        await db.delete(user)
+        await db.commit()
 
         return JSONResponse({"message": "User deleted successfully"}, status_code=200)
     
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return JSONResponse({"error": str(e)}, status_code=400)
 
 
-async def user_list_view(db: Session):
-    users = db.query(User)
-    return users
+async def user_list_view(
+    db: AsyncSession, response: Response, cursor: str = None, limit: int = None, with_total: bool = False
+):
+    return await paginate(db, select(User), User.id, response, cursor, limit, with_total)
 
 
-async def get_user_view(db: Session, user: dict):
+async def get_user_view(db: AsyncSession, user: dict):
     try:
     
-        user_data = db.query(User).filter(User.id == user["id"]).first()
+        user_data = await db.scalar(select(User).where(User.id == user["id"]))
         if not user:
             return JSONResponse({"error": "User not exists"}, status_code=400)
         return user_data
@@ -1,13 +1,16 @@
 import random
 from datetime import datetime
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from models.users import UserOtp
 from models.products import Payment
 
 
 async def generate_otp(db, email):
     # Step 0: Expire all previous OTPs for this email
-    db.query(UserOtp).filter(UserOtp.email == email, UserOtp.expires == False).update({UserOtp.expires: True})
-    db.commit()
+    await db.execute(update(UserOtp).where(UserOtp.email == email, UserOtp.expires == False).values(expires=True))
+    await db.commit()
 
     # Step 1: Generate OTP
     otp = str(random.randint(100000, 999999))
@@ -15,11 +18,18 @@ async def generate_otp(db, email):
     # Step 2: Save OTP to the database
     otp_entry = UserOtp(otp=otp, email=email, created_at=datetime.now(), expires=False)
     db.add(otp_entry)
-    db.commit()
+    await db.commit()
 
     return otp
 
 
+# INSERT with on_conflict_do_update / on_conflict_do_nothing for the session's database, Postgres or SQLite
+def dialect_insert(db, table):
+    if db.get_bind().dialect.name == "postgresql":
+        return postgresql_insert(table)
+    return sqlite_insert(table)
+
+
 def generate_name(name):
     first_name = None
     last_name = None
@@ -37,7 +47,7 @@ def generate_name(name):
 async def get_order_payment_details(db, order):
     try:
         # Get User All Payments
-        user_paments = db.query(Payment).filter(Payment.user_id == order.user_id)
+        user_paments = await db.scalars(select(Payment).where(Payment.user_id == order.user_id))
 
         payment_detail = None
         
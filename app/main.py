@@ -1,4 +1,6 @@
+import asyncio
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
@@ -9,14 +11,29 @@ from models.products import Product, ProductImage
 
 from routers.users import router as user_router
 from routers.products import router as product_router
+from routers.monitoring import router as monitoring_router
 
 # from starlette_admin.contrib.sqla import Admin, ModelView
 from logging_config import setup_logging
+from middlewares import QueryStatsMiddleware, UploadSizeLimitMiddleware
+from crud.media import media_reaper
+from crud.file_upload import shutdown_image_pool
 
 
 setup_logging()
 
-app = FastAPI(root_path="/backend")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Deletes S3 objects no product image or page section uses anymore
+    reaper = asyncio.create_task(media_reaper())
+    yield
+    reaper.cancel()
+    # Joins the image variant worker processes, reloads and restarts would leak them otherwise
+    shutdown_image_pool()
+
+
+app = FastAPI(root_path="/backend", lifespan=lifespan)
 
 allowed_origins = ['*']
 
@@ -26,12 +43,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "ETag", "X-Cart-Token"],
     # max_age=600 # for cache
 )
 
 allowed_host = ["localhost", "127.0.0.1", "13.126.195.172", "alqudsiyah.in"]
 app.add_middleware(TrustedHostMiddleware, allowed_hosts=allowed_host)
 
+# Inside the query stats middleware, which would wrap the size limit's error on the way out
+app.add_middleware(UploadSizeLimitMiddleware)
+app.add_middleware(QueryStatsMiddleware)
+
 
 
 
@@ -45,6 +67,7 @@ app.add_middleware(TrustedHostMiddleware, allowed_hosts=allowed_host)
 
 app.include_router(user_router)
 app.include_router(product_router)
+app.include_router(monitoring_router)
 
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8000, reload=False)
@@ -0,0 +1,101 @@
+import re
+import logging
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import JSONResponse
+
+from models.query_stats import start_query_stats, stop_query_stats
+from crud.file_upload import MAX_UPLOAD_SIZE
+from crud.bulk import BULK_IMPORT_MAX_SIZE
+
+
+logger = logging.getLogger("query_stats")
+
+# Multipart routes and the largest file each accepts, other routes are not limited here
+UPLOAD_LIMITS = [
+    (re.compile(r"/product-image/"), MAX_UPLOAD_SIZE),
+    (re.compile(r"/admin/page-section/(\d+/)?"), MAX_UPLOAD_SIZE),
+    (re.compile(r"/admin/products/import/"), BULK_IMPORT_MAX_SIZE),
+]
+
+
+class QueryStatsMiddleware(BaseHTTPMiddleware):
+    """Counts the SQL a request runs and reports it in response headers and the log."""
+
+    async def dispatch(self, request, call_next):
+        stats, token = start_query_stats()
+        try:
+            response = await call_next(request)
+        finally:
+            stop_query_stats(token)
+
+        response.headers["X-DB-Query-Count"] = str(stats.count)
+        response.headers["X-DB-Time-Ms"] = str(stats.duration_ms)
+
+        repeated = stats.repeated()
+        if repeated:
+            response.headers["X-DB-N-Plus-One"] = str(max(repeated.values()))
+            for shape, count in repeated.items():
+                logger.warning("N+1 on %s %s: %d x %s", request.method, request.url.path, count, shape)
+
+        logger.info(
+            "%s %s queries=%d db_time=%sms", request.method, request.url.path, stats.count, stats.duration_ms
+        )
+        return response
+
+
+class UploadSizeLimitMiddleware:
+    """Turns away multipart bodies over their route's limit in UPLOAD_LIMITS before the form is spooled.
+
+    Bodies that announce their size are refused up front, chunked ones are counted
+    as they arrive and cut off once they pass the limit.
+    """
+
+    # Room for the other form fields and multipart boundaries
+    FORM_OVERHEAD = 64 * 1024
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        headers = Headers(scope=scope) if scope["type"] == "http" else None
+        if headers is None or not headers.get("content-type", "").startswith("multipart/form-data"):
+            return await self.app(scope, receive, send)
+
+        limit = next((limit for path, limit in UPLOAD_LIMITS if path.fullmatch(scope["path"])), None)
+        if limit is None:
+            return await self.app(scope, receive, send)
+        limit += self.FORM_OVERHEAD
+        content_length = headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            return await self.too_large(scope, receive, send)
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Re-raised by the route's body parsing, so the exception handlers answer 413
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            started = started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except HTTPException as e:
+            if e.status_code != 413 or started:
+                raise
+            await self.too_large(scope, receive, send)
+
+    async def too_large(self, scope, receive, send):
+        response = JSONResponse({"detail": "Request body too large"}, status_code=413)
+        await response(scope, receive, send)
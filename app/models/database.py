@@ -1,15 +1,136 @@
 import os
-from sqlalchemy import create_engine
+import jwt
+import math
+import random
+import logging
+from fastapi import Request
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+
+from .pool import InstrumentedPool
+from crud.auth import SECRET_KEY, ALGORITHM
+from crud.response_cache import backend as pin_store, READ_YOUR_WRITES_SECONDS
 
 from dotenv import load_dotenv
 load_dotenv()
 
+logger = logging.getLogger(__name__)
 
 Database_url = os.environ.get("DATABASE_URL")
+# Comma separated read replica urls, reads fall back to the primary when empty
+Replica_urls = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Sync driver names used in DATABASE_URL mapped to their async counterparts
+ASYNC_DRIVERS = {
+    "postgres": "postgresql+psycopg",
+    "postgresql": "postgresql+psycopg",
+    "postgresql+psycopg2": "postgresql+psycopg",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_url(url: str):
+    # DATABASE_URL is shared with alembic, so keep accepting the sync form
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+def get_pool_options():
+    return {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true",
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 30)),
+    }
+
+
+def build_engine(url: str):
+    url = get_async_url(url)
+
+    # In-memory sqlite lives inside a single connection, keep SQLAlchemy's default pool for it
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return create_async_engine(url)
+
+    return create_async_engine(url, poolclass=InstrumentedPool, **get_pool_options())
+
+
+engine = build_engine(Database_url)
+replica_engines = [build_engine(url) for url in Replica_urls]
+
 
-engine = create_engine(Database_url)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+class RoutingSession(Session):
+    """Sends reads to a replica when the request allows it, everything else to the primary."""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info["wrote"] = True
+
+        # Once this session has written, keep it on the primary so it reads its own rows
+        if replica_engines and self.info.get("use_replica") and not self.info.get("wrote"):
+            # One replica per session, replicas lag by different amounts and a request's reads must agree
+            if "replica" not in self.info:
+                self.info["replica"] = random.choice(replica_engines)
+            return self.info["replica"].sync_engine
+
+        return engine.sync_engine
+
+
+SessionLocal = async_sessionmaker(
+    class_=AsyncSession, sync_session_class=RoutingSession, autoflush=False, expire_on_commit=False
+)
 Base = declarative_base()
 
+
+def get_client_key(request: Request):
+    """The signed-in user a request comes from, None when it carries no valid token.
+
+    Anonymous requests are never pinned, clients sharing an IP must not share a pin.
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return f"user:{jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])['id']}"
+    except (jwt.PyJWTError, KeyError):
+        return None
+
+
+# Pins live in the response cache backend, with redis a write on one worker pins reads on all of them
+async def is_pinned_to_primary(client_key):
+    if not client_key or not replica_engines:
+        return False
+    try:
+        return await pin_store.get(f"primary-pin:{client_key}") is not None
+    except Exception:
+        # Without the pin store the primary is the safe choice
+        return True
+
+
+async def pin_to_primary(client_key):
+    if not replica_engines:
+        return
+    try:
+        await pin_store.set(f"primary-pin:{client_key}", b"1", math.ceil(READ_YOUR_WRITES_SECONDS))
+    except Exception as e:
+        logger.warning("Could not pin %s to the primary: %s", client_key, e)
+
+
+async def get_db(request: Request):
+    client_key = get_client_key(request)
+
+    async with SessionLocal() as db:
+        db.info["use_replica"] = (
+            bool(replica_engines) and request.method in READ_METHODS and not await is_pinned_to_primary(client_key)
+        )
+        try:
+            yield db
+        finally:
+            if db.info.get("wrote") and client_key:
+                await pin_to_primary(client_key)
@@ -0,0 +1,82 @@
+import time
+from collections import deque
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+class PoolMetrics:
+    # Upper bounds (ms) of the connection wait histogram, the last bucket catches the rest
+    WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+    def __init__(self, samples: int = 1000):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_histogram = [0] * (len(self.WAIT_BUCKETS_MS) + 1)
+        self.checkout_durations = deque(maxlen=samples)
+
+    def record_wait(self, seconds: float):
+        wait_ms = seconds * 1000
+        for index, bound in enumerate(self.WAIT_BUCKETS_MS):
+            if wait_ms <= bound:
+                self.wait_histogram[index] += 1
+                return
+        self.wait_histogram[-1] += 1
+
+    def record_checkout_duration(self, seconds: float):
+        self.checkouts += 1
+        self.checkout_durations.append(seconds * 1000)
+
+    def percentiles(self):
+        durations = sorted(self.checkout_durations)
+        if not durations:
+            return {"p50": 0, "p90": 0, "p99": 0, "max": 0}
+
+        def pick(percent):
+            return round(durations[min(len(durations) - 1, int(len(durations) * percent / 100))], 3)
+
+        return {"p50": pick(50), "p90": pick(90), "p99": pick(99), "max": round(durations[-1], 3)}
+
+    def histogram(self):
+        labels = [f"<={bound}ms" for bound in self.WAIT_BUCKETS_MS] + [f">{self.WAIT_BUCKETS_MS[-1]}ms"]
+        return dict(zip(labels, self.wait_histogram))
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long callers wait for, and then hold, a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        finally:
+            self.metrics.record_wait(time.perf_counter() - started)
+
+        record.info["checked_out_at"] = time.perf_counter()
+        return record
+
+    def _do_return_conn(self, record):
+        checked_out_at = record.info.pop("checked_out_at", None)
+        if checked_out_at is not None:
+            self.metrics.record_checkout_duration(time.perf_counter() - checked_out_at)
+        super()._do_return_conn(record)
+
+    def stats(self):
+        return {
+            "pool_size": self.size(),
+            "checked_out": self.checkedout(),
+            "checked_in": self.checkedin(),
+            "overflow": self.overflow(),
+            "max_overflow": self._max_overflow,
+            "timeout": self._timeout,
+            "total_checkouts": self.metrics.checkouts,
+            "timeouts": self.metrics.timeouts,
+            "wait_histogram": self.metrics.histogram(),
+            "checkout_duration_ms": self.metrics.percentiles(),
+        }
@@ -1,6 +1,7 @@
 import pytz
-from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey, Float, DateTime, Date
+from sqlalchemy import Column, Integer, String, Boolean, Text, ForeignKey, Float, DateTime, Date, Index
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql import expression
 from datetime import datetime
 
 from .database import Base
@@ -10,6 +11,10 @@ IST = pytz.timezone("Asia/Kolkata")
 
 class Product(Base):
     __tablename__ = "products"
+    __table_args__ = (
+        # Keyset pagination of category listings
+        Index("ix_products_category_id", "category", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True, nullable=True)
@@ -20,11 +25,15 @@ class Product(Base):
     ingredients = Column(String, nullable=True)
     category = Column(String, index=True, nullable=True)
     description = Column(Text, nullable=True)
-    slug = Column(String, index=True, nullable=True)
+    slug = Column(String, index=True, nullable=True, unique=True)
     quantity = Column(Integer, default=0)
     unit = Column(String, nullable=True)
     rating = Column(Float, default=0)
     in_stock = Column(Integer, default=0)
+    # First image and number of images, kept in sync by the product image views so listings skip product_images
+    cover_image_url = Column(String, nullable=True)
+    image_count = Column(Integer, default=0, server_default="0", nullable=False)
+    cover_variants_ready = Column(Boolean, default=False, server_default=expression.false(), nullable=False)
 
     # Add this line to fix the error
     images = relationship("ProductImage", back_populates="product", cascade="all, delete-orphan")
@@ -38,11 +47,23 @@ class Product(Base):
     
 
 
+# Per category aggregates of products, refreshed by the product views on every write
+class ProductCategory(Base):
+    __tablename__ = "product_categories"
+
+    category = Column(String, primary_key=True)
+    product_count = Column(Integer, default=0, nullable=False)
+    in_stock_count = Column(Integer, default=0, nullable=False)
+    min_price = Column(Float, nullable=True)
+    max_price = Column(Float, nullable=True)
+
+
 class Cart(Base):
     __tablename__ = "cart"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    # One cart per user, get_or_create_cart_id relies on it for ON CONFLICT
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True, unique=True)
 
     user = relationship("User", back_populates="carts")
     # Many to many relationship with Product
@@ -54,7 +75,8 @@ class ProductCartAssociation(Base):
     __tablename__ = "product_cart_association"
 
     product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
-    cart_id = Column(Integer, ForeignKey("cart.id"), primary_key=True)
+    # The primary key leads with product_id, reading one cart needs its own index
+    cart_id = Column(Integer, ForeignKey("cart.id"), primary_key=True, index=True)
     quantity = Column(Integer, default=1)
 
 
@@ -64,6 +86,8 @@ class ProductImage(Base):
     id = Column(Integer, primary_key=True, index=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=True)
     image_url = Column(String, nullable=True)
+    # Resized thumb/card/detail variants exist next to image_url
+    variants_ready = Column(Boolean, default=False, server_default=expression.false(), nullable=False)
 
     product = relationship("Product", back_populates="images")
 
@@ -93,12 +117,20 @@ class Pincode(Base):
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        # Keyset pagination of filtered order listings
+        Index("ix_orders_status_id", "status", "id"),
+        Index("ix_orders_delivery_status_id", "delivery_status", "id"),
+        Index("ix_orders_user_id_id", "user_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     address = Column(Text, nullable=True)
     total_amount = Column(Text, nullable=True)
+    # Units of the product, total_amount is the price of all of them
+    quantity = Column(Integer, default=1, server_default="1", nullable=False)
     status = Column(String, default="PENDING", nullable=True)
     cancellation_reason = Column(Text, nullable=True)
     cancellation_date = Column(DateTime, nullable=True)
@@ -111,6 +143,9 @@ class Order(Base):
 
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        Index("ix_payments_user_id_id", "user_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True)
     cart_id = Column(Integer, nullable=True)
@@ -153,11 +188,29 @@ class Promocode(Base):
     user = relationship("User", back_populates="promocodes")
 
 
+class MediaObject(Base):
+    """An image stored in S3 under its SHA-256, shared by every product image and page section with the same bytes."""
+    __tablename__ = "media_objects"
+
+    id = Column(Integer, primary_key=True)
+    key = Column(String, unique=True, nullable=False)
+    size = Column(Integer, nullable=True)
+    content_type = Column(String, nullable=True)
+    # Product images and page sections pointing at key, the reaper deletes the object once it stays at 0
+    ref_count = Column(Integer, default=0, server_default="0", nullable=False)
+    variants_ready = Column(Boolean, default=False, server_default=expression.false(), nullable=False)
+    # Reserved for an upload that nothing references yet, the object may not exist
+    pending = Column(Boolean, default=False, server_default=expression.false(), nullable=False)
+    created_on = Column(DateTime, default=datetime.now, nullable=True)
+    orphaned_on = Column(DateTime, nullable=True, index=True)
+
+
 class PageSection(Base):
     __tablename__ = "pagesection"
     id = Column(Integer, primary_key=True)
     page_url = Column(String, nullable=True)
     name = Column(String, nullable=True)
     image_url = Column(String, nullable=True)
+    variants_ready = Column(Boolean, default=False, server_default=expression.false(), nullable=False)
 
     
\ No newline at end of file
@@ -0,0 +1,76 @@
+import os
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Same statement shape repeated more than this many times in one request is reported as N+1
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("DB_N_PLUS_ONE_THRESHOLD", 5))
+# Raise instead of logging when an N+1 pattern shows up, meant for test runs
+N_PLUS_ONE_STRICT = os.environ.get("DB_N_PLUS_ONE_STRICT", "false").lower() == "true"
+
+_IN_LIST = re.compile(r"\bIN\s*\((?:[^()]*)\)", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.duration += duration
+        shape = statement_shape(statement)
+        self.shapes[shape] += 1
+        return self.shapes[shape]
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD):
+        return {shape: count for shape, count in self.shapes.items() if count > threshold}
+
+    @property
+    def duration_ms(self):
+        return round(self.duration * 1000, 2)
+
+
+_current_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+def statement_shape(statement: str):
+    # Expanded IN lists differ only by their length, treat them as one shape
+    statement = _IN_LIST.sub("IN (...)", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+def start_query_stats():
+    stats = QueryStats()
+    return stats, _current_stats.set(stats)
+
+
+def stop_query_stats(token):
+    _current_stats.reset(token)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started_at"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = conn.info.pop("query_started_at", time.perf_counter())
+    stats = _current_stats.get()
+    if stats is None:
+        return
+
+    repeats = stats.record(statement, time.perf_counter() - started_at)
+    if N_PLUS_ONE_STRICT and repeats > N_PLUS_ONE_THRESHOLD:
+        raise NPlusOneError(f"Statement ran more than {N_PLUS_ONE_THRESHOLD} times in one request: {statement}")
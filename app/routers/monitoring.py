@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends
+
+from crud.auth import get_current_user
+from crud.monitoring import pool_stats_view, cache_stats_view, storage_stats_view
+
+
+router = APIRouter()
+
+
+# Database Pool Stats - Admin
+@router.get("/admin/db/pool-stats/")
+async def pool_stats(user: dict = Depends(get_current_user)):
+    return await pool_stats_view()
+
+
+# Cache Stats - Admin
+@router.get("/admin/cache/stats/")
+async def cache_stats(user: dict = Depends(get_current_user)):
+    return await cache_stats_view()
+
+
+# Storage Upload Stats - Admin
+@router.get("/admin/storage/stats/")
+async def storage_stats(user: dict = Depends(get_current_user)):
+    return await storage_stats_view()
@@ -1,82 +1,199 @@
-from fastapi import APIRouter, Depends, Form, UploadFile, File, Query
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
-from models.database import SessionLocal
+from fastapi import APIRouter, Depends, Form, UploadFile, File, Query, Request, Response, Header
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.database import get_db
 
 from schemas.products import (
     ProductActionBase, ProductBase, ProductImageBase, ProductCategoriesBase, AdminProductsListBase, ProductsListBase, ProductBase, ProductsDetailBase, UserCartBase, AddToCartBase, 
     PincodeBase, OrderBase, CreateOrderBase, CheckoutBase, CashfreeWebhookBase, PaymentBase, UserOrderBase, ProductRatingReviewBase, AddProductRatingReviewBase, AdminOrderBase, 
-    AdminOrderDetailBase, LatestOrdersBase, UpdatePincodeBase, PromocodeBase, PromocodeActionBase, PageSectionBase, UserOrderDetailBase, OrderCancelBase, AdminUpdateOrderBase
+    AdminOrderDetailBase, LatestOrdersBase, UpdatePincodeBase, PromocodeBase, PromocodeActionBase, PageSectionBase, UserOrderDetailBase, OrderCancelBase, AdminUpdateOrderBase,
+    FacetedProductsBase, BulkProductPatchBase, PresignUploadBase, FinalizeProductImageBase, FinalizePageSectionBase, CartItemsBase
 )
 
 from crud.auth import get_current_user
+from crud.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from crud.response_cache import cached, conditional
+from crud.bulk import import_products_view, export_products, bulk_patch_products_view
 from crud.products import (
     create_product, get_all_products, add_product_image_view, get_product_images_view, get_product_categories_view, delete_product_view,  update_product_view, delete_product_image_view,
     admin_products_list_view, get_product_view, user_cart_view, add_to_cart_view, delete_from_cart_view, add_pincode_view, pincodes_list_view, check_pincode_delivery_view, add_order_view,
     checkout_view, cashfree_view, cashfree_webhook_view, payments_view, orders_list_view, user_orders_list_view, user_cart_items_count, add_product_rating_view, product_rating_review_view,
     admin_order_detail_view, admin_orders_count_view, admin_latest_orders_view, update_pincode_view, add_promocode_view, promocodes_list_view, apply_promocode_view, update_promocode_view,
     get_promocode_view, delete_promocode_view, get_product_category_view, add_page_section_view, get_page_section_view, update_page_section_view, user_order_detail_view, order_cancel_request_view,
-    update_order_view
+    update_order_view, search_products_view, faceted_products_view, product_bundle_view, presign_upload_view, finalize_product_image_view,
+    finalize_page_section_view, set_cart_items_view, guest_cart_view, guest_add_to_cart_view, guest_set_cart_items_view,
+    guest_delete_from_cart_view
 )
 
 
 router = APIRouter()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 
 # ---------------------- Product ---------------------------------------------------------------
 
 @router.get("/")
-async def get_no_found(db: Session = Depends(get_db)):
+async def get_no_found(db: AsyncSession = Depends(get_db)):
     return JSONResponse(status_code=404, content={"detail": "Page not found"})
 
 
 #  Add Product
 @router.post("/product/", response_model=ProductBase)
-async def create_new_product(product: ProductActionBase, db: Session = Depends(get_db)):
+async def create_new_product(product: ProductActionBase, db: AsyncSession = Depends(get_db)):
     return await create_product(db=db, product=product)
 
 
 # Get Products List
 @router.get("/products-list/", response_model=list[ProductsListBase])
+@conditional(cache_control="public, max-age=60")
+@cached("products", ttl=300, tags=("products",))
 async def get_products_list(
-    limit: int = Query(100, ge=1), 
+    request: Request,
+    response: Response,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE), 
+    category: str | None = None,
+    cursor: str | None = None,
+    with_total: bool = False,
+    db: AsyncSession = Depends(get_db)):
+    return await get_all_products(
+        db=db, response=response, limit=limit, category=category, cursor=cursor, with_total=with_total
+    )
+
+
+# Search Products
+@router.get("/products/search", response_model=list[ProductsListBase])
+@conditional(cache_control="public, max-age=60")
+@cached("products", ttl=300, tags=("products",))
+async def search_products(
+    request: Request,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
     category: str | None = None,
-    db: Session = Depends(get_db)):
-    return await get_all_products(db=db, limit=limit, category=category)
+    db: AsyncSession = Depends(get_db)
+):
+    return await search_products_view(db=db, q=q, limit=limit, category=category)
+
+
+# Products List with facet counts
+@router.get("/products/faceted/", response_model=FacetedProductsBase)
+@conditional(cache_control="public, max-age=60")
+@cached("products", ttl=300, tags=("products",))
+async def get_faceted_products(
+    request: Request,
+    response: Response,
+    category: str | None = None,
+    is_available: bool | None = None,
+    is_giftset: bool | None = None,
+    cursor: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    with_total: bool = False,
+    db: AsyncSession = Depends(get_db)
+):
+    return await faceted_products_view(
+        db=db, response=response, category=category, is_available=is_available, is_giftset=is_giftset,
+        cursor=cursor, limit=limit, with_total=with_total
+    )
 
 
 # Get Products List - Admin Only
 @router.get("/admin-dashboard/products-list/", response_model=list[AdminProductsListBase])
 async def admin_products_list(
+    response: Response,
     get_image: bool = False,
     name: str | None = None,
     category: str = None,
-    db: Session = Depends(get_db)
+    cursor: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    with_total: bool = False,
+    db: AsyncSession = Depends(get_db)
+):
+    return await admin_products_list_view(
+        db=db, response=response, get_image=get_image, name=name, category=category,
+        cursor=cursor, limit=limit, with_total=with_total
+    )
+
+
+# Bulk Import Products (CSV or NDJSON) - Admin Only
+@router.post("/admin/products/import/")
+async def import_products(
+    file: UploadFile = File(),
+    format: str | None = Query(None, pattern="^(csv|ndjson)$"),
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    return await import_products_view(db=db, upload=file, format=format)
+
+
+# Bulk Export Products - Admin Only
+@router.get("/admin/products/export/")
+async def export_products_list(
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    user: dict = Depends(get_current_user)
+):
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        export_products(format), media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=products.{format}"}
+    )
+
+
+# Bulk Price and Stock Update - Admin Only
+@router.patch("/admin/products/bulk/")
+async def bulk_patch_products(
+    items: list[BulkProductPatchBase],
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
-    return await admin_products_list_view(db=db, get_image=get_image, name=name, category=category)
+    return await bulk_patch_products_view(db=db, items=items)
 
 
 # Retrive Product
 @router.get("/product/{product_id}", response_model=ProductsDetailBase)
+@conditional(cache_control="public, max-age=60")
+@cached("products", ttl=300, tags=("products",))
 async def get_product(
+    request: Request,
+    response: Response,
     product_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await get_product_view(db=db, product_id=product_id)
 
 
+# Product page bundle: product, images, rating summary, latest reviews and related products
+@router.get("/product/{product_id}/bundle")
+@conditional(cache_control="public, max-age=60")
+@cached("products", ttl=300, tags=("products", "reviews"))
+async def get_product_bundle(
+    request: Request,
+    response: Response,
+    product_id: int,
+    db: AsyncSession = Depends(get_db)
+):
+    return await product_bundle_view(db=db, product_id=product_id)
+
+
+@router.get("/product/slug/{slug}/bundle")
+@conditional(cache_control="public, max-age=60")
+@cached("products", ttl=300, tags=("products", "reviews"))
+async def get_product_bundle_by_slug(
+    request: Request,
+    response: Response,
+    slug: str,
+    db: AsyncSession = Depends(get_db)
+):
+    return await product_bundle_view(db=db, slug=slug)
+
+
 # Get Product Category
 @router.get("/product/category/{product_id}")
+@conditional(cache_control="public, max-age=300")
+@cached("products", ttl=300, tags=("products",))
 async def get_product_category(
+    request: Request,
+    response: Response,
     product_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await get_product_category_view(db=db, product_id=product_id)
 
@@ -86,20 +203,22 @@ async def get_product_category(
 async def update_product(
     product_id: int, 
     product_data: ProductActionBase,
-    db: Session = Depends(get_db)):
+    db: AsyncSession = Depends(get_db)):
     return await update_product_view(db=db, product_id=product_id, product_data=product_data)
  
 
 # Delete Product
 @router.delete("/product/{product_id}/")
-async def delete_product(product_id: int, db: Session = Depends(get_db)):
+async def delete_product(product_id: int, db: AsyncSession = Depends(get_db)):
     return await delete_product_view(db=db, product_id=product_id)
 # ===============================================================================================
 
 
 # Product Categories List
 @router.get("/product-categories/", response_model=list[ProductCategoriesBase])
-async def get_product_categories(db: Session = Depends(get_db)):
+@conditional(cache_control="public, max-age=300")
+@cached("products", ttl=300, tags=("products",))
+async def get_product_categories(request: Request, response: Response, db: AsyncSession = Depends(get_db)):
     return await get_product_categories_view(db=db)
 
 # ===============================================================================================
@@ -108,7 +227,7 @@ async def get_product_categories(db: Session = Depends(get_db)):
 # ---------------------- Product Image ----------------------------------------------------------
 # Get Product Image 
 @router.get("/product-images/{product_id}/", response_model=list[ProductImageBase])
-async def get_product_images(product_id: int, db: Session = Depends(get_db)):
+async def get_product_images(product_id: int, db: AsyncSession = Depends(get_db)):
     return await get_product_images_view(db=db, product_id=product_id)
 
 
@@ -117,15 +236,34 @@ async def get_product_images(product_id: int, db: Session = Depends(get_db)):
 async def add_product_image(
     product_id: str = Form(),
     image: UploadFile = Form(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await add_product_image_view(db, product_id, image)
 
 
+# Presigned Upload, large files go straight to S3 instead of through the API
+@router.post("/admin/uploads/presign/")
+async def presign_upload(
+    data: PresignUploadBase,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    return await presign_upload_view(db=db, data=data)
+
+
+# Finalize Product Image uploaded with a presigned URL
+@router.post("/product-image/finalize/", response_model=ProductImageBase)
+async def finalize_product_image(
+    data: FinalizeProductImageBase,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    return await finalize_product_image_view(db=db, data=data)
+
+
 # Delete Product Image
 @router.delete("/product-image/{image_id}/")
-async def delete_product_image(image_id: int, db: Session = Depends(get_db)):
-    # - Reamining Delete Image from AWS
+async def delete_product_image(image_id: int, db: AsyncSession = Depends(get_db)):
     return await delete_product_image_view(db=db, image_id=image_id)
 
 # =================================================================================================
@@ -136,7 +274,7 @@ async def delete_product_image(image_id: int, db: Session = Depends(get_db)):
 @router.get("/user/cart/", response_model=UserCartBase)
 async def user_cart(
     user: dict = Depends(get_current_user), 
-    db: Session = Depends(get_db)):
+    db: AsyncSession = Depends(get_db)):
     
     return await user_cart_view(db=db, user=user)
 
@@ -145,7 +283,7 @@ async def user_cart(
 @router.get("/user/cart/count/")
 async def user_cart_itmes_count(
     user: dict = Depends(get_current_user), 
-    db: Session = Depends(get_db)):
+    db: AsyncSession = Depends(get_db)):
     
     return await user_cart_items_count(db=db, user=user)
 
@@ -155,7 +293,7 @@ async def user_cart_itmes_count(
 async def add_to_cart(
     cart_data: AddToCartBase,
     user: dict = Depends(get_current_user), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await add_to_cart_view(db=db, user=user, cart=cart_data)
 
@@ -164,10 +302,56 @@ async def add_to_cart(
 async def delete_from_cart(
     product_id: int,
     user: dict = Depends(get_current_user), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await delete_from_cart_view(db=db, user=user, product_id=product_id)
 
+
+# Replace the cart with the given items, for syncing a whole local cart at once
+@router.put("/user/cart/items")
+async def set_cart_items(
+    data: CartItemsBase,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    return await set_cart_items_view(db=db, user=user, data=data)
+
+
+# Guest Cart, no login needed, the cart is identified by the X-Cart-Token header
+@router.get("/guest/cart/")
+async def guest_cart(
+    x_cart_token: str | None = Header(None),
+    db: AsyncSession = Depends(get_db)
+):
+    return await guest_cart_view(db=db, cart_token=x_cart_token)
+
+
+@router.post("/guest/cart/add-to-cart/")
+async def guest_add_to_cart(
+    cart_data: AddToCartBase,
+    x_cart_token: str | None = Header(None),
+    db: AsyncSession = Depends(get_db)
+):
+    return await guest_add_to_cart_view(db=db, cart_token=x_cart_token, cart=cart_data)
+
+
+@router.put("/guest/cart/items")
+async def guest_set_cart_items(
+    data: CartItemsBase,
+    x_cart_token: str | None = Header(None),
+    db: AsyncSession = Depends(get_db)
+):
+    return await guest_set_cart_items_view(db=db, cart_token=x_cart_token, data=data)
+
+
+@router.delete("/guest/cart/{product_id}/")
+async def guest_delete_from_cart(
+    product_id: int,
+    x_cart_token: str | None = Header(None),
+    db: AsyncSession = Depends(get_db)
+):
+    return await guest_delete_from_cart_view(db=db, cart_token=x_cart_token, product_id=product_id)
+
 # ========================================================================================================
 
 # Add Pincode
@@ -175,7 +359,7 @@ async def delete_from_cart(
 async def add_pincode(
     pincode_data: PincodeBase,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await add_pincode_view(db=db, user=user, pincode_data=pincode_data)
 
@@ -186,24 +370,35 @@ async def update_pincode(
     pincode_id: int,
     pincode_data: UpdatePincodeBase,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await update_pincode_view(db=db, pincode_id=pincode_id, pincode_data=pincode_data)
 
 
 @router.get("/admin/pincodes/", response_model=list[PincodeBase])
+@cached("pincodes", ttl=300, tags=("pincodes",))
 async def pincodes_list(
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    with_total: bool = False,
     user: dict = Depends(get_current_user), 
-    db: Session = Depends(get_db)):
+    db: AsyncSession = Depends(get_db)):
     
-    return await pincodes_list_view(db=db, user=user)
+    return await pincodes_list_view(
+        db=db, response=response, user=user, cursor=cursor, limit=limit, with_total=with_total
+    )
 
 
 # Check Delviry Available
 @router.get("/check-delivery/{pincode}/")
+@conditional(cache_control="public, max-age=300")
+@cached("pincodes", ttl=300, tags=("pincodes",))
 async def check_pincode_delivery(
+    request: Request,
+    response: Response,
     pincode: str,
-    db: Session = Depends(get_db)):
+    db: AsyncSession = Depends(get_db)):
     
     return await check_pincode_delivery_view(db=db, pincode=pincode)
 
@@ -212,7 +407,7 @@ async def check_pincode_delivery(
 @router.get("/user/orders/", response_model=list[UserOrderBase])
 async def user_orders_list(
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await user_orders_list_view(db=db, user=user)
 
@@ -221,7 +416,7 @@ async def user_orders_list(
 async def user_order_detail(
     order_id: int,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await user_order_detail_view(db=db, user=user, order_id=order_id)
 
@@ -231,7 +426,7 @@ async def user_order_detail(
 async def add_order(
     order: CreateOrderBase,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await add_order_view(db=db, order=order, user=user)
 
@@ -242,7 +437,7 @@ async def update_order(
     order_id: int,
     order_data: AdminUpdateOrderBase,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await update_order_view(db, user, order_id, order_data)
 
@@ -253,7 +448,7 @@ async def order_cancel_request(
     order_id: int,
     order_data: OrderCancelBase,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     
     return await order_cancel_request_view(db, order_id, order_data, user)
@@ -262,13 +457,20 @@ async def order_cancel_request(
 # Get Orders - admin
 @router.get("/admin/orders/", response_model=list[AdminOrderBase])
 async def orders_list(
+    response: Response,
     status: str | None = None,
     delivery_status: str | None = None,
     product_name: str | None = None,
+    cursor: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    with_total: bool = False,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
-    return await orders_list_view(db=db, status=status, delivery_status=delivery_status, product_name=product_name)
+    return await orders_list_view(
+        db=db, response=response, status=status, delivery_status=delivery_status, product_name=product_name,
+        cursor=cursor, limit=limit, with_total=with_total
+    )
 
 
 # Order Detail - Admin
@@ -276,7 +478,7 @@ async def orders_list(
 async def admin_order_detail(
     order_id: int,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await admin_order_detail_view(db=db, order_id=order_id)
 
@@ -284,7 +486,7 @@ async def admin_order_detail(
 @router.get("/admin/orders/count/")
 async def admin_orders_count(
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await admin_orders_count_view(db=db)
 
@@ -293,7 +495,7 @@ async def admin_orders_count(
 async def admin_latest_orders(
     status: str | None = None,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await admin_latest_orders_view(db=db, status=status)
 
@@ -302,7 +504,7 @@ async def admin_latest_orders(
 async def checkout(
     checkout_data: CheckoutBase,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await checkout_view(db=db, user=user, checkout_data=checkout_data)
 
@@ -310,7 +512,7 @@ async def checkout(
 @router.post("/cashfree/webhook/")
 async def cashfree_webhook(
     data: CashfreeWebhookBase,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
     
 ):
     return await cashfree_webhook_view(db=db, data=data)
@@ -318,7 +520,7 @@ async def cashfree_webhook(
 # Cashfree order -----------------------------------------
 @router.post("/create/order/")
 async def cashfree_order(
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await cashfree_view(db=db)
 
@@ -326,9 +528,13 @@ async def cashfree_order(
 # Payments
 @router.get("/admin/payments/", response_model=list[PaymentBase])
 async def payments_list(
-    db: Session = Depends(get_db)
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    with_total: bool = False,
+    db: AsyncSession = Depends(get_db)
 ):
-    return await payments_view(db=db)
+    return await payments_view(db=db, response=response, cursor=cursor, limit=limit, with_total=with_total)
 
 
 # -------------- Rating review ----------------------------------------
@@ -337,7 +543,7 @@ async def payments_list(
 @router.get("/product/rating-reviews/{product_id}/")
 async def product_rating_review(
     product_id: int,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await product_rating_review_view(db=db, product_id=product_id)
 
@@ -346,7 +552,7 @@ async def product_rating_review(
 async def add_product_rating(
     data: AddProductRatingReviewBase,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     
     return await add_product_rating_view(db=db, user=user, data=data)
@@ -357,7 +563,7 @@ async def add_product_rating(
 async def add_promocode(
     promocode: PromocodeActionBase,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     
     return await add_promocode_view(db=db, user=user, promocode=promocode)
@@ -368,7 +574,7 @@ async def update_promocode(
     promocode_id: int,
     promocode: PromocodeActionBase,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     
     return await update_promocode_view(db=db, promocode_id=promocode_id, promocode=promocode)
@@ -377,7 +583,7 @@ async def update_promocode(
 @router.get("/admin/promocodes", response_model=list[PromocodeBase])
 async def promocodes_list(
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await promocodes_list_view(db=db)
 
@@ -386,7 +592,7 @@ async def promocodes_list(
 @router.get("/apply-promocode/{promocode}")
 async def apply_promocode(
     promocode: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await apply_promocode_view(db=db, promocode=promocode)
 
@@ -395,7 +601,7 @@ async def apply_promocode(
 @router.get("/promocode/{promocode}", response_model=PromocodeBase)
 async def get_promocode(
     promocode: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await get_promocode_view(db=db, promocode=promocode)
 
@@ -405,7 +611,7 @@ async def get_promocode(
 async def delete_promocode(
     promocode_id: int,
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await delete_promocode_view(db=db, promocode_id=promocode_id)
 
@@ -417,16 +623,20 @@ async def add_pagesection_data(
     name: str = Form(),
     image: UploadFile = Form(),
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await add_page_section_view(db, page_url, name, image)
 
 
 @router.get("/page-section", response_model=list[PageSectionBase])
+@conditional(cache_control="public, max-age=300")
+@cached("page-section", ttl=300, tags=("page-section",))
 async def get_pagesection(
+    request: Request,
+    response: Response,
     page_url: str | None = None,
     name: str | None = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await get_page_section_view(db, page_url, name)
 
@@ -438,8 +648,18 @@ async def update_pagesection_data(
     name: str | None = Form(),
     image: UploadFile | None = Form(),
     user: dict = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     return await update_page_section_view(db, pagesection_id, page_url, name, image)
 
 
+# Finalize Page Section uploaded with a presigned URL
+@router.post("/admin/page-section/finalize/")
+async def finalize_pagesection(
+    data: FinalizePageSectionBase,
+    user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    return await finalize_page_section_view(db=db, data=data)
+
+
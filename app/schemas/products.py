@@ -2,6 +2,7 @@ from pydantic import BaseModel
 from typing import Dict, Any
 from datetime import datetime, date
 from crud.utils import get_order_payment_details
+from crud.image_variants import variant_url
 
 class ProductBase(BaseModel):
     id: int | None = None
@@ -32,6 +33,15 @@ class ProductActionBase(BaseModel):
     in_stock: int | None = None
 
 
+class BulkProductPatchBase(BaseModel):
+    id: int | None = None
+    slug: str | None = None
+    sale_price: float | None = None
+    original_price: float | None = None
+    in_stock: int | None = None
+    is_available: bool | None = None
+
+
 class ProductImageBase(BaseModel):
     id: int
     image_url: str | None = None
@@ -43,8 +53,29 @@ class ProductImageActionBase(BaseModel):
     product_id: int | None = None
 
 
+class PresignUploadBase(BaseModel):
+    kind: str
+    sha256: str
+    content_type: str
+    size: int
+    method: str = "post"
+    product_id: int | None = None
+
+
+class FinalizeProductImageBase(BaseModel):
+    product_id: int
+    key: str
+
+
 class ProductCategoriesBase(BaseModel):
     category: str | None = None
+    product_count: int | None = None
+    in_stock_count: int | None = None
+    min_price: float | None = None
+    max_price: float | None = None
+
+    class Config:
+        from_attributes = True
 
 
 class AdminProductsListBase(BaseModel):
@@ -59,6 +90,7 @@ class AdminProductsListBase(BaseModel):
     unit: str | None = None
     in_stock: int | None = None
     image: str | None = None
+    image_count: int | None = 0
 
     class Config:
         from_attributes = True
@@ -66,7 +98,7 @@ class AdminProductsListBase(BaseModel):
     @classmethod
     async def get_image_data(cls, product: Dict[str, Any]):
         if product:
-            product.image = product.images[0].image_url if product.images else None
+            product.image = variant_url(product.cover_image_url, "thumb", product.cover_variants_ready)
         return product if product else None
 
 
@@ -79,6 +111,7 @@ class ProductsListBase(BaseModel):
     category: str | None = None
     description: str | None = None
     image: str | None = None
+    image_webp: str | None = None
 
     class Config:
         from_attributes = True
@@ -86,10 +119,22 @@ class ProductsListBase(BaseModel):
     @classmethod
     async def get_image_data(cls, product: Dict[str, Any]):
         if product:
-            product.image = product.images[0].image_url if product.images else None
+            product.image = variant_url(product.cover_image_url, "card", product.cover_variants_ready)
+            product.image_webp = variant_url(product.cover_image_url, "card", product.cover_variants_ready, "webp")
         return product if product else None
 
 
+class ProductFacetsBase(BaseModel):
+    category: dict[str, int] = {}
+    is_available: dict[str, int] = {}
+    is_giftset: dict[str, int] = {}
+
+
+class FacetedProductsBase(BaseModel):
+    products: list[ProductsListBase] = []
+    facets: ProductFacetsBase
+
+
 class ProductsDetailBase(BaseModel):
     id: int | None = None
     name: str | None = None
@@ -120,6 +165,7 @@ class CatProductBase(BaseModel):
     category: str | None = None
     description: str | None = None
     image: str | None = None
+    image_webp: str | None = None
     quantity: int | None = 1
 
     class Config:
@@ -128,7 +174,8 @@ class CatProductBase(BaseModel):
     @classmethod
     async def get_image_data(cls, product: Dict[str, Any]):
         if product:
-            product.image = product.images[0].image_url if product.images else None
+            product.image = variant_url(product.cover_image_url, "thumb", product.cover_variants_ready)
+            product.image_webp = variant_url(product.cover_image_url, "thumb", product.cover_variants_ready, "webp")
         return product if product else None
 
 
@@ -142,6 +189,15 @@ class AddToCartBase(BaseModel):
     quantity: int | None = 1
 
 
+class CartItemBase(BaseModel):
+    product_id: int
+    quantity: int = 1
+
+
+class CartItemsBase(BaseModel):
+    items: list[CartItemBase] = []
+
+
 class PincodeBase(BaseModel):
     id: int | None = None
     pincode: str
@@ -164,6 +220,7 @@ class OrderBase(BaseModel):
     product_id: int | None = None
     address: str | None = None
     total_amount: int | None = None
+    quantity: int | None = None
     user_id: int | None = None
     status: str | None = None
     created_on: datetime | None = None
@@ -182,6 +239,7 @@ class AdminOrderBase(BaseModel):
     image: str | None = None
     address: str | None = None
     total_amount: int | None = None
+    quantity: int | None = None
     cancellation_reason: str | None = None
     cancellation_date: datetime | None = None
     user_id: int | None = None
@@ -196,7 +254,7 @@ class AdminOrderBase(BaseModel):
     @classmethod
     async def get_data(cls, order: Dict[str, Any]):
         if order and order.product:
-            order.image = order.product.images[0].image_url if order.product.images else None
+            order.image = variant_url(order.product.cover_image_url, "thumb", order.product.cover_variants_ready)
             order.product_name = order.product.name if order.product else None
             if order.user:
                 order.username = f"{order.user.first_name} {order.user.last_name} "
@@ -211,6 +269,7 @@ class AdminOrderDetailBase(BaseModel):
     image: str | None = None
     address: str | None = None
     total_amount: int | None = None
+    quantity: int | None = None
     user_id: int | None = None
     cancellation_reason: str | None = None
     cancellation_date: datetime | None = None
@@ -226,7 +285,7 @@ class AdminOrderDetailBase(BaseModel):
     @classmethod
     async def get_data(cls, order: Dict[str, Any], db):
         if order and order.product:
-            order.image = order.product.images[0].image_url if order.product.images else None
+            order.image = variant_url(order.product.cover_image_url, "thumb", order.product.cover_variants_ready)
             order.product_name = order.product.name if order.product else None
             if order.user:
                 order.username = f"{order.user.first_name} {order.user.last_name} "
@@ -242,6 +301,7 @@ class LatestOrdersBase(BaseModel):
     product_name: str | None = None
     image: str | None = None
     total_amount: int | None = None
+    quantity: int | None = None
     username: str | None = None
     status: str | None = None
     created_on: datetime | None = None
@@ -252,7 +312,7 @@ class LatestOrdersBase(BaseModel):
     @classmethod
     async def get_data(cls, order: Dict[str, Any]):
         if order and order.product:
-            order.image = order.product.images[0].image_url if order.product.images else None
+            order.image = variant_url(order.product.cover_image_url, "thumb", order.product.cover_variants_ready)
             order.product_name = order.product.name if order.product else None
             if order.user:
                 order.username = f"{order.user.first_name} {order.user.last_name} "
@@ -266,6 +326,7 @@ class UserOrderBase(BaseModel):
     product_name: str | None = None
     address: str | None = None
     total_amount: int | None = None
+    quantity: int | None = None
     user_id: int | None = None
     image: str | None = None
     status: str | None = None
@@ -277,7 +338,7 @@ class UserOrderBase(BaseModel):
     @classmethod
     async def get_image_data(cls, order: Dict[str, Any]):
         if order.product:
-            order.image = order.product.images[0].image_url if order.product.images else None
+            order.image = variant_url(order.product.cover_image_url, "thumb", order.product.cover_variants_ready)
             order.product_name = order.product.name if order.product else None
         return order if order else None
 
@@ -375,6 +436,14 @@ class PageSectionBase(BaseModel):
     page_url: str | None = None
     name: str | None = None
     image_url: str | None = None
+    variants: dict | None = None
+
+
+class FinalizePageSectionBase(BaseModel):
+    key: str
+    page_url: str | None = None
+    name: str | None = None
+    pagesection_id: int | None = None
 
 
 class UserOrderDetailBase(BaseModel):
@@ -384,6 +453,7 @@ class UserOrderDetailBase(BaseModel):
     image: str | None = None
     address: str | None = None
     total_amount: int | None = None
+    quantity: int | None = None
     user_id: int | None = None
     username: str | None = None
     status: str | None = None
@@ -397,7 +467,7 @@ class UserOrderDetailBase(BaseModel):
     @classmethod
     async def get_data(cls, order: Dict[str, Any], db):
         if order and order.product:
-            order.image = order.product.images[0].image_url if order.product.images else None
+            order.image = variant_url(order.product.cover_image_url, "thumb", order.product.cover_variants_ready)
             order.product_name = order.product.name if order.product else None
             if order.user:
                 order.username = f"{order.user.first_name} {order.user.last_name} "
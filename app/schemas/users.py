@@ -20,6 +20,7 @@ class LoginBase(BaseModel):
     email: str
     password: str | None =  None  # Optional for Google login
     access_token: str | None = None # Optional for Oauth2 token
+    cart_token: str | None = None # Guest cart to merge into the user's cart
 
 
 class UserBase(BaseModel):
@@ -0,0 +1,113 @@
+import os
+import sys
+import sqlite3
+import tempfile
+
+import pytest
+
+# The app reads its settings at import time, so they are set before anything from app/ is imported
+TEST_DIR = tempfile.mkdtemp(prefix="alq-tests-")
+TEST_DB = os.path.join(TEST_DIR, "test.db")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{TEST_DB}",
+    "CACHE_BACKEND": "memory",
+    # A statement repeated once per row fails the request instead of only being logged
+    "DB_N_PLUS_ONE_STRICT": "true",
+    "AUTH_SECRET_KEY": "test-secret-key-that-is-long-enough-for-hs256",
+    "AUTH_ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "60",
+    "MAIL_USERNAME": "test", "MAIL_PASSWORD": "test", "MAIL_FROM": "test@example.com",
+    "MAIL_PORT": "587", "MAIL_SERVER": "localhost",
+    "BUCKET_NAME": "test-bucket", "ACCESS_KEY": "test", "SECRET_KEY": "test",
+    "AWS_URL": "https://cdn.example.com", "AWS_DEFAULT_REGION": "us-east-1",
+})
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+sys.path.insert(0, APP_DIR)
+
+from moto import mock_aws
+from fastapi.testclient import TestClient
+
+from main import app
+from models.database import Base, SessionLocal, engine
+from models.users import User
+from crud.auth import get_current_user, hash_password
+from crud.cache import catalog_cache
+from crud.cart import guest_carts
+from crud.file_upload import storage, bucket_name
+from crud.search import search_index
+from crud import response_cache
+
+
+ADMIN = {"id": 1, "email": "admin@example.com", "is_admin": True}
+
+
+@pytest.fixture(scope="session")
+def s3():
+    with mock_aws():
+        storage.client.create_bucket(Bucket=bucket_name)
+        yield storage.client
+
+
+def fail_on_n_plus_one(response):
+    if "X-DB-N-Plus-One" in response.headers:
+        pytest.fail(f"N+1 queries on {response.request.method} {response.request.url.path}")
+
+
+@pytest.fixture(scope="session")
+def app_client(s3):
+    app.dependency_overrides[get_current_user] = lambda: ADMIN
+    with TestClient(app, base_url="http://localhost") as client:
+        # Views turn most exceptions into error responses, the header still shows an N+1 they swallowed
+        client.event_hooks["response"].append(fail_on_n_plus_one)
+        yield client
+    app.dependency_overrides.clear()
+
+
+async def reset_database():
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+
+
+@pytest.fixture
+def client(app_client):
+    """Client on an empty database and empty caches, signed in as ADMIN."""
+    app_client.portal.call(reset_database)
+    for cache in (response_cache.backend, guest_carts):
+        cache.entries.clear()
+        cache.versions.clear()
+        cache.bumped_at.clear()
+    catalog_cache.clear()
+    search_index.mark_stale()
+    return app_client
+
+
+@pytest.fixture
+def run(client):
+    """Run a coroutine function on the app's event loop, where its engine and caches live."""
+    return lambda func, *args: client.portal.call(func, *args)
+
+
+@pytest.fixture
+def db_rows():
+    """Rows of a query straight from the test database, bypassing the app."""
+    def query(sql: str, *params):
+        with sqlite3.connect(TEST_DB) as connection:
+            return connection.execute(sql, params).fetchall()
+    return query
+
+
+@pytest.fixture
+def user(client, run):
+    async def create():
+        async with SessionLocal() as db:
+            db.add(User(email=ADMIN["email"], password=hash_password("password"), is_active=True))
+            await db.commit()
+    run(create)
+    return ADMIN
+
+
+def create_product(client, headers=None, **fields):
+    response = client.post("/product/", json={"name": "Rose", "slug": "rose", "sale_price": 10, **fields}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
@@ -0,0 +1,90 @@
+import csv
+import io
+
+import orjson
+import pytest
+
+from conftest import create_product
+from crud import bulk
+
+
+def import_file(client, content: str, filename="products.csv", **params):
+    response = client.post(
+        "/admin/products/import/", params=params, files={"file": (filename, content.encode(), "text/plain")}
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def products(db_rows):
+    return db_rows("SELECT slug, name, sale_price, category FROM products ORDER BY id")
+
+
+def test_csv_import_creates_updates_and_reports_bad_rows(client, db_rows):
+    create_product(client, name="Rose", slug="rose", sale_price=10, category="Attar")
+
+    report = import_file(client, (
+        "slug,name,sale_price,category\n"
+        "rose,,12,\n"
+        "oud,Oud,40,Attar\n"
+        ",Nameless,5,\n"
+        "mist,Mist,cheap,Spray\n"
+        "amber,Amber,20,Attar\n"
+    ))
+    assert (report["created"], report["updated"]) == (2, 1)
+    assert sorted((error["row"], error["error"].splitlines()[0]) for error in report["errors"]) == [
+        (4, "slug is required"), (5, "1 validation error for ProductActionBase"),
+    ]
+    # Empty cells leave the existing values alone
+    assert products(db_rows) == [("rose", "Rose", 12, "Attar"), ("oud", "Oud", 40, "Attar"), ("amber", "Amber", 20, "Attar")]
+
+
+def test_duplicate_slugs_keep_the_last_row_and_report_the_others(client, db_rows):
+    report = import_file(client, "slug,name\noud,First\nrose,Rose\noud,Second\noud,Third\n")
+
+    assert (report["created"], report["updated"]) == (2, 0)
+    assert report["errors"] == [
+        {"row": 2, "error": "Superseded by row 4 with the same slug"},
+        {"row": 4, "error": "Superseded by row 5 with the same slug"},
+    ]
+    assert [(slug, name) for slug, name, _, _ in products(db_rows)] == [("oud", "Third"), ("rose", "Rose")]
+
+
+def test_ndjson_import_in_batches(client, db_rows, monkeypatch):
+    monkeypatch.setattr(bulk, "BULK_BATCH_SIZE", 2)
+    lines = [
+        {"slug": "rose", "name": "Rose", "category": "Attar"},
+        "not json",
+        {"slug": "oud", "name": "Oud", "category": "Attar"},
+        # Same slug in a later batch is an update of the row the first batch created
+        {"slug": "rose", "sale_price": 15},
+        {"slug": "mist", "name": "Mist", "category": "Spray"},
+    ]
+    content = "\n".join(line if isinstance(line, str) else orjson.dumps(line).decode() for line in lines)
+    report = import_file(client, content, filename="products.ndjson")
+
+    assert (report["created"], report["updated"]) == (3, 1)
+    assert [error["row"] for error in report["errors"]] == [2]
+    assert products(db_rows) == [("rose", "Rose", 15, "Attar"), ("oud", "Oud", 0, "Attar"), ("mist", "Mist", 0, "Spray")]
+    assert {row["category"]: row["product_count"] for row in client.get("/product-categories/").json()} == {"Attar": 2, "Spray": 1}
+
+
+@pytest.mark.parametrize("format", ["csv", "ndjson"])
+def test_export_round_trips_through_import(client, db_rows, format, monkeypatch):
+    monkeypatch.setattr(bulk, "BULK_BATCH_SIZE", 2)
+    for index in range(5):
+        create_product(client, name=f"Rose {index}", slug=f"rose-{index}", category="Attar", in_stock=index)
+
+    response = client.get("/admin/products/export/", params={"format": format})
+    assert response.status_code == 200
+    if format == "csv":
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+    else:
+        rows = [orjson.loads(line) for line in response.text.splitlines()]
+    assert [row["slug"] for row in rows] == [f"rose-{index}" for index in range(5)]
+    assert [str(row["in_stock"]) for row in rows] == [str(index) for index in range(5)]
+
+    before = products(db_rows)
+    report = import_file(client, response.text, filename=f"products.{format}")
+    assert report == {"created": 0, "updated": 5, "errors": []}
+    assert products(db_rows) == before
@@ -0,0 +1,55 @@
+from conftest import create_product
+from crud import bulk
+
+
+def patch(client, items):
+    response = client.patch("/admin/products/bulk/", json=items)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_each_item_gets_its_own_result(client, db_rows):
+    rose = create_product(client, name="Rose", slug="rose", sale_price=10, original_price=15, category="Attar", is_available=True)
+    create_product(client, name="Oud", slug="oud", sale_price=40, category="Attar", is_available=True)
+
+    report = patch(client, [
+        {"id": rose["id"], "sale_price": 12},
+        {"slug": "oud", "in_stock": 7, "is_available": False},
+        {"slug": "missing", "sale_price": 1},
+        {"id": 404, "sale_price": 1},
+        {"sale_price": 1},
+    ])
+    assert report["updated"] == 2
+    assert [(result["index"], result["id"], result["status"]) for result in report["results"]] == [
+        (0, rose["id"], "updated"), (1, 2, "updated"), (2, None, "not_found"), (3, 404, "not_found"), (4, None, "error"),
+    ]
+    assert report["results"][4]["error"] == "id or slug is required"
+
+    # Fields an item leaves out keep their values
+    assert db_rows("SELECT slug, sale_price, original_price, in_stock, is_available FROM products ORDER BY id") == [
+        ("rose", 12, 15, 0, 1), ("oud", 40, 0, 7, 0),
+    ]
+
+
+def test_later_items_for_a_product_override_earlier_ones(client, db_rows, monkeypatch):
+    monkeypatch.setattr(bulk, "BULK_BATCH_SIZE", 2)
+    create_product(client, name="Rose", slug="rose", sale_price=10)
+
+    report = patch(client, [
+        {"slug": "rose", "sale_price": 11, "in_stock": 3},
+        {"id": 1, "sale_price": 12},
+        # Next chunk
+        {"slug": "rose", "in_stock": 5},
+    ])
+    assert [result["status"] for result in report["results"]] == ["updated"] * 3
+    assert db_rows("SELECT sale_price, in_stock FROM products") == [(12, 5)]
+
+
+def test_patch_refreshes_the_catalog_and_category_index(client):
+    create_product(client, name="Rose", slug="rose", sale_price=10, category="Attar")
+    assert client.get("/products-list/").json()[0]["sale_price"] == 10
+
+    patch(client, [{"slug": "rose", "sale_price": 30, "in_stock": 2}])
+    assert client.get("/products-list/").json()[0]["sale_price"] == 30
+    [category] = client.get("/product-categories/").json()
+    assert (category["min_price"], category["in_stock_count"]) == (30, 1)
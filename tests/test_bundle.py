@@ -0,0 +1,67 @@
+import pytest
+
+from conftest import create_product
+from models.database import SessionLocal
+from models.products import ProductImage, RatingReview
+from models.users import User
+
+
+@pytest.fixture
+def product(client, run):
+    rose = create_product(client, category="Attar")
+    for index in range(3):
+        create_product(client, name=f"Oud {index}", slug=f"oud-{index}", category="Attar")
+    create_product(client, name="Mist", slug="mist", category="Spray")
+
+    async def add_images_and_reviews():
+        async with SessionLocal() as db:
+            db.add(ProductImage(product_id=rose["id"], image_url="https://cdn.example.com/media/rose.jpg", variants_ready=True))
+            for index, rating in enumerate([5, 4, 4.4]):
+                user = User(email=f"reviewer{index}@example.com", first_name=f"Reviewer{index}", is_active=True)
+                db.add(user)
+                await db.flush()
+                db.add(RatingReview(product_id=rose["id"], user_id=user.id, rating=rating, reveiew=f"Review {index}"))
+            await db.commit()
+    run(add_images_and_reviews)
+    return rose
+
+
+def test_bundle_has_everything_a_product_page_shows(client, product):
+    response = client.get(f"/product/{product['id']}/bundle")
+    assert response.status_code == 200, response.text
+    bundle = response.json()
+
+    assert bundle["product"]["name"] == "Rose"
+    assert [image["image_url"] for image in bundle["images"]] == ["https://cdn.example.com/media/rose.jpg"]
+    assert bundle["images"][0]["variants"]
+    assert bundle["rating"] == {
+        "average": 4.5, "total_reviews": 3, "breakdown": {"5": 1, "4": 2, "3": 0, "2": 0, "1": 0},
+    }
+    assert [review["review"] for review in bundle["reviews"]] == ["Review 2", "Review 1", "Review 0"]
+    assert [related["name"] for related in bundle["related"]] == ["Oud 2", "Oud 1", "Oud 0"]
+
+
+def test_bundle_takes_five_queries_and_matches_by_slug(client, product):
+    by_id = client.get(f"/product/{product['id']}/bundle")
+    assert by_id.headers["X-DB-Query-Count"] == "5"
+
+    by_slug = client.get("/product/slug/rose/bundle")
+    assert by_slug.json() == by_id.json()
+    assert by_slug.headers["ETag"] == by_id.headers["ETag"]
+
+
+def test_new_review_invalidates_the_bundle(client, user, product):
+    etag = client.get(f"/product/{product['id']}/bundle").headers["ETag"]
+
+    response = client.post("/product/rating/", json={"product_id": product["id"], "rating": 1, "review": "Too strong"})
+    assert response.status_code == 200, response.text
+
+    response = client.get(f"/product/{product['id']}/bundle", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["rating"]["total_reviews"] == 4
+    assert response.json()["reviews"][0]["review"] == "Too strong"
+
+
+def test_unknown_product_is_a_404(client):
+    assert client.get("/product/404/bundle").status_code == 404
+    assert client.get("/product/slug/missing/bundle").status_code == 404
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from conftest import create_product
+from crud.cart import get_or_create_cart_id
+from models.database import SessionLocal
+from models.products import Cart
+
+
+def add_to_cart(client, product_id, quantity=1):
+    response = client.post("/product/add-to-cart/", json={"product_id": product_id, "quantity": quantity})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def cart_count(client):
+    response = client.get("/user/cart/count/")
+    assert response.status_code == 200, response.text
+    return response.json()["count"], response.headers["X-DB-Query-Count"]
+
+
+def test_count_without_a_cart_does_not_create_one(client, user, db_rows):
+    assert cart_count(client) == (0, "1")
+    assert db_rows("SELECT * FROM cart") == []
+
+
+def test_count_is_one_query_and_counts_lines(client, user):
+    rose = create_product(client)
+    oud = create_product(client, name="Oud", slug="oud")
+    add_to_cart(client, rose["id"], quantity=3)
+    add_to_cart(client, oud["id"])
+    assert cart_count(client) == (2, "1")
+
+    client.delete(f"/user/cart/{rose['id']}/")
+    assert cart_count(client) == (1, "1")
+
+
+def set_items(client, items):
+    return client.put("/user/cart/items", json={"items": items})
+
+
+def cart_lines(db_rows):
+    return db_rows("SELECT product_id, quantity FROM product_cart_association ORDER BY product_id")
+
+
+def test_set_items_upserts_and_removes_in_one_request(client, user, db_rows):
+    rose = create_product(client, sale_price=10)
+    oud = create_product(client, name="Oud", slug="oud", sale_price=40)
+    mist = create_product(client, name="Mist", slug="mist", sale_price=25)
+    add_to_cart(client, rose["id"])
+    add_to_cart(client, oud["id"])
+
+    response = set_items(client, [
+        {"product_id": rose["id"], "quantity": 4},
+        {"product_id": mist["id"], "quantity": 1},
+        {"product_id": mist["id"], "quantity": 2},
+        {"product_id": oud["id"], "quantity": 0},
+    ])
+    assert response.status_code == 200, response.text
+    cart = response.json()
+    assert [(product["id"], product["cart_quantity"]) for product in cart["products"]] == [(rose["id"], 4), (mist["id"], 2)]
+    assert (cart["items_count"], cart["total_quantity"], cart["subtotal"]) == (2, 6, 90)
+    assert cart_lines(db_rows) == [(rose["id"], 4), (mist["id"], 2)]
+
+    # The cached cart was invalidated by the write
+    assert client.get("/user/cart/").json() == cart
+
+
+def test_set_items_with_unknown_products_changes_nothing(client, user, db_rows):
+    rose = create_product(client)
+    add_to_cart(client, rose["id"], quantity=2)
+
+    response = set_items(client, [{"product_id": rose["id"], "quantity": 5}, {"product_id": 404}, {"product_id": 405}])
+    assert response.status_code == 404
+    assert response.json()["product_ids"] == [404, 405]
+    assert cart_lines(db_rows) == [(rose["id"], 2)]
+
+
+def test_empty_set_clears_the_cart(client, user, db_rows):
+    rose = create_product(client)
+    add_to_cart(client, rose["id"])
+
+    response = set_items(client, [])
+    assert response.status_code == 200, response.text
+    assert response.json()["products"] == []
+    assert cart_lines(db_rows) == []
+
+
+def test_first_cart_visit_creates_the_cart_with_one_insert(client, user, db_rows):
+    response = client.get("/user/cart/")
+    assert response.status_code == 200, response.text
+    assert response.json()["products"] == []
+    # The cart load, then the insert that creates it
+    assert response.headers["X-DB-Query-Count"] == "2"
+    assert db_rows("SELECT id, user_id FROM cart") == [(response.json()["cart_id"], user["id"])]
+
+
+def test_concurrent_get_or_create_makes_one_cart(client, user, run, db_rows):
+    async def get_or_create():
+        async with SessionLocal() as db:
+            cart_id = await get_or_create_cart_id(db, user["id"])
+            await db.commit()
+            return cart_id
+
+    async def race():
+        return await asyncio.gather(*(get_or_create() for _ in range(5)))
+
+    cart_ids = run(race)
+    assert len(set(cart_ids)) == 1
+    assert db_rows("SELECT id FROM cart") == [(cart_ids[0],)]
+    assert run(get_or_create) == cart_ids[0]
+
+
+def test_cart_user_is_unique(client, user, run):
+    async def add_two():
+        async with SessionLocal() as db:
+            db.add_all([Cart(user_id=user["id"]), Cart(user_id=user["id"])])
+            await db.commit()
+
+    with pytest.raises(IntegrityError):
+        run(add_two)
@@ -0,0 +1,61 @@
+import pytest
+
+from conftest import create_product
+
+
+def categories(client):
+    response = client.get("/product-categories/")
+    assert response.status_code == 200, response.text
+    return {row["category"]: (row["product_count"], row["in_stock_count"], row["min_price"], row["max_price"]) for row in response.json()}
+
+
+def test_category_index_follows_product_writes(client):
+    rose = create_product(client, category="Attar", in_stock=3)
+    create_product(client, name="Oud", slug="oud", category="Attar", sale_price=40)
+    create_product(client, name="Mist", slug="mist", category="Spray", sale_price=25, in_stock=1)
+    assert categories(client) == {"Attar": (2, 1, 10, 40), "Spray": (1, 1, 25, 25)}
+
+    client.patch(f"/product/{rose['id']}/", json={"category": "Spray"})
+    assert categories(client) == {"Attar": (1, 0, 40, 40), "Spray": (2, 2, 10, 25)}
+
+    client.delete(f"/product/{rose['id']}/")
+    client.patch("/product/2/", json={"category": "Spray"})
+    assert categories(client) == {"Spray": (2, 1, 25, 40)}
+
+
+@pytest.fixture
+def catalog(client, db_rows):
+    for index, (category, available, giftset) in enumerate([
+        ("Attar", True, False), ("Attar", True, True), ("Attar", False, False),
+        ("Spray", True, True), ("Spray", False, True),
+    ]):
+        create_product(client, name=f"Rose {index}", slug=f"rose-{index}", category=category, is_available=available)
+        db_rows("UPDATE products SET is_giftset = ? WHERE slug = ?", giftset, f"rose-{index}")
+
+
+def faceted(client, **params):
+    response = client.get("/products/faceted/", params=params)
+    assert response.status_code == 200, response.text
+    body = response.json()
+    return len(body["products"]), body["facets"]
+
+
+def test_facets_without_filters_count_everything(client, catalog):
+    assert faceted(client) == (5, {
+        "category": {"Attar": 3, "Spray": 2},
+        "is_available": {"true": 3, "false": 2},
+        "is_giftset": {"true": 3, "false": 2},
+    })
+
+
+def test_each_facet_ignores_its_own_filter(client, catalog):
+    assert faceted(client, is_available=True) == (3, {
+        "category": {"Attar": 2, "Spray": 1},
+        "is_available": {"true": 3, "false": 2},
+        "is_giftset": {"true": 2, "false": 1},
+    })
+    assert faceted(client, category="Attar", is_giftset=False) == (2, {
+        "category": {"Attar": 2},
+        "is_available": {"true": 1, "false": 1},
+        "is_giftset": {"true": 1, "false": 2},
+    })
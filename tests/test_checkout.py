@@ -0,0 +1,162 @@
+import pytest
+
+from conftest import APP_DIR, create_product
+from crud import products, send_mail
+from models.database import SessionLocal
+from models.products import Promocode
+
+
+class CashfreeResponse:
+    def __init__(self, status_code=200, data=None):
+        self.status_code = status_code
+        self.data = data
+
+    def json(self):
+        if self.data is None:
+            raise ValueError("Expecting value: line 1 column 1 (char 0)")
+        return self.data
+
+
+@pytest.fixture
+def cashfree(monkeypatch):
+    """Record the orders sent to Cashfree and answer with `cashfree.response`, or raise it."""
+    class Cashfree:
+        requests = []
+        response = CashfreeResponse(data={"order_id": "CF-1", "payment_session_id": "session-1"})
+
+        @classmethod
+        def post(cls, url, json, headers, timeout):
+            cls.requests.append(json)
+            if isinstance(cls.response, Exception):
+                raise cls.response
+            return cls.response
+    monkeypatch.setattr(products.requests, "post", Cashfree.post)
+    return Cashfree
+
+
+@pytest.fixture
+def cart(client, user):
+    rose = create_product(client)
+    oud = create_product(client, name="Oud", slug="oud", sale_price=25)
+    response = client.put("/user/cart/items", json={"items": [
+        {"product_id": rose["id"], "quantity": 3}, {"product_id": oud["id"], "quantity": 1},
+    ]})
+    assert response.status_code == 200, response.text
+    return rose, oud
+
+
+@pytest.fixture
+def promocode(run):
+    async def create():
+        async with SessionLocal() as db:
+            db.add(Promocode(promocode="SAVE10", amount=10, available=True, quantity=1))
+            await db.commit()
+    run(create)
+    return "SAVE10"
+
+
+def checkout(client, promocode=None):
+    return client.post("/user/checkout/", json={"customer_phone": "9999999999", "address": "Mumbai", "promocode": promocode})
+
+
+def test_checkout_stores_orders_and_payment(client, cart, cashfree, promocode, db_rows):
+    rose, oud = cart
+    response = checkout(client, promocode)
+    assert response.status_code == 200, response.text
+    assert response.json() == {"session_id": "session-1"}
+
+    orders = db_rows("SELECT id, product_id, quantity, CAST(total_amount AS REAL) FROM orders ORDER BY product_id")
+    assert [order[1:] for order in orders] == [(rose["id"], 3, 30.0), (oud["id"], 1, 25.0)]
+
+    payment = db_rows("SELECT amount_paid, orders, transaction_no FROM payments")
+    assert payment == [(49.5, ",".join(str(order[0]) for order in sorted(orders)), "CF-1")]
+    assert cashfree.requests[-1]["order_amount"] == 49.5
+    assert db_rows("SELECT quantity FROM promocode") == [(0,)]
+
+
+@pytest.mark.parametrize("response", [
+    ConnectionError("connection refused"),
+    CashfreeResponse(400, {"message": "order_amount is invalid"}),
+    CashfreeResponse(502),
+], ids=["unreachable", "refused", "not-json"])
+def test_failed_gateway_call_is_undone(client, cart, cashfree, promocode, db_rows, response):
+    cashfree.response = response
+    failed = checkout(client, promocode)
+    assert failed.status_code in (400, 502)
+
+    assert db_rows("SELECT DISTINCT status FROM orders") == [("FAILED",)]
+    assert db_rows("SELECT status, transaction_no FROM payments") == [("FAILED", None)]
+    assert db_rows("SELECT quantity FROM promocode") == [(1,)]
+
+    # The cart is untouched, so the user can simply try again
+    cashfree.response = CashfreeResponse(data={"order_id": "CF-2", "payment_session_id": "session-2"})
+    assert checkout(client, promocode).json() == {"session_id": "session-2"}
+    assert db_rows("SELECT status, transaction_no FROM payments ORDER BY id") == [("FAILED", None), ("PENDING", "CF-2")]
+    assert db_rows("SELECT quantity FROM promocode") == [(0,)]
+
+
+def test_payment_is_committed_before_the_gateway_call(client, cart, cashfree, promocode, db_rows, monkeypatch):
+    seen = []
+    post = cashfree.post
+
+    def check_committed(url, json, headers, timeout):
+        # Read on a connection of its own, so only committed rows are visible
+        seen.append((
+            db_rows("SELECT id, status FROM payments"),
+            db_rows("SELECT DISTINCT status FROM orders"),
+            db_rows("SELECT quantity FROM promocode"),
+        ))
+        return post(url, json, headers, timeout)
+    monkeypatch.setattr(products.requests, "post", check_committed)
+
+    assert checkout(client, promocode).status_code == 200
+    [(payment_id, _)] = seen[0][0]
+    assert seen == [([(payment_id, "PENDING")], [("PENDING",)], [(0,)])]
+    assert cashfree.requests[-1]["order_tags"] == {"payment_id": str(payment_id)}
+
+
+def test_promocode_is_not_oversold(client, cart, cashfree, promocode, db_rows):
+    assert checkout(client, promocode).status_code == 200
+    refused = checkout(client, promocode)
+    assert refused.status_code == 400
+    assert db_rows("SELECT quantity FROM promocode") == [(0,)]
+    assert db_rows("SELECT COUNT(*) FROM payments") == [(1,)]
+
+
+def test_empty_cart_is_refused(client, user, cashfree):
+    create_product(client)
+    client.put("/user/cart/items", json={"items": []})
+    assert checkout(client).status_code in (400, 404)
+    assert cashfree.requests == []
+
+
+def test_paid_webhook_confirms_the_orders(client, cart, cashfree, db_rows, monkeypatch):
+    sent = []
+
+    async def send_message(self, message):
+        sent.append(message)
+    monkeypatch.setattr(send_mail.FastMail, "send_message", send_message)
+    # The mail templates are looked up relative to app/
+    monkeypatch.chdir(APP_DIR)
+
+    checkout(client)
+    [(payment_id,)] = db_rows("SELECT id FROM payments")
+    response = client.post("/cashfree/webhook/", json={"data": {
+        "order": {"order_tags": {"payment_id": str(payment_id)}},
+        "payment": {"payment_status": "SUCCESS", "payment_time": "2026-10-18T14:05:09+05:30"},
+    }})
+    assert response.status_code == 200, response.text
+
+    assert db_rows("SELECT status, paid_on FROM payments") == [("SUCCESS", "2026-10-18 14:05:09.000000")]
+    assert db_rows("SELECT DISTINCT status FROM orders") == [("SUCCESS",)]
+    assert client.get("/user/cart/").json()["products"] == []
+    assert len(sent) == 1
+
+
+def test_webhook_for_an_unknown_payment_is_ignored(client, db_rows):
+    response = client.post("/cashfree/webhook/", json={"data": {
+        "order": {"order_tags": {"payment_id": "404"}},
+        "payment": {"payment_status": "SUCCESS", "payment_time": "2026-10-18T14:05:09+05:30"},
+    }})
+    assert response.status_code == 200, response.text
+    assert db_rows("SELECT COUNT(*) FROM payment_webhook") == [(1,)]
@@ -0,0 +1,59 @@
+import re
+
+import middlewares
+from conftest import create_product
+from crud.cart import CART_MAX_QUANTITY
+from crud.file_upload import MAX_UPLOAD_SIZE, MB
+
+BOUNDARY = "limit-test"
+
+
+def post_chunked_form(client, path, fields: dict, file_field: str, filename: str, chunks):
+    """POST a multipart form whose file part is `chunks`, from a generator so no Content-Length is sent."""
+    def body():
+        for name, value in fields.items():
+            yield f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        yield (
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n"
+        ).encode()
+        yield from chunks
+        yield f"\r\n--{BOUNDARY}--\r\n".encode()
+
+    return client.post(path, content=body(), headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"})
+
+
+def test_chunked_image_over_the_limit_gets_413(client):
+    product = create_product(client)
+    chunks = (b"\x00" * MB for _ in range(MAX_UPLOAD_SIZE // MB + 2))
+    response = post_chunked_form(client, "/product-image/", {"product_id": product["id"]}, "image", "big.png", chunks)
+    assert response.status_code == 413
+
+
+def test_bulk_import_is_not_held_to_the_image_limit(client, db_rows):
+    # Blank NDJSON lines are skipped, they only make the file bigger than an image may be
+    blank_lines = (b" " * 1023 + b"\n") * 1024
+    chunks = [*(blank_lines for _ in range(MAX_UPLOAD_SIZE // MB + 2)), b'{"slug": "rose", "name": "Rose"}\n']
+    response = post_chunked_form(client, "/admin/products/import/", {}, "file", "products.ndjson", chunks)
+    assert response.status_code == 200, response.text
+    assert response.json() == {"created": 1, "updated": 0, "errors": []}
+
+
+def test_bulk_import_over_its_own_limit_gets_413(client, monkeypatch):
+    monkeypatch.setattr(middlewares, "UPLOAD_LIMITS", [(re.compile(r"/admin/products/import/"), MB)])
+    chunks = (b" " * MB for _ in range(2))
+    response = post_chunked_form(client, "/admin/products/import/", {}, "file", "products.ndjson", chunks)
+    assert response.status_code == 413
+
+
+def test_cart_quantities_are_capped(client, user):
+    product = create_product(client)
+
+    client.put("/user/cart/items", json={"items": [{"product_id": product["id"], "quantity": 10_000}]})
+    client.post("/product/add-to-cart/", json={"product_id": product["id"], "quantity": CART_MAX_QUANTITY})
+    cart = client.get("/user/cart/").json()
+    assert [item["cart_quantity"] for item in cart["products"]] == [CART_MAX_QUANTITY]
+
+    client.post("/product/add-to-cart/", json={"product_id": product["id"], "quantity": -5})
+    cart = client.get("/user/cart/").json()
+    assert [item["cart_quantity"] for item in cart["products"]] == [CART_MAX_QUANTITY]
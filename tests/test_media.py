@@ -0,0 +1,175 @@
+import hashlib
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import create_product
+from crud import media, products
+from crud.file_upload import storage, bucket_name, content_key
+from crud.media import MEDIA_REAP_GRACE, acquire_media, object_keys, reap_media
+from models.database import SessionLocal
+from models.products import MediaObject
+
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+LONG_AGO = datetime.now() - timedelta(seconds=MEDIA_REAP_GRACE + 60)
+
+
+def stored(s3, key):
+    return "Contents" in s3.list_objects_v2(Bucket=bucket_name, Prefix=key)
+
+
+@pytest.fixture
+def add_media(client, run, s3):
+    """Insert a media row, and put its original and variants in the bucket."""
+    def add(name: str, ref_count=0, orphaned_on=LONG_AGO, **fields):
+        key = content_key(hashlib.sha256(name.encode()).hexdigest(), "image/png")
+        for object_key in object_keys(key):
+            s3.put_object(Bucket=bucket_name, Key=object_key, Body=PNG)
+
+        async def insert():
+            async with SessionLocal() as db:
+                db.add(MediaObject(key=key, ref_count=ref_count, orphaned_on=orphaned_on, **fields))
+                await db.commit()
+        run(insert)
+        return key
+    return add
+
+
+def test_reaper_deletes_orphans_past_the_grace_period(add_media, run, s3, db_rows):
+    orphan = add_media("orphan", variants_ready=True)
+    recent = add_media("recent", orphaned_on=datetime.now())
+    referenced = add_media("referenced", ref_count=1, orphaned_on=None)
+
+    assert run(reap_media) == 1
+    assert [key for (key,) in db_rows("SELECT key FROM media_objects ORDER BY id")] == [recent, referenced]
+    assert not any(stored(s3, key) for key in object_keys(orphan))
+    assert stored(s3, recent) and stored(s3, referenced)
+
+
+def test_reaper_keeps_rows_whose_original_could_not_be_deleted(add_media, run, s3, db_rows, monkeypatch):
+    key = add_media("stuck", variants_ready=True)
+
+    async def delete_many(keys):
+        return [key]
+    monkeypatch.setattr(storage, "delete_many", delete_many)
+
+    assert run(reap_media) == 0
+    assert db_rows("SELECT ref_count, variants_ready FROM media_objects WHERE key = ?", key) == [(0, 0)]
+
+
+def test_upload_after_a_reap_stores_the_bytes_again(add_media, run):
+    key = add_media("reused", variants_ready=True)
+    run(reap_media)
+
+    async def acquire():
+        async with SessionLocal() as db:
+            acquired = await acquire_media(db, key)
+            await db.commit()
+            return acquired
+
+    assert run(acquire) == (False, True)
+
+
+def presign(client, product, data=PNG):
+    response = client.post("/admin/uploads/presign/", json={
+        "kind": "product-image", "product_id": product["id"], "sha256": hashlib.sha256(data).hexdigest(),
+        "content_type": "image/png", "size": len(data),
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_presigned_upload_is_recorded_until_finalized(client, s3, db_rows, monkeypatch):
+    monkeypatch.setattr(products, "schedule_stored_variants", lambda *args: None)
+    product = create_product(client)
+    key = presign(client, product)["key"]
+    assert db_rows("SELECT ref_count, pending FROM media_objects WHERE key = ?", key) == [(0, 1)]
+
+    # Finalizing before the upload took place changes nothing
+    response = client.post("/product-image/finalize/", json={"product_id": product["id"], "key": key})
+    assert response.status_code == 404
+    assert db_rows("SELECT ref_count, pending FROM media_objects WHERE key = ?", key) == [(0, 1)]
+
+    s3.put_object(Bucket=bucket_name, Key=key, Body=PNG)
+    response = client.post("/product-image/finalize/", json={"product_id": product["id"], "key": key})
+    assert response.status_code == 200, response.text
+    assert db_rows("SELECT ref_count, pending, orphaned_on FROM media_objects WHERE key = ?", key) == [(1, 0, None)]
+
+    # The bytes are stored now, a second presign skips the upload
+    assert presign(client, product)["exists"] is True
+
+
+def test_abandoned_presigned_upload_is_reaped(client, run, s3, db_rows):
+    product = create_product(client)
+    key = presign(client, product)["key"]
+    s3.put_object(Bucket=bucket_name, Key=key, Body=PNG)
+    db_rows("UPDATE media_objects SET orphaned_on = ?", LONG_AGO)
+
+    assert run(reap_media) == 1
+    assert db_rows("SELECT * FROM media_objects") == []
+    assert not stored(s3, key)
+
+
+@pytest.fixture
+def upload_image(client, monkeypatch):
+    monkeypatch.setattr(products, "schedule_variants", no_variants)
+
+    def upload(product_id, data=PNG):
+        return client.post("/product-image/", data={"product_id": product_id}, files={"image": ("photo.png", data, "image/png")})
+    return upload
+
+
+async def no_variants(*args):
+    pass
+
+
+def test_upload_is_stored_once_and_referenced_per_image(client, s3, db_rows, upload_image, monkeypatch):
+    product = create_product(client)
+    uploads = []
+    upload_to_s3 = media.upload_to_s3
+
+    async def count_uploads(*args):
+        uploads.append(args[1])
+        await upload_to_s3(*args)
+    monkeypatch.setattr(media, "upload_to_s3", count_uploads)
+
+    assert upload_image(product["id"]).status_code == 200
+    assert upload_image(product["id"]).status_code == 200
+
+    key = content_key(hashlib.sha256(PNG).hexdigest(), "image/png")
+    assert uploads == [key.removeprefix("media/")]
+    assert stored(s3, key)
+    assert db_rows("SELECT ref_count, pending, orphaned_on FROM media_objects") == [(2, 0, None)]
+
+
+def test_upload_whose_reference_is_not_committed_is_reaped(client, run, s3, db_rows, upload_image, monkeypatch):
+    product = create_product(client)
+
+    async def fail(*args):
+        raise RuntimeError("database went away")
+    monkeypatch.setattr(products, "sync_product_cover", fail)
+
+    assert upload_image(product["id"]).status_code == 400
+    key = content_key(hashlib.sha256(PNG).hexdigest(), "image/png")
+    assert stored(s3, key)
+    assert db_rows("SELECT ref_count, pending FROM media_objects") == [(0, 1)]
+
+    db_rows("UPDATE media_objects SET orphaned_on = ?", LONG_AGO)
+    assert run(reap_media) == 1
+    assert not stored(s3, key)
+
+
+def test_failed_upload_leaves_a_row_for_the_reaper(client, run, db_rows, upload_image, monkeypatch):
+    product = create_product(client)
+
+    async def fail(*args):
+        raise RuntimeError("S3 unavailable")
+    monkeypatch.setattr(media, "upload_to_s3", fail)
+
+    assert upload_image(product["id"]).status_code == 400
+    assert db_rows("SELECT ref_count, pending FROM media_objects") == [(0, 1)]
+    assert db_rows("SELECT * FROM product_images") == []
+
+    db_rows("UPDATE media_objects SET orphaned_on = ?", LONG_AGO)
+    assert run(reap_media) == 1
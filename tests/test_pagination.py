@@ -0,0 +1,51 @@
+import pytest
+
+from conftest import create_product
+
+
+def walk(client, path, **params):
+    """Ids of every page of `path`, following X-Next-Cursor until it is gone."""
+    pages = []
+    cursor = None
+    while True:
+        response = client.get(path, params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200, response.text
+        pages.append([row["id"] for row in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return pages
+
+
+@pytest.fixture
+def products(client):
+    return [create_product(client, name=f"Rose {index}", slug=f"rose-{index}")["id"] for index in range(7)]
+
+
+@pytest.mark.parametrize("path", ["/admin-dashboard/products-list/", "/products-list/"])
+def test_pages_follow_the_cursor_newest_first(client, products, path):
+    pages = walk(client, path, limit=3)
+    newest_first = sorted(products, reverse=True)
+    assert pages == [newest_first[:3], newest_first[3:6], newest_first[6:]]
+
+    # A second walk is served from the response cache where there is one, with the same cursors
+    assert walk(client, path, limit=3) == pages
+
+
+def test_rows_added_meanwhile_do_not_shift_later_pages(client, products):
+    first = client.get("/admin-dashboard/products-list/", params={"limit": 3})
+    create_product(client, name="Oud", slug="oud")
+
+    second = client.get("/admin-dashboard/products-list/", params={"limit": 3, "cursor": first.headers["X-Next-Cursor"]})
+    assert [row["id"] for row in second.json()] == sorted(products, reverse=True)[3:6]
+
+
+def test_total_count_is_only_sent_when_asked_for(client, products):
+    assert "X-Total-Count" not in client.get("/admin-dashboard/products-list/").headers
+    response = client.get("/admin-dashboard/products-list/", params={"with_total": True, "limit": 2})
+    assert response.headers["X-Total-Count"] == "7"
+    assert len(response.json()) == 2
+
+
+def test_invalid_cursor_is_refused(client):
+    assert client.get("/admin-dashboard/products-list/", params={"cursor": "not-a-cursor"}).status_code == 400
+    assert client.get("/admin-dashboard/products-list/", params={"limit": 0}).status_code == 422
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+from sqlalchemy import exc, text
+
+from conftest import TEST_DIR
+from models.database import build_engine
+from models.pool import PoolMetrics
+
+
+def test_wait_histogram_and_checkout_percentiles():
+    metrics = PoolMetrics()
+    for seconds in (0.0005, 0.003, 0.003, 0.2, 9):
+        metrics.record_wait(seconds)
+    for ms in range(1, 101):
+        metrics.record_checkout_duration(ms / 1000)
+
+    histogram = metrics.histogram()
+    assert (histogram["<=1ms"], histogram["<=5ms"], histogram["<=250ms"], histogram[">5000ms"]) == (1, 2, 1, 1)
+    assert sum(histogram.values()) == 5
+    assert metrics.checkouts == 100
+    assert metrics.percentiles() == {"p50": 51.0, "p90": 91.0, "p99": 100.0, "max": 100.0}
+
+
+def test_pool_stats_endpoint_counts_checkouts(client):
+    before = client.get("/admin/db/pool-stats/").json()["primary"]
+    client.get("/products-list/")
+    after = client.get("/admin/db/pool-stats/").json()
+
+    assert after["replicas"] == []
+    assert after["primary"]["pool_size"] == int(os.environ.get("DB_POOL_SIZE", 5))
+    assert after["primary"]["checked_out"] == 0
+    assert after["primary"]["total_checkouts"] > before["total_checkouts"]
+
+
+def test_exhausted_pool_times_out_and_is_counted(run, monkeypatch):
+    monkeypatch.setenv("DB_POOL_SIZE", "1")
+    monkeypatch.setenv("DB_MAX_OVERFLOW", "0")
+    monkeypatch.setenv("DB_POOL_TIMEOUT", "0.1")
+    small = build_engine(f"sqlite:///{os.path.join(TEST_DIR, 'pool.db')}")
+
+    async def hold_and_wait():
+        try:
+            async with small.connect() as held:
+                await held.execute(text("SELECT 1"))
+                with pytest.raises(exc.TimeoutError):
+                    async with small.connect():
+                        pass
+            return small.sync_engine.pool.stats()
+        finally:
+            await small.dispose()
+
+    stats = run(hold_and_wait)
+    assert stats["timeouts"] == 1
+    assert stats["checked_out"] == 0
+    assert stats["total_checkouts"] == 1
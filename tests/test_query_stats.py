@@ -0,0 +1,46 @@
+import pytest
+from sqlalchemy import select
+
+from conftest import create_product
+from models.database import SessionLocal
+from models.products import Product
+from models.query_stats import N_PLUS_ONE_THRESHOLD, NPlusOneError, start_query_stats, statement_shape, stop_query_stats
+
+
+def test_in_lists_of_any_length_share_a_shape():
+    assert statement_shape("SELECT * FROM products\n WHERE id IN (?, ?, ?)") == statement_shape(
+        "SELECT * FROM products WHERE id IN (?)"
+    )
+    assert statement_shape("SELECT 1") != statement_shape("SELECT 2")
+
+
+def test_strict_mode_raises_on_a_repeated_statement(run):
+    async def load_one_by_one():
+        stats, token = start_query_stats()
+        try:
+            async with SessionLocal() as db:
+                for product_id in range(N_PLUS_ONE_THRESHOLD + 1):
+                    await db.scalar(select(Product).where(Product.id == product_id))
+        finally:
+            stop_query_stats(token)
+
+    with pytest.raises(NPlusOneError):
+        run(load_one_by_one)
+
+
+@pytest.mark.parametrize("path", ["/products-list/", "/admin-dashboard/products-list/?get_image=true", "/user/cart/"])
+def test_listings_take_a_fixed_number_of_queries(client, user, path):
+    def query_count():
+        # Called right after a write, so the response cache never answers it
+        response = client.get(path)
+        assert response.status_code == 200, response.text
+        return int(response.headers["X-DB-Query-Count"])
+
+    first = create_product(client)
+    client.post("/product/add-to-cart/", json={"product_id": first["id"]})
+    few = query_count()
+
+    for index in range(2 * N_PLUS_ONE_THRESHOLD):
+        product = create_product(client, name=f"Rose {index}", slug=f"rose-{index}")
+        client.post("/product/add-to-cart/", json={"product_id": product["id"]})
+    assert query_count() == few
@@ -0,0 +1,110 @@
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+from conftest import TEST_DIR, create_product
+from crud import cache, response_cache
+from crud.auth import create_access_token
+from models import database
+from models.database import Base, SessionLocal, build_engine
+from models.products import Product
+
+
+def bearer(user_id):
+    return {"Authorization": f"Bearer {create_access_token(data={'sub': 'user@example.com', 'id': str(user_id)})}"}
+
+
+def product_names(client, headers=None):
+    response = client.get("/admin-dashboard/products-list/", headers=headers)
+    assert response.status_code == 200, response.text
+    return [product["name"] for product in response.json()]
+
+
+@pytest.fixture
+def replicas(client, run, monkeypatch):
+    """Two replica databases that never catch up, each holding a product the primary does not have."""
+    engines = [build_engine(f"sqlite:///{os.path.join(TEST_DIR, f'replica-{index}.db')}") for index in range(2)]
+
+    async def reset():
+        for index, replica in enumerate(engines):
+            async with replica.begin() as connection:
+                await connection.run_sync(Base.metadata.drop_all)
+                await connection.run_sync(Base.metadata.create_all)
+                await connection.execute(Product.__table__.insert().values(name=f"Replica {index}", slug=f"replica-{index}"))
+    run(reset)
+    monkeypatch.setattr(database, "replica_engines", engines)
+    yield engines
+
+    async def dispose():
+        for replica in engines:
+            await replica.dispose()
+    run(dispose)
+
+
+def test_reads_go_to_a_replica_and_writes_to_the_primary(client, replicas, db_rows):
+    assert product_names(client)[0].startswith("Replica")
+
+    create_product(client)
+    assert db_rows("SELECT name FROM products") == [("Rose",)]
+    assert product_names(client)[0].startswith("Replica")
+
+
+def test_writer_reads_the_primary_until_the_pin_expires(client, replicas, monkeypatch):
+    create_product(client, headers=bearer(1))
+
+    assert product_names(client, bearer(1)) == ["Rose"]
+    # Other users and anonymous clients are not pinned by it
+    assert product_names(client, bearer(2))[0].startswith("Replica")
+    assert product_names(client)[0].startswith("Replica")
+
+    later = time.monotonic() + database.READ_YOUR_WRITES_SECONDS + 1
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=lambda: later))
+    assert product_names(client, bearer(1))[0].startswith("Replica")
+
+
+def test_a_session_reads_from_one_replica(replicas, run):
+    async def read_names():
+        async with SessionLocal() as db:
+            db.info["use_replica"] = True
+            names = {(await db.scalars(select(Product.name))).one() for _ in range(20)}
+
+            # After a write the session stays on the primary
+            db.add(Product(name="Rose", slug="rose"))
+            await db.flush()
+            written = (await db.scalars(select(Product.name).order_by(Product.id))).all()
+            await db.rollback()
+            return names, written
+
+    for _ in range(5):
+        names, written = run(read_names)
+        assert len(names) == 1
+        assert written == ["Rose"]
+
+
+def test_cache_fills_right_after_an_invalidation_read_the_primary(client, replicas, monkeypatch):
+    def listing():
+        response = client.get("/products-list/")
+        return [product["name"] for product in response.json()], int(response.headers["X-DB-Query-Count"])
+
+    assert listing()[0][0].startswith("Replica")
+
+    # The replicas never get the new product, the entry stored after the write must still have it
+    create_product(client)
+    assert listing()[0] == ["Rose"]
+    assert listing() == (["Rose"], 0)
+
+    later = time.monotonic() + database.READ_YOUR_WRITES_SECONDS + 1
+    monkeypatch.setattr(response_cache, "time", SimpleNamespace(monotonic=lambda: later))
+    assert listing() == (["Rose"], 0)
+
+
+@pytest.mark.parametrize("backend", [response_cache.MemoryBackend(), response_cache.RedisBackend(response_cache.FakeRedis())])
+def test_backends_report_recent_bumps(run, backend):
+    async def bump_and_check():
+        await backend.bump_versions(["products"])
+        return await backend.recently_bumped(["products", "reviews"]), await backend.recently_bumped(["reviews"])
+
+    assert run(bump_and_check) == (True, False)
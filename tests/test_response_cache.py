@@ -0,0 +1,90 @@
+from conftest import create_product
+from crud import response_cache
+from crud.cache import catalog_cache
+
+
+def query_count(response):
+    return int(response.headers["X-DB-Query-Count"])
+
+
+def test_listing_is_served_from_cache_until_a_product_write(client):
+    product = create_product(client)
+
+    first = client.get("/products-list/")
+    assert first.status_code == 200
+    assert query_count(first) > 0
+
+    cached = client.get("/products-list/")
+    assert cached.json() == first.json()
+    assert query_count(cached) == 0
+
+    client.patch(f"/product/{product['id']}/", json={"name": "Oud"})
+    changed = client.get("/products-list/")
+    assert [item["name"] for item in changed.json()] == ["Oud"]
+    assert query_count(changed) > 0
+
+
+def test_matching_etag_gets_304_without_queries(client):
+    create_product(client)
+    etag = client.get("/products-list/").headers["ETag"]
+
+    response = client.get("/products-list/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert query_count(response) == 0
+
+
+def test_etag_changes_with_the_content(client):
+    product = create_product(client)
+    etag = client.get("/products-list/").headers["ETag"]
+
+    client.patch(f"/product/{product['id']}/", json={"sale_price": 12})
+    response = client.get("/products-list/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_etag_does_not_depend_on_cache_state(client, db_rows):
+    create_product(client)
+    etag = client.get("/products-list/").headers["ETag"]
+
+    # A fresh worker, or this one after a restart, has no cache entries or tag versions
+    response_cache.backend.entries.clear()
+    response_cache.backend.versions.clear()
+    catalog_cache.clear()
+    assert client.get("/products-list/", headers={"If-None-Match": etag}).status_code == 304
+
+    # A write handled by another worker never bumped a version here
+    db_rows("UPDATE products SET name = 'Oud'")
+    response_cache.backend.entries.clear()
+    catalog_cache.clear()
+    response = client.get("/products-list/", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()[0]["name"] == "Oud"
+
+
+def test_user_cart_is_invalidated_by_cart_writes(client):
+    product = create_product(client)
+    assert client.get("/user/cart/").json()["products"] == []
+
+    client.put("/user/cart/items", json={"items": [{"product_id": product["id"], "quantity": 2}]})
+    cart = client.get("/user/cart/").json()
+    assert [(item["id"], item["cart_quantity"]) for item in cart["products"]] == [(product["id"], 2)]
+
+    cached = client.get("/user/cart/")
+    assert cached.json() == cart
+    assert query_count(cached) == 0
+
+    client.delete(f"/user/cart/{product['id']}/")
+    assert client.get("/user/cart/").json()["products"] == []
+
+
+def test_tag_versions_expire(client, run, monkeypatch):
+    backend = response_cache.MemoryBackend()
+    monkeypatch.setattr(response_cache, "TAG_VERSION_TTL", 0)
+
+    async def bump_and_read():
+        await backend.bump_versions(["cart:1"])
+        return await backend.get_versions(["cart:1"])
+
+    assert run(bump_and_read) == [0]
@@ -0,0 +1,85 @@
+import asyncio
+
+from conftest import create_product
+from crud.search import ProductSearchIndex, get_search_index, search_index
+from models.database import SessionLocal
+
+
+def search(client, q, **params):
+    response = client.get("/products/search", params={"q": q, **params})
+    assert response.status_code == 200, response.text
+    return [product["name"] for product in response.json()]
+
+
+def test_name_matches_rank_above_category_and_description(client):
+    create_product(client, name="Amber Mist", slug="amber", description="A hint of rose")
+    create_product(client, name="Velvet", slug="velvet", category="Rose")
+    create_product(client, name="Rose Oud", slug="rose-oud", description="Rose and oud")
+
+    assert search(client, "rose") == ["Rose Oud", "Velvet", "Amber Mist"]
+
+
+def test_misspelt_and_partial_words_still_match(client):
+    create_product(client, name="Oud Royale", slug="oud-royale")
+    create_product(client, name="Musk", slug="musk")
+
+    assert search(client, "oudh") == ["Oud Royale"]
+    assert search(client, "roy") == ["Oud Royale"]
+    assert search(client, "vanilla") == []
+
+
+def test_every_word_has_to_match(client):
+    create_product(client, name="Rose Oud", slug="rose-oud", category="Attar")
+    create_product(client, name="Rose Musk", slug="rose-musk", category="Attar")
+
+    assert search(client, "rose musk") == ["Rose Musk"]
+    assert search(client, "rose", category="Attar", limit=1) == ["Rose Musk"]
+
+
+def test_writes_are_searchable_right_away(client):
+    create_product(client, name="Rose", slug="rose")
+    assert search(client, "jasmine") == []
+
+    create_product(client, name="Jasmine", slug="jasmine")
+    assert search(client, "jasmine") == ["Jasmine"]
+
+
+def test_concurrent_searches_share_one_build(client, run, monkeypatch):
+    create_product(client)
+    builds = []
+    build = ProductSearchIndex.build
+
+    async def slow_build(self, db):
+        builds.append(db)
+        await asyncio.sleep(0.05)
+        await build(self, db)
+    monkeypatch.setattr(ProductSearchIndex, "build", slow_build)
+
+    async def search_concurrently():
+        async def lookup():
+            async with SessionLocal() as db:
+                return (await get_search_index(db)).search("rose")
+        return await asyncio.gather(*(lookup() for _ in range(5)))
+
+    search_index.mark_stale()
+    assert run(search_concurrently) == [[1]] * 5
+    assert len(builds) == 1
+
+
+def test_a_write_during_a_build_leaves_the_index_stale(run):
+    index = ProductSearchIndex()
+
+    async def build_with_a_write():
+        async with SessionLocal() as db:
+            # A write lands between the build reading products and swapping its result in
+            original = db.execute
+
+            async def execute(*args, **kwargs):
+                result = await original(*args, **kwargs)
+                index.mark_stale()
+                return result
+            db.execute = execute
+            await index.build(db)
+            return index.is_stale()
+
+    assert run(build_with_a_write) is True